@@ -33,10 +33,19 @@ setup(
         "image_dataset_converter",
         "kasperl_redis",
     ],
+    extras_require={
+        "compression": ["lz4", "zstandard"],
+        "test": ["pytest", "fakeredis"],
+    },
     version="0.1.0",
     author='Peter Reutemann',
     author_email='fracpete@waikato.ac.nz',
     entry_points={
+        "console_scripts": [
+            "idc-redis-benchmark=idc.redis.tool.benchmark:sys_main",
+            "idc-redis-stand-in=idc.redis.tool.stand_in:sys_main",
+            "idc-redis-load=idc.redis.tool.load:sys_main",
+        ],
         "class_lister": [
             "idc.redis=idc.redis.class_lister",
         ],
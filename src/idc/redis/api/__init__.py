@@ -0,0 +1,14 @@
+from ._stats import STAGE_ENCODE, STAGE_PUBLISH, STAGE_WAIT, STAGE_POLL, STAGE_DECODE, STAGE_BUILD, STAGE_SERIALIZE
+from ._stats import STAGE_COMPRESS, STAGE_DECOMPRESS, STAGE_JOURNAL, STAGE_DEDUP, STAGE_STORE
+from ._stats import EXPORT_PROMETHEUS, EXPORT_STATSD, EXPORTS
+from ._stats import Histogram, StageStats, StatsExporter, StatsReporter, timed, add_stats_options, create_stats_reporter
+from ._circuit import CIRCUIT_CLOSED, CIRCUIT_OPEN, CIRCUIT_HALF_OPEN, CircuitBreaker, AdaptiveTimeout
+from ._utils import load_npy_from_bytes, resize_bilinear
+from ._connections import SharedPubSub, SharedClient, set_connection_factory, acquire_client, release_client, add_unix_socket_option
+from ._compression import COMPRESSION_NONE, COMPRESSION_LZ4, COMPRESSION_ZSTD, COMPRESSIONS, COMPRESSION_MAGIC
+from ._compression import Compressor, is_compressed, add_compression_options, create_compressor
+from ._journal import JOURNAL_SQLITE, JOURNAL_REDIS, JOURNALS, Journal, SqliteJournal, RedisJournal
+from ._journal import journal_key, add_journal_options, create_journal
+from ._image_refs import KEY_IMAGE_REF, DEFAULT_IMAGE_REF_PREFIX, DEFAULT_IMAGE_REF_TTL, image_ref_key, store_image_ref, fetch_image_ref
+from ._shutdown import DEFAULT_DRAIN_TIMEOUT, install_shutdown_handler, request_shutdown, reset_shutdown, shutdown_requested, drain_remaining
+from ._shutdown import add_shutdown_callback, remove_shutdown_callback, register_drain_source, unregister_drain_source, has_drain_sources, add_drain_option
@@ -0,0 +1,139 @@
+import logging
+from collections import deque
+from time import perf_counter
+from typing import Optional
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half-open"
+
+
+class CircuitBreaker:
+    """
+    Keeps track of consecutive timeouts. Once the threshold has been reached, the circuit opens
+    and requests fail fast. After the probe interval, a single request is let through (half-open)
+    to probe whether the backend is available again.
+    """
+
+    def __init__(self, threshold: int, probe_interval: float, logger: logging.Logger = None):
+        """
+        Initializes the circuit breaker.
+
+        :param threshold: the number of consecutive timeouts after which to open the circuit
+        :type threshold: int
+        :param probe_interval: the time in seconds after which to probe the backend again when open
+        :type probe_interval: float
+        :param logger: the optional logger for outputting state changes
+        :type logger: logging.Logger
+        """
+        self.threshold = threshold
+        self.probe_interval = probe_interval
+        self.logger = logger
+        self.state = CIRCUIT_CLOSED
+        self.consecutive_timeouts = 0
+        self.num_rejected = 0
+        self._opened = None
+
+    def allow_request(self) -> bool:
+        """
+        Returns whether a request can be made.
+
+        :return: True if the request can be made, False if it should fail fast
+        :rtype: bool
+        """
+        if self.state == CIRCUIT_CLOSED:
+            return True
+        if (self.state == CIRCUIT_OPEN) and (perf_counter() - self._opened >= self.probe_interval):
+            self.state = CIRCUIT_HALF_OPEN
+            if self.logger is not None:
+                self.logger.info("Circuit half-open, probing backend")
+            return True
+        self.num_rejected += 1
+        return False
+
+    def record_success(self):
+        """
+        Records a successful request, closing the circuit if necessary.
+        """
+        self.consecutive_timeouts = 0
+        if self.state != CIRCUIT_CLOSED:
+            self.state = CIRCUIT_CLOSED
+            if self.logger is not None:
+                self.logger.warning("Circuit closed, backend available again (rejected requests: %d)" % self.num_rejected)
+            self.num_rejected = 0
+
+    def record_timeout(self):
+        """
+        Records a timed out request, opening the circuit if necessary.
+        """
+        self.consecutive_timeouts += 1
+        if (self.state == CIRCUIT_HALF_OPEN) or (self.consecutive_timeouts >= self.threshold):
+            if (self.state == CIRCUIT_CLOSED) and (self.logger is not None):
+                self.logger.warning("Circuit opened after %d consecutive timeouts" % self.consecutive_timeouts)
+            self.state = CIRCUIT_OPEN
+            self._opened = perf_counter()
+
+
+class AdaptiveTimeout:
+    """
+    Derives the timeout from the p99 of the recently observed round trip times.
+    Timeouts don't produce round trip times, so each timeout doubles the timeout
+    (up to the maximum) and discards the samples collected so far.
+    """
+
+    def __init__(self, factor: float, minimum: float, maximum: float, window: int = 100, min_samples: int = 20):
+        """
+        Initializes the timeout.
+
+        :param factor: the factor to multiply the p99 with
+        :type factor: float
+        :param minimum: the minimum timeout in seconds
+        :type minimum: float
+        :param maximum: the maximum timeout in seconds, also used until enough samples have been collected
+        :type maximum: float
+        :param window: the number of recent round trip times to use
+        :type window: int
+        :param min_samples: the minimum number of samples before adapting the timeout
+        :type min_samples: int
+        """
+        self.factor = factor
+        self.minimum = minimum
+        self.maximum = maximum
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._current: Optional[float] = None
+        self._backoff: Optional[float] = None
+
+    def add(self, duration: float):
+        """
+        Adds the round trip time.
+
+        :param duration: the time in seconds
+        :type duration: float
+        """
+        self._samples.append(duration)
+        self._current = None
+
+    def record_timeout(self):
+        """
+        Records a timeout: doubles the current timeout (capped by the maximum), which gets used
+        until enough new round trip times have been collected.
+        """
+        self._backoff = min(self.maximum, self.current() * 2)
+        self._samples.clear()
+        self._current = None
+
+    def current(self) -> float:
+        """
+        Returns the current timeout.
+
+        :return: the timeout in seconds
+        :rtype: float
+        """
+        if len(self._samples) < self.min_samples:
+            return self.maximum if (self._backoff is None) else self._backoff
+        if self._current is None:
+            samples = sorted(self._samples)
+            p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+            self._current = min(self.maximum, max(self.minimum, p99 * self.factor))
+        return self._current
@@ -0,0 +1,170 @@
+import argparse
+from typing import Optional, Union
+
+COMPRESSION_NONE = "none"
+COMPRESSION_LZ4 = "lz4"
+COMPRESSION_ZSTD = "zstd"
+COMPRESSIONS = [
+    COMPRESSION_NONE,
+    COMPRESSION_LZ4,
+    COMPRESSION_ZSTD,
+]
+
+COMPRESSION_MAGIC = b"\x89IDZ"
+""" the header that identifies compressed payloads, followed by the codec byte """
+
+CODEC_IDS = {
+    COMPRESSION_LZ4: 1,
+    COMPRESSION_ZSTD: 2,
+}
+
+DEFAULT_MIN_SIZE = 1024
+
+
+def _import_codec(codec: str):
+    """
+    Imports the library for the codec.
+
+    :param codec: the codec to import the library for
+    :type codec: str
+    :return: the module
+    """
+    if codec == COMPRESSION_LZ4:
+        try:
+            import lz4.frame
+            return lz4.frame
+        except ImportError:
+            raise Exception("The lz4 library is not installed, please install it with: pip install lz4")
+    elif codec == COMPRESSION_ZSTD:
+        try:
+            import zstandard
+            return zstandard
+        except ImportError:
+            raise Exception("The zstandard library is not installed, please install it with: pip install zstandard")
+    else:
+        raise Exception("Unsupported compression: %s" % codec)
+
+
+def is_compressed(data: Union[bytes, memoryview]) -> bool:
+    """
+    Checks whether the payload has the compression header.
+
+    :param data: the payload to check
+    :type data: bytes or memoryview
+    :return: True if compressed
+    :rtype: bool
+    """
+    return (len(data) > len(COMPRESSION_MAGIC)) and (data[:len(COMPRESSION_MAGIC)] == COMPRESSION_MAGIC)
+
+
+class Compressor:
+    """
+    Compresses payloads with the specified codec, prefixing them with a header that identifies the codec.
+    Payloads are decompressed based on their header, independent of the compressor's codec.
+    """
+
+    def __init__(self, codec: str = COMPRESSION_NONE, level: int = None, min_size: int = DEFAULT_MIN_SIZE):
+        """
+        Initializes the compressor.
+
+        :param codec: the codec to use for compressing, see COMPRESSIONS
+        :type codec: str
+        :param level: the compression level, uses the default of the codec if None
+        :type level: int
+        :param min_size: the minimum size in bytes for payloads to get compressed
+        :type min_size: int
+        """
+        if codec not in COMPRESSIONS:
+            raise Exception("Unsupported compression: %s" % codec)
+        self.codec = codec
+        self.level = level
+        self.min_size = min_size
+        self._compressor = None
+        if codec == COMPRESSION_LZ4:
+            self._compressor = _import_codec(codec)
+        elif codec == COMPRESSION_ZSTD:
+            zstandard = _import_codec(codec)
+            self._compressor = zstandard.ZstdCompressor(level=3 if (level is None) else level)
+        self._decompressors = dict()
+        self._header = b"" if (codec == COMPRESSION_NONE) else (COMPRESSION_MAGIC + bytes([CODEC_IDS[codec]]))
+
+    @property
+    def enabled(self) -> bool:
+        """
+        Returns whether compression is enabled.
+
+        :return: True if enabled
+        :rtype: bool
+        """
+        return self._compressor is not None
+
+    def compress(self, data: Union[bytes, str]) -> bytes:
+        """
+        Compresses the payload, if compression is enabled and the payload is large enough.
+
+        :param data: the payload to compress
+        :type data: bytes or str
+        :return: the (compressed) payload
+        :rtype: bytes
+        """
+        if self._compressor is None:
+            return data
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if len(data) < self.min_size:
+            return data
+        if self.codec == COMPRESSION_LZ4:
+            return self._header + self._compressor.compress(data, compression_level=0 if (self.level is None) else self.level)
+        else:
+            return self._header + self._compressor.compress(data)
+
+    def decompress(self, data: Union[bytes, memoryview]) -> Union[bytes, memoryview]:
+        """
+        Decompresses the payload if it has the compression header, otherwise returns it as is.
+
+        :param data: the payload to decompress
+        :type data: bytes or memoryview
+        :return: the decompressed payload
+        :rtype: bytes or memoryview
+        """
+        if not is_compressed(data):
+            return data
+        codec_id = data[len(COMPRESSION_MAGIC)]
+        body = memoryview(data)[len(COMPRESSION_MAGIC) + 1:]
+        if codec_id == CODEC_IDS[COMPRESSION_LZ4]:
+            return _import_codec(COMPRESSION_LZ4).decompress(body)
+        elif codec_id == CODEC_IDS[COMPRESSION_ZSTD]:
+            if COMPRESSION_ZSTD not in self._decompressors:
+                self._decompressors[COMPRESSION_ZSTD] = _import_codec(COMPRESSION_ZSTD).ZstdDecompressor()
+            return self._decompressors[COMPRESSION_ZSTD].decompress(body)
+        else:
+            raise Exception("Unsupported compression codec ID: %d" % codec_id)
+
+
+def add_compression_options(parser: argparse.ArgumentParser):
+    """
+    Adds the options for compressing payloads to the parser.
+
+    :param parser: the parser to add the options to
+    :type parser: argparse.ArgumentParser
+    """
+    parser.add_argument("--compression", choices=COMPRESSIONS, type=str, default=COMPRESSION_NONE, help="The codec to compress the outgoing payloads with (requires the lz4/zstandard library); compressed incoming payloads are detected automatically.", required=False)
+    parser.add_argument("--compression_level", metavar="LEVEL", type=int, default=None, help="The compression level, uses the default of the codec if omitted.", required=False)
+    parser.add_argument("--compression_min_size", metavar="BYTES", type=int, default=DEFAULT_MIN_SIZE, help="The minimum size in bytes for payloads to get compressed.", required=False)
+
+
+def create_compressor(codec: Optional[str], level: int = None, min_size: int = None) -> Compressor:
+    """
+    Creates the compressor.
+
+    :param codec: the codec to use, see COMPRESSIONS, None for no compression
+    :type codec: str
+    :param level: the compression level, uses the default of the codec if None
+    :type level: int
+    :param min_size: the minimum size in bytes for payloads to get compressed, uses the default if None
+    :type min_size: int
+    :return: the compressor
+    :rtype: Compressor
+    """
+    return Compressor(codec=COMPRESSION_NONE if (codec is None) else codec, level=level,
+                      min_size=DEFAULT_MIN_SIZE if (min_size is None) else min_size)
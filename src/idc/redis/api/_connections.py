@@ -0,0 +1,227 @@
+import argparse
+import functools
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import redis
+
+DEFAULT_SLEEP_TIME = 0.01
+
+
+class SharedPubSub:
+    """
+    Multiplexes the pattern subscriptions of several handlers over a single
+    pubsub connection with a single worker thread.
+    """
+
+    def __init__(self, connection: redis.Redis, sleep_time: float = DEFAULT_SLEEP_TIME):
+        """
+        Initializes the pubsub.
+
+        :param connection: the connection to create the pubsub from
+        :type connection: redis.Redis
+        :param sleep_time: the time in seconds to block when waiting for messages in the worker thread
+        :type sleep_time: float
+        """
+        self.connection = connection
+        self.sleep_time = sleep_time
+        self._pubsub = connection.pubsub(ignore_subscribe_messages=True)
+        self._handlers: Dict[str, List[Callable]] = dict()
+        self._lock = threading.RLock()
+        self._thread = None
+
+    def _dispatch(self, pattern: str, message: Dict):
+        """
+        Forwards the message to all the handlers of the pattern.
+
+        :param pattern: the pattern the message was received for
+        :type pattern: str
+        :param message: the message
+        :type message: dict
+        """
+        with self._lock:
+            handlers = list(self._handlers.get(pattern, []))
+        for handler in handlers:
+            handler(message)
+
+    def subscribe(self, pattern: str, handler: Callable):
+        """
+        Subscribes the handler to the pattern.
+
+        :param pattern: the pattern to subscribe to
+        :type pattern: str
+        :param handler: the handler to receive the messages
+        """
+        with self._lock:
+            if pattern not in self._handlers:
+                self._handlers[pattern] = []
+                self._pubsub.psubscribe(**{pattern: functools.partial(self._dispatch, pattern)})
+            self._handlers[pattern].append(handler)
+            if self._thread is None:
+                self._thread = self._pubsub.run_in_thread(sleep_time=self.sleep_time, daemon=True)
+
+    def unsubscribe(self, pattern: str, handler: Callable):
+        """
+        Unsubscribes the handler from the pattern.
+
+        :param pattern: the pattern to unsubscribe from
+        :type pattern: str
+        :param handler: the handler to remove
+        """
+        with self._lock:
+            if pattern not in self._handlers:
+                return
+            if handler in self._handlers[pattern]:
+                self._handlers[pattern].remove(handler)
+            if len(self._handlers[pattern]) == 0:
+                del self._handlers[pattern]
+                self._pubsub.punsubscribe(pattern)
+
+    def close(self):
+        """
+        Stops the worker thread and closes the pubsub connection.
+        """
+        # join outside the lock, the worker thread might be waiting for it in _dispatch
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None:
+            thread.stop()
+            thread.join()
+        with self._lock:
+            self._pubsub.close()
+            self._handlers.clear()
+
+
+class SharedClient:
+    """
+    Redis client that is shared between the plugins in the process using the same server/database.
+    """
+
+    def __init__(self, key: Tuple, connection: redis.Redis):
+        """
+        Initializes the client.
+
+        :param key: the registry key
+        :type key: tuple
+        :param connection: the (pooled) connection
+        :type connection: redis.Redis
+        """
+        self.key = key
+        self.connection = connection
+        self.ref_count = 0
+        self._pubsub = None
+
+    def pubsub(self, sleep_time: float = DEFAULT_SLEEP_TIME) -> SharedPubSub:
+        """
+        Returns the shared pubsub, creates it if necessary.
+
+        :param sleep_time: the time in seconds to block when waiting for messages in the worker thread
+        :type sleep_time: float
+        :return: the pubsub
+        :rtype: SharedPubSub
+        """
+        with _lock:
+            if self._pubsub is None:
+                self._pubsub = SharedPubSub(self.connection, sleep_time=sleep_time)
+            return self._pubsub
+
+    def close(self):
+        """
+        Closes the pubsub and the connection pool.
+        """
+        if self._pubsub is not None:
+            self._pubsub.close()
+            self._pubsub = None
+        self.connection.close()
+
+
+_lock = threading.RLock()
+_clients: Dict[Tuple, SharedClient] = dict()
+_connection_factory: Optional[Callable] = None
+
+
+def set_connection_factory(factory: Optional[Callable]):
+    """
+    Sets the function for creating connections, e.g., for using fakeredis.
+    The function takes host, port, db and unix_socket as parameters and returns a redis.Redis instance.
+
+    :param factory: the function, None for using the default
+    """
+    global _connection_factory
+    _connection_factory = factory
+
+
+def _create_connection(redis_host: str, redis_port: int, redis_db: int, redis_unix_socket: str = None) -> redis.Redis:
+    """
+    Creates a new connection.
+
+    :param redis_host: the redis host to use
+    :type redis_host: str
+    :param redis_port: the port to use
+    :type redis_port: int
+    :param redis_db: the database to use
+    :type redis_db: int
+    :param redis_unix_socket: the unix socket to use instead of host/port, ignored if None
+    :type redis_unix_socket: str
+    :return: the connection
+    :rtype: redis.Redis
+    """
+    if _connection_factory is not None:
+        return _connection_factory(redis_host, redis_port, redis_db, redis_unix_socket)
+    if redis_unix_socket is not None:
+        return redis.Redis(unix_socket_path=redis_unix_socket, db=redis_db)
+    return redis.Redis(host=redis_host, port=redis_port, db=redis_db)
+
+
+def acquire_client(redis_host: str, redis_port: int, redis_db: int, redis_unix_socket: str = None) -> SharedClient:
+    """
+    Returns the shared client for the server/database, creates it if necessary.
+    Needs to be released with release_client once no longer needed.
+
+    :param redis_host: the redis host to use
+    :type redis_host: str
+    :param redis_port: the port to use
+    :type redis_port: int
+    :param redis_db: the database to use
+    :type redis_db: int
+    :param redis_unix_socket: the unix socket to use instead of host/port, ignored if None
+    :type redis_unix_socket: str
+    :return: the client
+    :rtype: SharedClient
+    """
+    if redis_unix_socket is not None:
+        key = ("unix", redis_unix_socket, redis_db)
+    else:
+        key = ("tcp", redis_host, redis_port, redis_db)
+    with _lock:
+        if key not in _clients:
+            _clients[key] = SharedClient(key, _create_connection(redis_host, redis_port, redis_db, redis_unix_socket))
+        client = _clients[key]
+        client.ref_count += 1
+        return client
+
+
+def release_client(client: SharedClient):
+    """
+    Releases the shared client, closes it once no longer used by any plugin.
+
+    :param client: the client to release
+    :type client: SharedClient
+    """
+    with _lock:
+        client.ref_count -= 1
+        if client.ref_count <= 0:
+            if _clients.get(client.key) is client:
+                del _clients[client.key]
+            client.close()
+
+
+def add_unix_socket_option(parser: argparse.ArgumentParser):
+    """
+    Adds the option for connecting via unix socket to the parser.
+
+    :param parser: the parser to add the option to
+    :type parser: argparse.ArgumentParser
+    """
+    parser.add_argument("--redis_unix_socket", metavar="PATH", type=str, default=None, help="The unix socket of the Redis server to connect to instead of host/port, for co-located servers.", required=False)
@@ -0,0 +1,68 @@
+import hashlib
+from typing import Dict, Optional, Union
+
+import redis
+
+KEY_IMAGE_REF = "image_ref"
+""" the key in the broadcast messages that holds the redis key of the image """
+
+DEFAULT_IMAGE_REF_PREFIX = "idc:image:"
+
+DEFAULT_IMAGE_REF_TTL = 3600
+
+
+def image_ref_key(data: Union[bytes, memoryview], prefix: str = DEFAULT_IMAGE_REF_PREFIX) -> str:
+    """
+    Generates the content-addressed key for the image.
+
+    :param data: the image content
+    :type data: bytes or memoryview
+    :param prefix: the prefix for the key
+    :type prefix: str
+    :return: the key
+    :rtype: str
+    """
+    return prefix + hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def store_image_ref(connection: redis.Redis, data: Union[bytes, memoryview], prefix: str = DEFAULT_IMAGE_REF_PREFIX,
+                    ttl: int = DEFAULT_IMAGE_REF_TTL) -> str:
+    """
+    Stores the image under its content-addressed key, unless already present. The time-to-live
+    of the key gets refreshed in either case.
+
+    :param connection: the connection to use
+    :type connection: redis.Redis
+    :param data: the image content
+    :type data: bytes or memoryview
+    :param prefix: the prefix for the key
+    :type prefix: str
+    :param ttl: the time-to-live in seconds, 0 for no expiry
+    :type ttl: int
+    :return: the key
+    :rtype: str
+    """
+    key = image_ref_key(data, prefix=prefix)
+    if ttl > 0:
+        # only upload the image if the key doesn't exist (anymore)
+        if not connection.expire(key, ttl):
+            connection.set(key, data, ex=ttl)
+    else:
+        connection.set(key, data, nx=True)
+    return key
+
+
+def fetch_image_ref(connection: redis.Redis, message: Dict) -> Optional[bytes]:
+    """
+    Fetches the image referenced by the broadcast message, for subscribers that need the pixels.
+
+    :param connection: the connection to use
+    :type connection: redis.Redis
+    :param message: the decoded message
+    :type message: dict
+    :return: the image content, None if the message has no reference or the image has expired
+    :rtype: bytes
+    """
+    if KEY_IMAGE_REF not in message:
+        return None
+    return connection.get(message[KEY_IMAGE_REF])
@@ -0,0 +1,359 @@
+import abc
+import argparse
+import hashlib
+import logging
+import queue
+import threading
+from time import perf_counter
+from typing import Dict, Optional, Union
+
+import redis
+
+JOURNAL_SQLITE = "sqlite"
+JOURNAL_REDIS = "redis"
+JOURNALS = [
+    JOURNAL_SQLITE,
+    JOURNAL_REDIS,
+]
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+_STOP = object()
+
+
+def journal_key(image_name: str, data: Union[bytes, memoryview]) -> str:
+    """
+    Generates the journal key from the image name and the hash of the image content.
+
+    :param image_name: the name of the image
+    :type image_name: str
+    :param data: the image content
+    :type data: bytes or memoryview
+    :return: the key
+    :rtype: str
+    """
+    return "%s:%s" % (image_name, hashlib.blake2b(data, digest_size=16).hexdigest())
+
+
+class Journal(abc.ABC):
+    """
+    Ancestor for journals that record the predictions of completed items, for resuming runs.
+    Writes are batched and performed asynchronously in a background thread.
+    """
+
+    def __init__(self, batch_size: int = DEFAULT_BATCH_SIZE, flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 logger: logging.Logger = None):
+        """
+        Initializes the journal.
+
+        :param batch_size: the number of entries to write in one go
+        :type batch_size: int
+        :param flush_interval: the maximum time in seconds before pending entries get written
+        :type flush_interval: float
+        :param logger: the logger to use for outputting errors
+        :type logger: logging.Logger
+        """
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.logger = logger
+        self.num_written = 0
+        self._queue = queue.Queue()
+        self._pending: Dict[str, bytes] = dict()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """
+        Starts the background thread for writing the entries.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    @abc.abstractmethod
+    def _lookup(self, key: str) -> Optional[bytes]:
+        """
+        Looks up the stored entry.
+
+        :param key: the key to look up
+        :type key: str
+        :return: the data, None if not present
+        :rtype: bytes
+        """
+        raise NotImplementedError()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Returns the entry, including ones that have not been written yet.
+
+        :param key: the key to look up
+        :type key: str
+        :return: the data, None if not present
+        :rtype: bytes
+        """
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+        return self._lookup(key)
+
+    def put(self, key: str, data: bytes):
+        """
+        Queues the entry for writing.
+
+        :param key: the key of the entry
+        :type key: str
+        :param data: the data to store
+        :type data: bytes
+        """
+        with self._lock:
+            self._pending[key] = data
+        self._queue.put(key)
+
+    def _open_writer(self):
+        """
+        Hook for preparing the writing in the background thread.
+        """
+        pass
+
+    @abc.abstractmethod
+    def _write(self, batch: Dict[str, bytes]):
+        """
+        Writes the batch of entries, gets called from the background thread.
+
+        :param batch: the entries to write
+        :type batch: dict
+        """
+        raise NotImplementedError()
+
+    def _close_writer(self):
+        """
+        Hook for finishing up the writing in the background thread.
+        """
+        pass
+
+    def _flush(self, keys):
+        """
+        Writes the entries with the specified keys.
+
+        :param keys: the keys of the entries to write
+        :type keys: list
+        """
+        if len(keys) == 0:
+            return
+        with self._lock:
+            batch = {k: self._pending[k] for k in keys if k in self._pending}
+        try:
+            self._write(batch)
+            self.num_written += len(batch)
+        except Exception:
+            if self.logger is not None:
+                self.logger.exception("Failed to write %d journal entries!" % len(batch))
+        with self._lock:
+            for k in batch:
+                if self._pending.get(k) is batch[k]:
+                    del self._pending[k]
+
+    def _run(self):
+        """
+        Writes the queued entries in batches until stopped.
+        """
+        self._open_writer()
+        try:
+            keys = []
+            deadline = None
+            stop = False
+            while not stop:
+                timeout = self.flush_interval if (deadline is None) else max(0.0, deadline - perf_counter())
+                try:
+                    key = self._queue.get(timeout=timeout)
+                    if key is _STOP:
+                        stop = True
+                    else:
+                        keys.append(key)
+                        if deadline is None:
+                            deadline = perf_counter() + self.flush_interval
+                except queue.Empty:
+                    pass
+                if stop or (len(keys) >= self.batch_size) or ((deadline is not None) and (perf_counter() >= deadline)):
+                    self._flush(keys)
+                    keys = []
+                    deadline = None
+        finally:
+            self._close_writer()
+
+    def close(self):
+        """
+        Writes all pending entries and stops the background thread.
+        """
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+
+class SqliteJournal(Journal):
+    """
+    Journal that uses a local SQLite database.
+    """
+
+    def __init__(self, path: str, batch_size: int = DEFAULT_BATCH_SIZE, flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 logger: logging.Logger = None):
+        """
+        Initializes the journal.
+
+        :param path: the database file
+        :type path: str
+        :param batch_size: the number of entries to write in one go
+        :type batch_size: int
+        :param flush_interval: the maximum time in seconds before pending entries get written
+        :type flush_interval: float
+        :param logger: the logger to use for outputting errors
+        :type logger: logging.Logger
+        """
+        super().__init__(batch_size=batch_size, flush_interval=flush_interval, logger=logger)
+        import sqlite3
+        self.path = path
+        # separate connections for reading (calling thread) and writing (background thread)
+        self._reader = sqlite3.connect(path)
+        self._reader.execute("PRAGMA journal_mode=WAL")
+        self._reader.execute("CREATE TABLE IF NOT EXISTS journal (key TEXT PRIMARY KEY, data BLOB)")
+        self._reader.commit()
+        self._writer = None
+
+    def _lookup(self, key: str) -> Optional[bytes]:
+        """
+        Looks up the stored entry.
+
+        :param key: the key to look up
+        :type key: str
+        :return: the data, None if not present
+        :rtype: bytes
+        """
+        row = self._reader.execute("SELECT data FROM journal WHERE key = ?", (key,)).fetchone()
+        return None if (row is None) else row[0]
+
+    def _open_writer(self):
+        """
+        Opens the connection for writing.
+        """
+        import sqlite3
+        self._writer = sqlite3.connect(self.path)
+
+    def _write(self, batch: Dict[str, bytes]):
+        """
+        Writes the batch of entries in a single transaction.
+
+        :param batch: the entries to write
+        :type batch: dict
+        """
+        with self._writer:
+            self._writer.executemany("INSERT OR REPLACE INTO journal (key, data) VALUES (?, ?)", batch.items())
+
+    def _close_writer(self):
+        """
+        Closes the connection for writing.
+        """
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def close(self):
+        """
+        Writes all pending entries and closes the database.
+        """
+        super().close()
+        self._reader.close()
+
+
+class RedisJournal(Journal):
+    """
+    Journal that uses a Redis hash.
+    """
+
+    def __init__(self, connection: redis.Redis, name: str, batch_size: int = DEFAULT_BATCH_SIZE,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL, logger: logging.Logger = None):
+        """
+        Initializes the journal.
+
+        :param connection: the connection to use
+        :type connection: redis.Redis
+        :param name: the name of the hash
+        :type name: str
+        :param batch_size: the number of entries to write in one go
+        :type batch_size: int
+        :param flush_interval: the maximum time in seconds before pending entries get written
+        :type flush_interval: float
+        :param logger: the logger to use for outputting errors
+        :type logger: logging.Logger
+        """
+        super().__init__(batch_size=batch_size, flush_interval=flush_interval, logger=logger)
+        self.connection = connection
+        self.name = name
+
+    def _lookup(self, key: str) -> Optional[bytes]:
+        """
+        Looks up the stored entry.
+
+        :param key: the key to look up
+        :type key: str
+        :return: the data, None if not present
+        :rtype: bytes
+        """
+        return self.connection.hget(self.name, key)
+
+    def _write(self, batch: Dict[str, bytes]):
+        """
+        Writes the batch of entries with a single command.
+
+        :param batch: the entries to write
+        :type batch: dict
+        """
+        self.connection.hset(self.name, mapping=batch)
+
+
+def add_journal_options(parser: argparse.ArgumentParser):
+    """
+    Adds the options for journaling the predictions to the parser.
+
+    :param parser: the parser to add the options to
+    :type parser: argparse.ArgumentParser
+    """
+    parser.add_argument("--journal", metavar="SPEC", type=str, default=None, help="The journal for recording the predictions of completed images, for resuming runs without making predictions again: sqlite:FILE for a local SQLite database or redis:HASH for a Redis hash.", required=False)
+    parser.add_argument("--journal_batch_size", metavar="NUM", type=int, default=DEFAULT_BATCH_SIZE, help="The number of journal entries to write in one go.", required=False)
+    parser.add_argument("--journal_flush_interval", metavar="SEC", type=float, default=DEFAULT_FLUSH_INTERVAL, help="The maximum time in seconds before pending journal entries get written.", required=False)
+
+
+def create_journal(spec: Optional[str], connection: redis.Redis, batch_size: int = None, flush_interval: float = None,
+                   logger: logging.Logger = None) -> Optional[Journal]:
+    """
+    Creates and starts the journal.
+
+    :param spec: the journal specification (sqlite:FILE or redis:HASH), None for no journal
+    :type spec: str
+    :param connection: the connection to use for the Redis journal
+    :type connection: redis.Redis
+    :param batch_size: the number of entries to write in one go, uses the default if None
+    :type batch_size: int
+    :param flush_interval: the maximum time in seconds before pending entries get written, uses the default if None
+    :type flush_interval: float
+    :param logger: the logger to use for outputting errors
+    :type logger: logging.Logger
+    :return: the journal, None if no specification
+    :rtype: Journal
+    """
+    if spec is None:
+        return None
+    parts = spec.split(":", 1)
+    if (len(parts) != 2) or (parts[0] not in JOURNALS) or (len(parts[1]) == 0):
+        raise Exception("Invalid journal specification, expected sqlite:FILE or redis:HASH: %s" % spec)
+    if batch_size is None:
+        batch_size = DEFAULT_BATCH_SIZE
+    if flush_interval is None:
+        flush_interval = DEFAULT_FLUSH_INTERVAL
+    if parts[0] == JOURNAL_SQLITE:
+        result = SqliteJournal(parts[1], batch_size=batch_size, flush_interval=flush_interval, logger=logger)
+    else:
+        result = RedisJournal(connection, parts[1], batch_size=batch_size, flush_interval=flush_interval, logger=logger)
+    result.start()
+    return result
@@ -0,0 +1,166 @@
+import argparse
+import logging
+import os
+import signal
+import threading
+from time import perf_counter
+from typing import Callable, List, Optional
+
+DEFAULT_DRAIN_TIMEOUT = 0.0
+""" graceful shutdown is opt-in, as it replaces the SIGTERM handler of the process """
+
+# reentrant, as the signal handler runs in the main thread, possibly while it holds the lock
+_lock = threading.RLock()
+_installed = False
+_previous_handler = None
+_shutdown_time: Optional[float] = None
+_callbacks: List[Callable] = []
+_drain_sources = set()
+_logger = logging.getLogger("idc.redis.shutdown")
+
+
+def _handle_signal(signum, frame):
+    """
+    Handles SIGTERM: the first one requests a graceful shutdown, a second one
+    gets handled by the previous handler (by default terminating the process).
+
+    :param signum: the signal number
+    :param frame: the current stack frame
+    """
+    if _shutdown_time is not None:
+        signal.signal(signal.SIGTERM, _previous_handler if (_previous_handler is not None) else signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+        return
+    _logger.warning("Shutdown requested, draining (send signal again to terminate immediately)...")
+    request_shutdown()
+
+
+def install_shutdown_handler() -> bool:
+    """
+    Installs the SIGTERM handler for requesting a graceful shutdown, unless already installed.
+    Can only be installed from the main thread.
+
+    :return: True if installed (now or previously)
+    :rtype: bool
+    """
+    global _installed, _previous_handler
+    with _lock:
+        if _installed:
+            return True
+        try:
+            _previous_handler = signal.signal(signal.SIGTERM, _handle_signal)
+            _installed = True
+        except ValueError:
+            _logger.warning("Failed to install SIGTERM handler for graceful shutdown, not in main thread!")
+        return _installed
+
+
+def request_shutdown():
+    """
+    Requests a graceful shutdown, notifying the registered callbacks.
+    Gets called by the SIGTERM handler, but can be called directly as well.
+    """
+    global _shutdown_time
+    with _lock:
+        if _shutdown_time is not None:
+            return
+        _shutdown_time = perf_counter()
+        callbacks = list(_callbacks)
+    for callback in callbacks:
+        callback()
+
+
+def reset_shutdown():
+    """
+    Resets the shutdown request.
+    """
+    global _shutdown_time
+    with _lock:
+        _shutdown_time = None
+
+
+def shutdown_requested() -> bool:
+    """
+    Returns whether a graceful shutdown has been requested.
+
+    :return: True if requested
+    :rtype: bool
+    """
+    return _shutdown_time is not None
+
+
+def drain_remaining(drain_timeout: float) -> float:
+    """
+    Returns the time left for draining.
+
+    :param drain_timeout: the maximum time in seconds for draining after the shutdown request
+    :type drain_timeout: float
+    :return: the time left in seconds, 0 if exceeded, the timeout itself if no shutdown requested
+    :rtype: float
+    """
+    if _shutdown_time is None:
+        return drain_timeout
+    return max(0.0, _shutdown_time + drain_timeout - perf_counter())
+
+
+def add_shutdown_callback(callback: Callable):
+    """
+    Adds the callback to notify when a shutdown gets requested, e.g., for waking up waiting threads.
+    Gets executed in the signal handler, i.e., must not block.
+
+    :param callback: the callback without parameters
+    """
+    with _lock:
+        _callbacks.append(callback)
+
+
+def remove_shutdown_callback(callback: Callable):
+    """
+    Removes the callback again.
+
+    :param callback: the callback to remove
+    """
+    with _lock:
+        if callback in _callbacks:
+            _callbacks.remove(callback)
+
+
+def register_drain_source(source):
+    """
+    Registers a plugin that keeps forwarding buffered data while draining, i.e., downstream
+    plugins should keep processing until the drain timeout.
+
+    :param source: the plugin to register
+    """
+    with _lock:
+        _drain_sources.add(id(source))
+
+
+def unregister_drain_source(source):
+    """
+    Unregisters the plugin again.
+
+    :param source: the plugin to unregister
+    """
+    with _lock:
+        _drain_sources.discard(id(source))
+
+
+def has_drain_sources() -> bool:
+    """
+    Returns whether any plugins are forwarding buffered data while draining.
+
+    :return: True if at least one registered
+    :rtype: bool
+    """
+    return len(_drain_sources) > 0
+
+
+def add_drain_option(parser: argparse.ArgumentParser):
+    """
+    Adds the option for draining on shutdown to the parser.
+
+    :param parser: the parser to add the option to
+    :type parser: argparse.ArgumentParser
+    """
+    parser.add_argument("--drain_timeout", metavar="SEC", type=float, default=DEFAULT_DRAIN_TIMEOUT, help="Enables the graceful shutdown when greater than 0 (replaces the SIGTERM handler): the maximum time in seconds for draining when receiving SIGTERM, no new data gets accepted, but outstanding predictions and buffered images still get processed; a second SIGTERM terminates immediately.", required=False)
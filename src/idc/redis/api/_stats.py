@@ -0,0 +1,510 @@
+import argparse
+import bisect
+import logging
+import os
+import socket
+import threading
+from contextlib import nullcontext
+from time import perf_counter
+from typing import Dict, List, Optional, Tuple
+
+STAGE_ENCODE = "encode"
+STAGE_PUBLISH = "publish"
+STAGE_WAIT = "wait"
+STAGE_POLL = "poll"
+STAGE_DECODE = "decode"
+STAGE_BUILD = "build"
+STAGE_SERIALIZE = "serialize"
+STAGE_COMPRESS = "compress"
+STAGE_DECOMPRESS = "decompress"
+STAGE_JOURNAL = "journal"
+STAGE_DEDUP = "dedup"
+STAGE_STORE = "store"
+
+EXPORT_PROMETHEUS = "prometheus"
+EXPORT_STATSD = "statsd"
+EXPORTS = [
+    EXPORT_PROMETHEUS,
+    EXPORT_STATSD,
+]
+
+BUCKETS = [0.00001 * (2 ** i) for i in range(23)]
+""" the upper bounds of the histogram buckets in seconds: 10us ... ~42s """
+
+_NULL_CONTEXT = nullcontext()
+
+
+class Histogram:
+    """
+    Simple histogram for durations, using fixed exponential buckets.
+    """
+
+    def __init__(self):
+        """
+        Initializes the histogram.
+        """
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value: float):
+        """
+        Adds the duration.
+
+        :param value: the duration in seconds
+        :type value: float
+        """
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if (self.min is None) or (value < self.min):
+            self.min = value
+        if (self.max is None) or (value > self.max):
+            self.max = value
+
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        Estimates the percentile by interpolating within the bucket.
+
+        :param p: the percentile (0-100)
+        :type p: float
+        :return: the estimated duration in seconds, None if no values
+        :rtype: float
+        """
+        if self.count == 0:
+            return None
+        target = self.count * p / 100.0
+        total = 0
+        for i, c in enumerate(self.counts):
+            if c == 0:
+                continue
+            if total + c >= target:
+                lower = BUCKETS[i - 1] if i > 0 else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else self.max
+                value = lower + (upper - lower) * (target - total) / c
+                return min(max(value, self.min), self.max)
+            total += c
+        return self.max
+
+    @property
+    def mean(self) -> Optional[float]:
+        """
+        Returns the mean duration.
+
+        :return: the mean in seconds, None if no values
+        :rtype: float
+        """
+        if self.count == 0:
+            return None
+        return self.sum / self.count
+
+
+class _StageTimer:
+    """
+    Context manager for timing a stage.
+    """
+
+    def __init__(self, stats: "StageStats", stage: str):
+        """
+        Initializes the timer.
+
+        :param stats: the stats to add the duration to
+        :type stats: StageStats
+        :param stage: the stage to time
+        :type stage: str
+        """
+        self.stats = stats
+        self.stage = stage
+        self.start = None
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stats.add(self.stage, perf_counter() - self.start)
+        return False
+
+
+class StageStats:
+    """
+    Collects the durations of the processing stages in histograms.
+    """
+
+    def __init__(self, name: str):
+        """
+        Initializes the statistics.
+
+        :param name: the name of the plugin the statistics are for
+        :type name: str
+        """
+        self.name = name
+        self.histograms: Dict[str, Histogram] = dict()
+        self.counters: Dict[str, float] = dict()
+        self.num_items = 0
+
+    def add(self, stage: str, duration: float):
+        """
+        Adds the duration for the stage.
+
+        :param stage: the stage
+        :type stage: str
+        :param duration: the duration in seconds
+        :type duration: float
+        """
+        if stage not in self.histograms:
+            self.histograms[stage] = Histogram()
+        self.histograms[stage].add(duration)
+
+    def set_counter(self, name: str, value: float):
+        """
+        Sets the value of the counter/gauge, e.g., queue depth or number of dropped items.
+
+        :param name: the name of the counter
+        :type name: str
+        :param value: the current value
+        :type value: float
+        """
+        self.counters[name] = value
+
+    def time(self, stage: str) -> _StageTimer:
+        """
+        Returns a context manager for timing the stage.
+
+        :param stage: the stage to time
+        :type stage: str
+        :return: the context manager
+        """
+        return _StageTimer(self, stage)
+
+    def summary(self) -> List[str]:
+        """
+        Generates a summary, one line per stage.
+
+        :return: the summary lines
+        :rtype: list
+        """
+        result = ["stats - items: %d" % self.num_items]
+        for stage in self.histograms:
+            h = self.histograms[stage]
+            result.append("stats - %s: count=%d, mean=%.3fms, p50=%.3fms, p99=%.3fms, max=%.3fms" % (
+                stage, h.count, h.mean * 1000, h.percentile(50) * 1000,
+                h.percentile(99) * 1000, h.max * 1000))
+        if len(self.counters) > 0:
+            result.append("stats - counters: " + ", ".join("%s=%g" % (k, self.counters[k]) for k in self.counters))
+        return result
+
+    def to_prometheus(self) -> str:
+        """
+        Generates the statistics in Prometheus' text exposition format.
+
+        :return: the generated text
+        :rtype: str
+        """
+        return to_prometheus([(self.name, self)])
+
+
+def to_prometheus(entries: List[Tuple[str, StageStats]]) -> str:
+    """
+    Generates the statistics of one or more plugins in Prometheus' text exposition format,
+    with each metric family only listed once.
+
+    :param entries: the list of plugin label/statistics tuples
+    :type entries: list
+    :return: the generated text
+    :rtype: str
+    """
+    lines = [
+        "# HELP idc_redis_stage_seconds The duration of the processing stages of the redis plugins.",
+        "# TYPE idc_redis_stage_seconds histogram",
+    ]
+    for plugin, stats in entries:
+        for stage in stats.histograms:
+            h = stats.histograms[stage]
+            labels = 'plugin="%s",stage="%s"' % (plugin, stage)
+            total = 0
+            for i, c in enumerate(h.counts):
+                total += c
+                le = ("%g" % BUCKETS[i]) if (i < len(BUCKETS)) else "+Inf"
+                lines.append('idc_redis_stage_seconds_bucket{%s,le="%s"} %d' % (labels, le, total))
+            lines.append("idc_redis_stage_seconds_sum{%s} %f" % (labels, h.sum))
+            lines.append("idc_redis_stage_seconds_count{%s} %d" % (labels, h.count))
+    lines.append("# HELP idc_redis_items_total The number of items processed by the redis plugins.")
+    lines.append("# TYPE idc_redis_items_total counter")
+    for plugin, stats in entries:
+        lines.append('idc_redis_items_total{plugin="%s"} %d' % (plugin, stats.num_items))
+    if any(len(stats.counters) > 0 for _, stats in entries):
+        lines.append("# HELP idc_redis_counter The counters of the redis plugins, e.g., queue depth or dropped items.")
+        lines.append("# TYPE idc_redis_counter gauge")
+        for plugin, stats in entries:
+            for k in stats.counters:
+                lines.append('idc_redis_counter{plugin="%s",name="%s"} %g' % (plugin, k, stats.counters[k]))
+    return "\n".join(lines) + "\n"
+
+
+class _PrometheusTextfile:
+    """
+    The statistics of all the plugins exporting to the same Prometheus textfile,
+    as the file gets rewritten completely with each export.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initializes the textfile.
+
+        :param path: the file to write to
+        :type path: str
+        """
+        self.path = path
+        self.entries: List[Tuple[str, StageStats]] = []
+
+    def register(self, stats: StageStats) -> str:
+        """
+        Adds the statistics, using the plugin name as label. Plugins with the same name
+        get the label made unique by appending a number.
+
+        :param stats: the statistics to add
+        :type stats: StageStats
+        :return: the plugin label
+        :rtype: str
+        """
+        labels = set(label for label, _ in self.entries)
+        label = stats.name
+        i = 1
+        while label in labels:
+            i += 1
+            label = "%s-%d" % (stats.name, i)
+        self.entries.append((label, stats))
+        return label
+
+    def unregister(self, stats: StageStats):
+        """
+        Removes the statistics.
+
+        :param stats: the statistics to remove
+        :type stats: StageStats
+        """
+        self.entries = [x for x in self.entries if x[1] is not stats]
+
+    def write(self):
+        """
+        Writes the statistics of all plugins to the file.
+        """
+        # write to temp file first, as the node exporter could read the file at any time
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as fp:
+            fp.write(to_prometheus(self.entries))
+        os.replace(tmp, self.path)
+
+
+_textfiles: Dict[str, _PrometheusTextfile] = dict()
+""" the Prometheus textfiles, with the absolute path as key """
+
+_textfiles_lock = threading.Lock()
+
+
+class StatsExporter:
+    """
+    Exports the statistics to Prometheus textfiles (prometheus:FILE) or
+    statsd-compatible UDP endpoints (statsd:HOST:PORT).
+    """
+
+    def __init__(self, spec: str):
+        """
+        Initializes the exporter.
+
+        :param spec: the export specification
+        :type spec: str
+        """
+        parts = spec.split(":", 1)
+        if (len(parts) != 2) or (parts[0] not in EXPORTS):
+            raise Exception("Invalid export specification, expected prometheus:FILE or statsd:HOST:PORT: %s" % spec)
+        self.export_type = parts[0]
+        self.file = None
+        self.address = None
+        self._socket = None
+        self._last_counts = dict()
+        self._textfile = None
+        self._stats = None
+        if self.export_type == EXPORT_PROMETHEUS:
+            self.file = parts[1]
+        else:
+            host, port = parts[1].rsplit(":", 1)
+            self.address = (host, int(port))
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def export(self, stats: StageStats):
+        """
+        Exports the statistics.
+
+        :param stats: the statistics to export
+        :type stats: StageStats
+        """
+        if self.export_type == EXPORT_PROMETHEUS:
+            # several plugins of a pipeline can export to the same file, merge their statistics
+            with _textfiles_lock:
+                if self._textfile is None:
+                    path = os.path.abspath(self.file)
+                    if path not in _textfiles:
+                        _textfiles[path] = _PrometheusTextfile(path)
+                    self._textfile = _textfiles[path]
+                    self._textfile.register(stats)
+                    self._stats = stats
+                self._textfile.write()
+        else:
+            lines = []
+            prefix = "idc_redis.%s" % stats.name
+            for stage in stats.histograms:
+                h = stats.histograms[stage]
+                key = "%s.%s" % (prefix, stage)
+                lines.append("%s.count:%d|c" % (key, h.count - self._last_counts.get(stage, 0)))
+                lines.append("%s.mean:%f|g" % (key, h.mean * 1000))
+                lines.append("%s.p50:%f|g" % (key, h.percentile(50) * 1000))
+                lines.append("%s.p99:%f|g" % (key, h.percentile(99) * 1000))
+                self._last_counts[stage] = h.count
+            for k in stats.counters:
+                lines.append("%s.%s:%g|g" % (prefix, k, stats.counters[k]))
+            for line in lines:
+                self._socket.sendto(line.encode(), self.address)
+
+    def close(self):
+        """
+        Closes the exporter.
+        """
+        if self._textfile is not None:
+            with _textfiles_lock:
+                self._textfile.unregister(self._stats)
+                if len(self._textfile.entries) == 0:
+                    _textfiles.pop(self._textfile.path, None)
+            self._textfile = None
+            self._stats = None
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+class StatsReporter:
+    """
+    Manages the statistics of a plugin: collecting, periodic reporting and exporting.
+    """
+
+    def __init__(self, name: str, logger: logging.Logger, interval: int = 0, export: str = None):
+        """
+        Initializes the reporter.
+
+        :param name: the name of the plugin
+        :type name: str
+        :param logger: the logger to report the statistics with
+        :type logger: logging.Logger
+        :param interval: the number of items after which to report, 0 for only reporting when finalizing
+        :type interval: int
+        :param export: the export specification (prometheus:FILE or statsd:HOST:PORT), ignored if None
+        :type export: str
+        """
+        self.stats = StageStats(name)
+        self.logger = logger
+        self.interval = interval
+        self.exporter = None if (export is None) else StatsExporter(export)
+
+    def add(self, stage: str, duration: float):
+        """
+        Adds the duration for the stage.
+
+        :param stage: the stage
+        :type stage: str
+        :param duration: the duration in seconds
+        :type duration: float
+        """
+        self.stats.add(stage, duration)
+
+    def set_counter(self, name: str, value: float):
+        """
+        Sets the value of the counter/gauge, e.g., queue depth or number of dropped items.
+
+        :param name: the name of the counter
+        :type name: str
+        :param value: the current value
+        :type value: float
+        """
+        self.stats.set_counter(name, value)
+
+    def item_done(self):
+        """
+        Counts the item and reports the statistics if the interval has been reached.
+        """
+        self.stats.num_items += 1
+        if (self.interval > 0) and (self.stats.num_items % self.interval == 0):
+            self.report()
+
+    def report(self):
+        """
+        Outputs the statistics via the logger at INFO level and exports them if necessary.
+        """
+        for line in self.stats.summary():
+            self.logger.info(line)
+        if self.exporter is not None:
+            try:
+                self.exporter.export(self.stats)
+            except Exception:
+                self.logger.exception("Failed to export statistics!")
+
+    def close(self):
+        """
+        Reports the statistics a final time and closes the exporter.
+        """
+        self.report()
+        if self.exporter is not None:
+            self.exporter.close()
+            self.exporter = None
+
+
+def timed(reporter: Optional[StatsReporter], stage: str):
+    """
+    Returns a context manager for timing the stage, a no-op one if no statistics are being collected.
+
+    :param reporter: the reporter to add the duration to, can be None
+    :type reporter: StatsReporter
+    :param stage: the stage to time
+    :type stage: str
+    :return: the context manager
+    """
+    if reporter is None:
+        return _NULL_CONTEXT
+    return reporter.stats.time(stage)
+
+
+def add_stats_options(parser: argparse.ArgumentParser):
+    """
+    Adds the options for collecting statistics to the parser.
+
+    :param parser: the parser to add the options to
+    :type parser: argparse.ArgumentParser
+    """
+    parser.add_argument("--stats", action="store_true", help="Whether to collect timing statistics for the processing stages, output via the logger at INFO level, i.e., requires '-l INFO'.", required=False)
+    parser.add_argument("--stats_interval", metavar="NUM", type=int, default=0, help="The number of items after which to output the statistics, 0 for only when finishing.", required=False)
+    parser.add_argument("--stats_export", metavar="SPEC", type=str, default=None, help="Where to export the statistics to: prometheus:FILE for a Prometheus textfile (shared by the plugins of the pipeline, using the plugin name as label) or statsd:HOST:PORT for a statsd UDP endpoint.", required=False)
+
+
+def create_stats_reporter(enabled: bool, name: str, logger: logging.Logger, interval: int = None,
+                          export: str = None) -> Optional[StatsReporter]:
+    """
+    Creates the statistics reporter if enabled.
+
+    :param enabled: whether statistics are enabled
+    :type enabled: bool
+    :param name: the name of the plugin
+    :type name: str
+    :param logger: the logger to report the statistics with
+    :type logger: logging.Logger
+    :param interval: the number of items after which to report, 0/None for only reporting when finalizing
+    :type interval: int
+    :param export: the export specification (prometheus:FILE or statsd:HOST:PORT), ignored if None
+    :type export: str
+    :return: the reporter, None if not enabled
+    :rtype: StatsReporter
+    """
+    if not enabled:
+        return None
+    return StatsReporter(name, logger, interval=0 if (interval is None) else interval, export=export)
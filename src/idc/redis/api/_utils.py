@@ -0,0 +1,79 @@
+import io
+from typing import Union, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+def load_npy_from_bytes(data: Union[bytes, memoryview]) -> "np.ndarray":
+    """
+    Loads a numpy array in .npy format from the bytes without copying the array data,
+    i.e., the array is a read-only view onto the bytes. Falls back to np.load for
+    formats other than 1.0 and 2.0.
+
+    :param data: the bytes to load the array from
+    :type data: bytes or memoryview
+    :return: the array
+    :rtype: np.ndarray
+    """
+    import numpy as np
+    from numpy.lib import format as npy_format
+    # BytesIO shares the buffer of bytes objects, i.e., no copy is made for parsing the header
+    fp = io.BytesIO(data)
+    version = npy_format.read_magic(fp)
+    if version == (1, 0):
+        shape, fortran_order, dtype = npy_format.read_array_header_1_0(fp)
+    elif version == (2, 0):
+        shape, fortran_order, dtype = npy_format.read_array_header_2_0(fp)
+    else:
+        fp.seek(0)
+        return np.load(fp)
+    if dtype.hasobject:
+        raise Exception("Arrays with Python objects are not supported!")
+    count = 1
+    for dim in shape:
+        count *= dim
+    result = np.frombuffer(data, dtype=dtype, count=count, offset=fp.tell())
+    if fortran_order:
+        return result.reshape(shape[::-1]).transpose()
+    else:
+        return result.reshape(shape)
+
+
+def resize_bilinear(arr: "np.ndarray", width: int, height: int) -> "np.ndarray":
+    """
+    Resizes the 2-dim array using bilinear interpolation (pixel centers aligned like PIL,
+    but without antialiasing when downscaling). Computes in the dtype of the array, i.e.,
+    use a float array. NaNs spread to the interpolated neighbors, but not to pixels that
+    coincide with valid ones.
+
+    :param arr: the array to resize
+    :type arr: np.ndarray
+    :param width: the new width
+    :type width: int
+    :param height: the new height
+    :type height: int
+    :return: the resized array, the array itself if the size already matches
+    :rtype: np.ndarray
+    """
+    import numpy as np
+    in_height, in_width = arr.shape
+    if (in_width == width) and (in_height == height):
+        return arr
+
+    def coords(size_in, size_out):
+        pos = (np.arange(size_out, dtype=arr.dtype) + 0.5) * (size_in / size_out) - 0.5
+        pos = np.clip(pos, 0, size_in - 1)
+        i0 = pos.astype(np.intp)
+        w = (pos - i0).astype(arr.dtype)
+        # neighbors with zero weight must not contribute, as NaN * 0 is NaN
+        i1 = np.where(w > 0, np.minimum(i0 + 1, size_in - 1), i0)
+        return i0, i1, w
+
+    y0, y1, wy = coords(in_height, height)
+    x0, x1, wx = coords(in_width, width)
+    top = arr[y0]
+    bottom = arr[y1]
+    top = top[:, x0] * (1 - wx) + top[:, x1] * wx
+    bottom = bottom[:, x0] * (1 - wx) + bottom[:, x1] * wx
+    return top * (1 - wy)[:, None] + bottom * wy[:, None]
@@ -1,3 +1,4 @@
+from ._redis_predict import AbstractRedisPredict
 from ._redis_predict_dp import DepthRedisPredict
 from ._redis_predict_ic import ImageClassificationRedisPredict
 from ._redis_predict_is import ImageSegmentationRedisPredict
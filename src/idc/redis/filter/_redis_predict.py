@@ -0,0 +1,486 @@
+import abc
+import argparse
+import threading
+from collections import deque
+from time import perf_counter
+
+from wai.logging import LOGGING_WARNING
+
+from kasperl.api import make_list, flatten_list
+from kasperl.redis.filter import AbstractRedisPubSubFilter
+from idc.redis.api import STAGE_ENCODE, STAGE_PUBLISH, STAGE_WAIT, STAGE_POLL, timed, add_stats_options, create_stats_reporter
+from idc.redis.api import CIRCUIT_HALF_OPEN, CircuitBreaker, AdaptiveTimeout
+from idc.redis.api import acquire_client, release_client, add_unix_socket_option
+from idc.redis.api import STAGE_COMPRESS, STAGE_DECOMPRESS, is_compressed, add_compression_options, create_compressor
+from idc.redis.api import STAGE_JOURNAL, journal_key, add_journal_options, create_journal
+from idc.redis.api import DEFAULT_DRAIN_TIMEOUT, install_shutdown_handler, shutdown_requested, drain_remaining, has_drain_sources, add_drain_option
+
+# the timeout actions of kasperl's AbstractRedisPubSubFilter, which doesn't export them
+TIMEOUT_ACTION_DROP = "drop"
+TIMEOUT_ACTION_INPUT = "input"
+
+LATE_PREDICTION_EXPIRY = 10
+""" the number of timeouts after which the prediction of a timed out image is considered lost """
+
+
+class AbstractRedisPredict(AbstractRedisPubSubFilter, abc.ABC):
+    """
+    Ancestor for filters that make predictions via Redis backend.
+    """
+
+    def __init__(self, redis_host: str = None, redis_port: int = None, redis_db: int = None,
+                 channel_out: str = None, channel_in: str = None, timeout: float = None,
+                 timeout_action: str = None, sleep_time: float = None,
+                 circuit_threshold: int = None, circuit_probe_interval: float = None,
+                 adaptive_timeout_factor: float = None, adaptive_timeout_min: float = None,
+                 compression: str = None, compression_level: int = None, compression_min_size: int = None,
+                 journal: str = None, journal_batch_size: int = None, journal_flush_interval: float = None,
+                 drain_timeout: float = None,
+                 stats: bool = False, stats_interval: int = None, stats_export: str = None,
+                 redis_unix_socket: str = None,
+                 logger_name: str = None, logging_level: str = LOGGING_WARNING):
+        """
+        Initializes the filter.
+
+        :param redis_host: the redis host to use
+        :type redis_host: str
+        :param redis_port: the port to use
+        :type redis_port: int
+        :param redis_db: the database to use
+        :type redis_db: int
+        :param channel_out: the channel to send the images to
+        :type channel_out: str
+        :param channel_in: the channel to receive the predictions on
+        :type channel_in: str
+        :param timeout: the time in seconds to wait for predictions
+        :type timeout: float
+        :param timeout_action: the action to take when a timeout happens
+        :type timeout_action: str
+        :param sleep_time: the time in seconds between polls
+        :type sleep_time: float
+        :param circuit_threshold: the number of consecutive timeouts after which to fail fast, 0 to disable
+        :type circuit_threshold: int
+        :param circuit_probe_interval: the time in seconds after which to probe the backend again when failing fast
+        :type circuit_probe_interval: float
+        :param adaptive_timeout_factor: the factor for the p99 of the round trip times to use as timeout, 0 to disable
+        :type adaptive_timeout_factor: float
+        :param adaptive_timeout_min: the minimum timeout in seconds when using the adaptive timeout
+        :type adaptive_timeout_min: float
+        :param compression: the codec to compress the images with (none/lz4/zstd)
+        :type compression: str
+        :param compression_level: the compression level, uses the codec's default if None
+        :type compression_level: int
+        :param compression_min_size: the minimum size in bytes for images to get compressed
+        :type compression_min_size: int
+        :param journal: the journal for the predictions of completed images (sqlite:FILE or redis:HASH), ignored if None
+        :type journal: str
+        :param journal_batch_size: the number of journal entries to write in one go
+        :type journal_batch_size: int
+        :param journal_flush_interval: the maximum time in seconds before pending journal entries get written
+        :type journal_flush_interval: float
+        :param drain_timeout: the maximum time in seconds for draining when receiving SIGTERM, 0 to disable
+        :type drain_timeout: float
+        :param stats: whether to collect timing statistics
+        :type stats: bool
+        :param stats_interval: the number of items after which to output the statistics, 0 for only when finishing
+        :type stats_interval: int
+        :param stats_export: where to export the statistics to (prometheus:FILE or statsd:HOST:PORT)
+        :type stats_export: str
+        :param redis_unix_socket: the unix socket to connect to instead of host/port, ignored if None
+        :type redis_unix_socket: str
+        :param logger_name: the name to use for the logger
+        :type logger_name: str
+        :param logging_level: the logging level to use
+        :type logging_level: str
+        """
+        super().__init__(redis_host=redis_host, redis_port=redis_port, redis_db=redis_db,
+                         channel_out=channel_out, channel_in=channel_in, timeout=timeout,
+                         timeout_action=timeout_action, sleep_time=sleep_time,
+                         logger_name=logger_name, logging_level=logging_level)
+        self.redis_unix_socket = redis_unix_socket
+        self.circuit_threshold = circuit_threshold
+        self.circuit_probe_interval = circuit_probe_interval
+        self.adaptive_timeout_factor = adaptive_timeout_factor
+        self.adaptive_timeout_min = adaptive_timeout_min
+        self.compression = compression
+        self.compression_level = compression_level
+        self.compression_min_size = compression_min_size
+        self.journal = journal
+        self.journal_batch_size = journal_batch_size
+        self.journal_flush_interval = journal_flush_interval
+        self.drain_timeout = drain_timeout
+        self.stats = stats
+        self.stats_interval = stats_interval
+        self.stats_export = stats_export
+        self._stats = None
+        self._circuit = None
+        self._adaptive_timeout = None
+        self._client = None
+        self._pubsub = None
+        self._compressor = None
+        self._journal = None
+        self._num_journaled = 0
+        self._outstanding = None
+        self._reply_lock = threading.Lock()
+        self._waiting = None
+        self._late = deque()
+        self._num_discarded = 0
+
+    def _default_channel_out(self):
+        """
+        Returns the default channel for broadcasting the filtered data.
+
+        :return: the default channel
+        :rtype: str
+        """
+        return "images"
+
+    def _default_channel_in(self):
+        """
+        Returns the default channel for the incoming data.
+
+        :return: the default channel
+        :rtype: str
+        """
+        return "predictions"
+
+    def _create_argparser(self) -> argparse.ArgumentParser:
+        """
+        Creates an argument parser. Derived classes need to fill in the options.
+
+        :return: the parser
+        :rtype: argparse.ArgumentParser
+        """
+        parser = super()._create_argparser()
+        add_unix_socket_option(parser)
+        parser.add_argument("--circuit_threshold", metavar="NUM", type=int, default=0, help="The number of consecutive timeouts after which to stop waiting for predictions and apply the timeout action straight away, 0 to disable.", required=False)
+        parser.add_argument("--circuit_probe_interval", metavar="SEC", type=float, default=10.0, help="The time in seconds after which to probe the model again with a single image when failing fast.", required=False)
+        parser.add_argument("--adaptive_timeout_factor", metavar="FACTOR", type=float, default=0.0, help="The factor to multiply the p99 of the recent round trip times with to use as timeout (capped by the timeout), 0 to disable.", required=False)
+        parser.add_argument("--adaptive_timeout_min", metavar="SEC", type=float, default=0.5, help="The minimum timeout in seconds when using the adaptive timeout.", required=False)
+        add_compression_options(parser)
+        add_journal_options(parser)
+        add_drain_option(parser)
+        add_stats_options(parser)
+        return parser
+
+    def _apply_args(self, ns: argparse.Namespace):
+        """
+        Initializes the object with the arguments of the parsed namespace.
+
+        :param ns: the parsed arguments
+        :type ns: argparse.Namespace
+        """
+        super()._apply_args(ns)
+        self.redis_unix_socket = ns.redis_unix_socket
+        self.circuit_threshold = ns.circuit_threshold
+        self.circuit_probe_interval = ns.circuit_probe_interval
+        self.adaptive_timeout_factor = ns.adaptive_timeout_factor
+        self.adaptive_timeout_min = ns.adaptive_timeout_min
+        self.compression = ns.compression
+        self.compression_level = ns.compression_level
+        self.compression_min_size = ns.compression_min_size
+        self.journal = ns.journal
+        self.journal_batch_size = ns.journal_batch_size
+        self.journal_flush_interval = ns.journal_flush_interval
+        self.drain_timeout = ns.drain_timeout
+        self.stats = ns.stats
+        self.stats_interval = ns.stats_interval
+        self.stats_export = ns.stats_export
+
+    def initialize(self):
+        """
+        Initializes the processing, e.g., for opening files or databases.
+        """
+        super().initialize()
+        # share connection pool and pubsub with the other redis plugins in the pipeline
+        self._client = acquire_client(self.redis_host, self.redis_port, self.redis_db,
+                                      redis_unix_socket=self.redis_unix_socket)
+        self._redis_session.connection = self._client.connection
+        self._pubsub = self._client.pubsub(sleep_time=self.sleep_time)
+        if self.circuit_threshold is None:
+            self.circuit_threshold = 0
+        if self.circuit_probe_interval is None:
+            self.circuit_probe_interval = 10.0
+        if self.adaptive_timeout_factor is None:
+            self.adaptive_timeout_factor = 0.0
+        if self.adaptive_timeout_min is None:
+            self.adaptive_timeout_min = 0.5
+        if self.stats is None:
+            self.stats = False
+        if self.drain_timeout is None:
+            self.drain_timeout = DEFAULT_DRAIN_TIMEOUT
+        if self.drain_timeout > 0:
+            install_shutdown_handler()
+        self._outstanding = None
+        self._waiting = None
+        self._late = deque()
+        self._num_discarded = 0
+        self._circuit = None
+        if self.circuit_threshold > 0:
+            self._circuit = CircuitBreaker(self.circuit_threshold, self.circuit_probe_interval, logger=self.logger())
+        self._adaptive_timeout = None
+        if (self.adaptive_timeout_factor > 0) and (self.timeout > 0):
+            self._adaptive_timeout = AdaptiveTimeout(self.adaptive_timeout_factor, self.adaptive_timeout_min, self.timeout)
+        self._compressor = create_compressor(self.compression, level=self.compression_level,
+                                             min_size=self.compression_min_size)
+        self._journal = create_journal(self.journal, self._redis_session.connection, batch_size=self.journal_batch_size,
+                                       flush_interval=self.journal_flush_interval, logger=self.logger())
+        self._num_journaled = 0
+        self._stats = create_stats_reporter(self.stats, self.name(), self.logger(),
+                                            interval=self.stats_interval, export=self.stats_export)
+        self._pubsub.subscribe(self._redis_session.channel_in, self._on_reply)
+
+    def _payload(self, item) -> bytes:
+        """
+        Returns the image bytes to send. Uses the binary data of the container as is
+        if available, only re-encodes the image if there is none.
+
+        :param item: the image data to send
+        :return: the bytes
+        :rtype: bytes
+        """
+        if item.data is not None:
+            return item.data
+        return item.image_bytes
+
+    def _on_reply(self, message):
+        """
+        Assigns the prediction to the image waiting for it, gets executed in the worker thread of the shared pubsub.
+        As the predictions carry no reference to their image, they are matched by their order: the models
+        respond in the order the images were sent, i.e., while images that timed out are still awaiting their
+        prediction, the prediction belongs to the oldest of them and gets discarded.
+
+        :param message: the pubsub message
+        :type message: dict
+        """
+        with self._reply_lock:
+            now = perf_counter()
+            # e.g., the model got restarted
+            while (len(self._late) > 0) and (self._late[0] < now):
+                self._late.popleft()
+            if len(self._late) > 0:
+                self._late.popleft()
+                self._discard()
+                return
+            if self._waiting is None:
+                self._discard()
+                return
+            session, arrived = self._waiting
+            self._waiting = None
+            session.received = now
+            session.data = message['data']
+            arrived.set()
+
+    def _discard(self):
+        """
+        Counts the discarded prediction, i.e., one that arrived after its image timed out.
+        """
+        self._num_discarded += 1
+        if self._stats is not None:
+            self._stats.set_counter("discarded", self._num_discarded)
+
+    def _receive(self, item, payload=None, key: str = None):
+        """
+        Sends the image of the item to the model and waits for the prediction to arrive.
+
+        :param item: the image data to send
+        :param payload: the image bytes to send, determined from the item if None
+        :param key: the journal key of the item, if any
+        :type key: str
+        :return: the received data, None if timed out
+        """
+        session = self._redis_session
+        session.data = None
+        session.received = None
+        if (self._circuit is not None) and (self._circuit.state == CIRCUIT_HALF_OPEN):
+            # probe with the configured timeout
+            session.timeout = self.timeout
+        elif self._adaptive_timeout is not None:
+            session.timeout = self._adaptive_timeout.current()
+        arrived = threading.Event()
+        with self._reply_lock:
+            self._waiting = (session, arrived)
+        try:
+            if payload is None:
+                with timed(self._stats, STAGE_ENCODE):
+                    payload = self._payload(item)
+            if self._compressor.enabled:
+                with timed(self._stats, STAGE_COMPRESS):
+                    payload = self._compressor.compress(payload)
+            with timed(self._stats, STAGE_PUBLISH):
+                receivers = session.connection.publish(session.channel_out, payload)
+            if receivers == 0:
+                # no model listening (anymore), i.e., no predictions to come for timed out images either
+                with self._reply_lock:
+                    self._late.clear()
+
+            # wait for data to show up
+            start = perf_counter()
+            if not arrived.wait(session.timeout if session.timeout > 0 else None):
+                with self._reply_lock:
+                    if not arrived.is_set():
+                        self._waiting = None
+                        # the late prediction must not get used for the next image
+                        if receivers > 0:
+                            self._late.append(perf_counter() + LATE_PREDICTION_EXPIRY * self.timeout)
+                        self.logger().warning("Timeout reached!")
+                if (session.data is None) and (self._adaptive_timeout is not None):
+                    self._adaptive_timeout.record_timeout()
+            end = perf_counter()
+        except BaseException:
+            # e.g., KeyboardInterrupt: keep waiting, the prediction can still get drained in finalize
+            self._outstanding = (session, arrived, key)
+            raise
+
+        if session.data is not None:
+            self.logger().info("Round trip time: %f sec" % (end - start))
+            if self._adaptive_timeout is not None:
+                self._adaptive_timeout.add(end - start)
+            if self._stats is not None:
+                received = max(start, session.received)
+                self._stats.add(STAGE_WAIT, received - start)
+                self._stats.add(STAGE_POLL, end - received)
+
+        # compressed predictions are detected automatically
+        if (session.data is not None) and is_compressed(session.data):
+            with timed(self._stats, STAGE_DECOMPRESS):
+                session.data = self._compressor.decompress(session.data)
+
+        return session.data
+
+    @abc.abstractmethod
+    def _process_data(self, item, data):
+        """
+        For processing the received data.
+
+        :param item: the image data that was sent via redis
+        :type item: ImageData
+        :param data: the received (decompressed) prediction
+        :type data: bytes
+        :return: the generated output data
+        :rtype: ImageData
+        """
+        raise NotImplementedError()
+
+    def _do_process(self, data):
+        """
+        Processes the data record(s).
+
+        :param data: the record(s) to process
+        :return: the potentially updated record(s)
+        """
+        result = []
+
+        for item in make_list(data):
+            if self._stop_accepting():
+                self.logger().warning("Shutting down, not sending any more images")
+                if self.session is not None:
+                    self.session.stopped = True
+                break
+
+            payload = None
+            key = None
+            received = None
+
+            # already journaled?
+            if self._journal is not None:
+                with timed(self._stats, STAGE_ENCODE):
+                    payload = self._payload(item)
+                with timed(self._stats, STAGE_JOURNAL):
+                    key = journal_key(item.image_name, payload)
+                    received = self._journal.get(key)
+                if received is not None:
+                    self._num_journaled += 1
+                    self.logger().info("Using journaled prediction: %s" % item.image_name)
+                    if is_compressed(received):
+                        with timed(self._stats, STAGE_DECOMPRESS):
+                            received = self._compressor.decompress(received)
+
+            # make prediction, unless journaled or failing fast
+            if (received is None) and ((self._circuit is None) or self._circuit.allow_request()):
+                received = self._receive(item, payload=payload, key=key)
+                if self._circuit is not None:
+                    if received is None:
+                        self._circuit.record_timeout()
+                    else:
+                        self._circuit.record_success()
+                if (received is not None) and (self._journal is not None):
+                    self._journal.put(key, self._compressor.compress(received))
+
+            if received is None:
+                if self.timeout_action == TIMEOUT_ACTION_DROP:
+                    continue
+                elif self.timeout_action == TIMEOUT_ACTION_INPUT:
+                    result.append(item)
+                    continue
+                else:
+                    raise Exception("Unhandled timeout action: %s" % self.timeout_action)
+
+            # process data
+            item_new = self._process_data(item, received)
+            if self._stats is not None:
+                self._stats.item_done()
+
+            if item_new is not None:
+                result.append(item_new)
+
+        return flatten_list(result)
+
+    def _stop_accepting(self) -> bool:
+        """
+        Determines whether to stop sending images, due to a shutdown request. Images keep getting
+        sent while upstream plugins are draining their buffers, until the drain timeout is reached.
+
+        :return: True if to stop
+        :rtype: bool
+        """
+        if (self.drain_timeout <= 0) or not shutdown_requested():
+            return False
+        return (not has_drain_sources()) or (drain_remaining(self.drain_timeout) <= 0)
+
+    def _drain_outstanding(self):
+        """
+        Waits for the prediction of the image that was sent before the processing got interrupted
+        and records it in the journal, so that the model's work isn't lost when resuming.
+        """
+        if self._outstanding is None:
+            return
+        session, arrived, key = self._outstanding
+        self._outstanding = None
+        try:
+            if (self._journal is None) or (key is None):
+                self.logger().warning("Discarding outstanding prediction, no journal to record it in")
+                return
+            if arrived.wait(self.drain_timeout) and (session.data is not None):
+                received = session.data
+                if not is_compressed(received):
+                    received = self._compressor.compress(received)
+                self._journal.put(key, received)
+                self.logger().info("Recorded outstanding prediction in journal")
+            else:
+                self.logger().warning("Outstanding prediction did not arrive within drain timeout")
+        finally:
+            with self._reply_lock:
+                self._waiting = None
+
+    def finalize(self):
+        """
+        Finishes the processing, e.g., for closing files or databases.
+        """
+        if self._client is not None:
+            self._drain_outstanding()
+            self._pubsub.unsubscribe(self._redis_session.channel_in, self._on_reply)
+            if self._num_discarded > 0:
+                self.logger().warning("Discarded %d prediction(s) that arrived after the timeout" % self._num_discarded)
+        if self._journal is not None:
+            self._journal.close()
+            self.logger().info("Journal - items served from journal: %d, entries written: %d" % (self._num_journaled, self._journal.num_written))
+            self._journal = None
+        if self._stats is not None:
+            self._stats.close()
+            self._stats = None
+        if self._client is not None:
+            release_client(self._client)
+            self._client = None
+            self._pubsub = None
+        super().finalize()
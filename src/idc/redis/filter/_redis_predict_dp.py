@@ -1,13 +1,15 @@
 import argparse
 import io
-import numpy as np
-from typing import List
+from typing import List, TYPE_CHECKING
 
-from PIL import Image
 from wai.logging import LOGGING_WARNING
 
-from kasperl.redis.filter import AbstractRedisPubSubFilter
-from idc.api import DepthData
+from idc.api import DepthData, DepthInformation
+from idc.redis.api import STAGE_DECODE, STAGE_BUILD, timed, load_npy_from_bytes, resize_bilinear
+from ._redis_predict import AbstractRedisPredict
+
+if TYPE_CHECKING:
+    import numpy as np
 
 FORMAT_GRAYSCALE = "grayscale"
 FORMAT_GRAYSCALE_DEPTH = "grayscale-depth"
@@ -19,7 +21,7 @@ FORMATS = [
 ]
 
 
-class DepthRedisPredict(AbstractRedisPubSubFilter):
+class DepthRedisPredict(AbstractRedisPredict):
     """
     Makes depth information predictions via Redis backend.
     """
@@ -27,6 +29,15 @@ class DepthRedisPredict(AbstractRedisPubSubFilter):
     def __init__(self, redis_host: str = None, redis_port: int = None, redis_db: int = None,
                  channel_out: str = None, channel_in: str = None, timeout: float = None,
                  timeout_action: str = None, sleep_time: float = None, data_format: str = None,
+                 depth_scale: float = None, depth_offset: float = None, invalid_value: float = None,
+                 min_depth: float = None, max_depth: float = None, invalid_fill: float = None,
+                 circuit_threshold: int = None, circuit_probe_interval: float = None,
+                 adaptive_timeout_factor: float = None, adaptive_timeout_min: float = None,
+                 compression: str = None, compression_level: int = None, compression_min_size: int = None,
+                 journal: str = None, journal_batch_size: int = None, journal_flush_interval: float = None,
+                 drain_timeout: float = None,
+                 stats: bool = False, stats_interval: int = None, stats_export: str = None,
+                 redis_unix_socket: str = None,
                  logger_name: str = None, logging_level: str = LOGGING_WARNING):
         """
         Initializes the filter.
@@ -49,16 +60,71 @@ class DepthRedisPredict(AbstractRedisPubSubFilter):
         :type sleep_time: float
         :param data_format: the format of the predictions
         :type data_format: str
+        :param depth_scale: the factor to multiply the grayscale-depth values with to obtain the depth
+        :type depth_scale: float
+        :param depth_offset: the offset to add to the scaled grayscale-depth values to obtain the depth
+        :type depth_offset: float
+        :param invalid_value: the received value that marks invalid depth, ignored if None
+        :type invalid_value: float
+        :param min_depth: the smallest valid depth, ignored if None
+        :type min_depth: float
+        :param max_depth: the largest valid depth, ignored if None
+        :type max_depth: float
+        :param invalid_fill: the value to use for invalid depth, NaN if None
+        :type invalid_fill: float
+        :param circuit_threshold: the number of consecutive timeouts after which to fail fast, 0 to disable
+        :type circuit_threshold: int
+        :param circuit_probe_interval: the time in seconds after which to probe the backend again when failing fast
+        :type circuit_probe_interval: float
+        :param adaptive_timeout_factor: the factor for the p99 of the round trip times to use as timeout, 0 to disable
+        :type adaptive_timeout_factor: float
+        :param adaptive_timeout_min: the minimum timeout in seconds when using the adaptive timeout
+        :type adaptive_timeout_min: float
+        :param compression: the codec to compress the images with (none/lz4/zstd)
+        :type compression: str
+        :param compression_level: the compression level, uses the codec's default if None
+        :type compression_level: int
+        :param compression_min_size: the minimum size in bytes for images to get compressed
+        :type compression_min_size: int
+        :param journal: the journal for the predictions of completed images (sqlite:FILE or redis:HASH), ignored if None
+        :type journal: str
+        :param journal_batch_size: the number of journal entries to write in one go
+        :type journal_batch_size: int
+        :param journal_flush_interval: the maximum time in seconds before pending journal entries get written
+        :type journal_flush_interval: float
+        :param drain_timeout: the maximum time in seconds for draining when receiving SIGTERM, 0 to disable
+        :type drain_timeout: float
+        :param stats: whether to collect timing statistics
+        :type stats: bool
+        :param stats_interval: the number of items after which to output the statistics, 0 for only when finishing
+        :type stats_interval: int
+        :param stats_export: where to export the statistics to (prometheus:FILE or statsd:HOST:PORT)
+        :type stats_export: str
+        :param redis_unix_socket: the unix socket to connect to instead of host/port, ignored if None
+        :type redis_unix_socket: str
         :param logger_name: the name to use for the logger
         :type logger_name: str
         :param logging_level: the logging level to use
         :type logging_level: str
         """
         super().__init__(redis_host=redis_host, redis_port=redis_port, redis_db=redis_db,
+                         redis_unix_socket=redis_unix_socket,
                          channel_out=channel_out, channel_in=channel_in, timeout=timeout,
                          timeout_action=timeout_action, sleep_time=sleep_time,
+                         circuit_threshold=circuit_threshold, circuit_probe_interval=circuit_probe_interval,
+                         adaptive_timeout_factor=adaptive_timeout_factor, adaptive_timeout_min=adaptive_timeout_min,
+                         compression=compression, compression_level=compression_level, compression_min_size=compression_min_size,
+                         journal=journal, journal_batch_size=journal_batch_size, journal_flush_interval=journal_flush_interval,
+                         drain_timeout=drain_timeout,
+                         stats=stats, stats_interval=stats_interval, stats_export=stats_export,
                          logger_name=logger_name, logging_level=logging_level)
         self.data_format = data_format
+        self.depth_scale = depth_scale
+        self.depth_offset = depth_offset
+        self.invalid_value = invalid_value
+        self.min_depth = min_depth
+        self.max_depth = max_depth
+        self.invalid_fill = invalid_fill
 
     def name(self) -> str:
         """
@@ -78,24 +144,6 @@ class DepthRedisPredict(AbstractRedisPubSubFilter):
         """
         return "Makes depth information predictions via Redis backend."
 
-    def _default_channel_out(self):
-        """
-        Returns the default channel for broadcasting the filtered data.
-
-        :return: the default channel
-        :rtype: str
-        """
-        return "images"
-
-    def _default_channel_in(self):
-        """
-        Returns the default channel for the incoming data.
-
-        :return: the default channel
-        :rtype: str
-        """
-        return "predictions"
-
     def accepts(self) -> List:
         """
         Returns the list of classes that are accepted.
@@ -123,6 +171,12 @@ class DepthRedisPredict(AbstractRedisPubSubFilter):
         """
         parser = super()._create_argparser()
         parser.add_argument("--data_format", choices=FORMATS, help="The data format of the predictions.", default=FORMAT_GRAYSCALE, required=False)
+        parser.add_argument("--depth_scale", metavar="FACTOR", type=float, help="The factor to multiply the grayscale-depth values with to obtain the depth, e.g., 0.001 for 16-bit images in mm to get meters.", default=1.0, required=False)
+        parser.add_argument("--depth_offset", metavar="OFFSET", type=float, help="The offset to add to the scaled grayscale-depth values to obtain the depth.", default=0.0, required=False)
+        parser.add_argument("--invalid_value", metavar="VALUE", type=float, help="The received value (before scaling) that marks invalid depth, e.g., 0.", default=None, required=False)
+        parser.add_argument("--min_depth", metavar="DEPTH", type=float, help="The smallest valid depth, smaller values are considered invalid.", default=None, required=False)
+        parser.add_argument("--max_depth", metavar="DEPTH", type=float, help="The largest valid depth, larger values are considered invalid.", default=None, required=False)
+        parser.add_argument("--invalid_fill", metavar="VALUE", type=float, help="The value to use for invalid depth.", default=float("nan"), required=False)
         return parser
 
     def _apply_args(self, ns: argparse.Namespace):
@@ -134,6 +188,12 @@ class DepthRedisPredict(AbstractRedisPubSubFilter):
         """
         super()._apply_args(ns)
         self.data_format = ns.data_format
+        self.depth_scale = ns.depth_scale
+        self.depth_offset = ns.depth_offset
+        self.invalid_value = ns.invalid_value
+        self.min_depth = ns.min_depth
+        self.max_depth = ns.max_depth
+        self.invalid_fill = ns.invalid_fill
 
     def initialize(self):
         """
@@ -142,45 +202,94 @@ class DepthRedisPredict(AbstractRedisPubSubFilter):
         super().initialize()
         if self.data_format is None:
             self.data_format = FORMAT_GRAYSCALE
+        if self.depth_scale is None:
+            self.depth_scale = 1.0
+        if self.depth_offset is None:
+            self.depth_offset = 0.0
+        if self.invalid_fill is None:
+            self.invalid_fill = float("nan")
 
-    def _fix_size(self, img, width, height):
+    def _decode(self, data) -> "np.ndarray":
         """
-        Fixes the size of the received image, if necessary.
+        Decodes the received data into a 2-dim array.
 
-        :param img: the to resize
-        :type img: Image.Image
+        :param data: the received data
+        :return: the array, can be read-only
+        :rtype: np.ndarray
+        """
+        import numpy as np
+        if self.data_format == FORMAT_NUMPY:
+            arr = load_npy_from_bytes(data)
+        elif self.data_format in [FORMAT_GRAYSCALE, FORMAT_GRAYSCALE_DEPTH]:
+            from PIL import Image
+            img = Image.open(io.BytesIO(data))
+            # 8-bit, 16-bit, 32-bit integer and float images can be used as is
+            if img.mode not in ["L", "I;16", "I", "F"]:
+                img = img.convert("L")
+            arr = np.asarray(img)
+        else:
+            raise Exception("Unsupported format: %s" % self.data_format)
+        if arr.ndim == 3 and arr.shape[2] == 1:
+            arr = arr[:, :, 0]
+        if arr.ndim != 2:
+            raise Exception("Depth information must have two dimensions, but got instead: %s" % str(arr.shape))
+        return arr
+
+    def _to_depth(self, arr: "np.ndarray", width: int, height: int) -> "np.ndarray":
+        """
+        Turns the decoded array into float32 depth of the required size, applying scale/offset and masking.
+
+        :param arr: the decoded array
+        :type arr: np.ndarray
         :param width: the required width
         :type width: int
         :param height: the required height
         :type height: int
-        :return: the (potentially) resized image
-        :rtype: Image.Image
+        :return: the depth
+        :rtype: np.ndarray
         """
-        if (img.width == width) and (img.height == height):
-            return img
-        else:
-            return img.resize((width, height), Image.Resampling.BILINEAR)
+        import numpy as np
+        invalid = None
+        if self.invalid_value is not None:
+            invalid = (arr == self.invalid_value)
+        # always a copy, i.e., writable even if the received data was read-only
+        depth = arr.astype(np.float32)
+        if self.data_format == FORMAT_GRAYSCALE_DEPTH:
+            if self.depth_scale != 1.0:
+                depth *= self.depth_scale
+            if self.depth_offset != 0.0:
+                depth += self.depth_offset
+        if self.min_depth is not None:
+            invalid = (depth < self.min_depth) if (invalid is None) else (invalid | (depth < self.min_depth))
+        if self.max_depth is not None:
+            invalid = (depth > self.max_depth) if (invalid is None) else (invalid | (depth > self.max_depth))
+        # mask before resizing, so that invalid values don't get blended into valid ones
+        if invalid is not None:
+            depth[invalid] = np.nan
+        depth = resize_bilinear(depth, width, height)
+        if (invalid is not None) and not np.isnan(self.invalid_fill):
+            depth[np.isnan(depth)] = self.invalid_fill
+        return depth
 
     def _process_data(self, item: DepthData, data):
         """
         For processing the received data.
 
         :param item: the image data that was sent via redis
-        :param data: the received data
+        :type item: DepthData
+        :param data: the received (decompressed) prediction
+        :type data: bytes
         :return: the generated output data
+        :rtype: DepthData
         """
         w = item.image_width
         h = item.image_height
 
         # convert received data
-        if self.data_format == FORMAT_GRAYSCALE:
-            annotations = self._fix_size(Image.open(io.BytesIO(data)), w, h)
-        elif self.data_format == FORMAT_GRAYSCALE_DEPTH:
-            annotations = self._fix_size(Image.open(io.BytesIO(data)), w, h)
-        elif self.data_format == FORMAT_NUMPY:
-            annotations = np.load(io.BytesIO(data))
-        else:
-            raise Exception("Unsupported format: %s" % self.data_format)
+        with timed(self._stats, STAGE_DECODE):
+            arr = self._decode(data)
 
-        return DepthData(source=item.source, image_name=item.image_name, data=item.data,
-                         annotation=annotations, metadata=item.get_metadata())
+        with timed(self._stats, STAGE_BUILD):
+            annotations = DepthInformation(self._to_depth(arr, w, h))
+            return DepthData(source=item.source, image_name=item.image_name, data=item.data,
+                             annotation=annotations, metadata=item.get_metadata())
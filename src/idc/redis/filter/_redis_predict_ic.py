@@ -1,16 +1,21 @@
 import argparse
+import heapq
 import json
 import logging
-from typing import List
+from operator import itemgetter
+from typing import List, Optional, Tuple, TYPE_CHECKING
 
 from wai.logging import LOGGING_WARNING
 
-from kasperl.api import safe_deepcopy
-from kasperl.redis.filter import AbstractRedisPubSubFilter
 from idc.api import ImageClassificationData
+from idc.redis.api import STAGE_DECODE, STAGE_BUILD, timed, load_npy_from_bytes
+from ._redis_predict import AbstractRedisPredict
 
+if TYPE_CHECKING:
+    import numpy as np
 
-class ImageClassificationRedisPredict(AbstractRedisPubSubFilter):
+
+class ImageClassificationRedisPredict(AbstractRedisPredict):
     """
     Makes image classification predictions via Redis backend.
     """
@@ -18,6 +23,14 @@ class ImageClassificationRedisPredict(AbstractRedisPubSubFilter):
     def __init__(self, redis_host: str = None, redis_port: int = None, redis_db: int = None,
                  channel_out: str = None, channel_in: str = None, timeout: float = None,
                  timeout_action: str = None, sleep_time: float = None, key_raw: str = None,
+                 top_k: int = None, min_prob: float = None, labels: List[str] = None, labels_key: str = None,
+                 circuit_threshold: int = None, circuit_probe_interval: float = None,
+                 adaptive_timeout_factor: float = None, adaptive_timeout_min: float = None,
+                 compression: str = None, compression_level: int = None, compression_min_size: int = None,
+                 journal: str = None, journal_batch_size: int = None, journal_flush_interval: float = None,
+                 drain_timeout: float = None,
+                 stats: bool = False, stats_interval: int = None, stats_export: str = None,
+                 redis_unix_socket: str = None,
                  logger_name: str = None, logging_level: str = LOGGING_WARNING):
         """
         Initializes the filter.
@@ -38,18 +51,68 @@ class ImageClassificationRedisPredict(AbstractRedisPubSubFilter):
         :type timeout_action: str
         :param sleep_time: the time in seconds between polls
         :type sleep_time: float
-        :param key_raw: the key in the meta-data to store the full prediction result under
+        :param key_raw: the key in the meta-data to store the full prediction result under (dictionary-form predictions get stored as received without top_k/min_prob)
         :type key_raw: str
+        :param top_k: the number of best classes to keep in the raw result, 0 for all
+        :type top_k: int
+        :param min_prob: the minimum probability for classes to be kept in the raw result and to be used as label
+        :type min_prob: float
+        :param labels: the labels for array-form predictions
+        :type labels: list
+        :param labels_key: the redis key to read the labels for array-form predictions from (JSON array), once
+        :type labels_key: str
+        :param circuit_threshold: the number of consecutive timeouts after which to fail fast, 0 to disable
+        :type circuit_threshold: int
+        :param circuit_probe_interval: the time in seconds after which to probe the backend again when failing fast
+        :type circuit_probe_interval: float
+        :param adaptive_timeout_factor: the factor for the p99 of the round trip times to use as timeout, 0 to disable
+        :type adaptive_timeout_factor: float
+        :param adaptive_timeout_min: the minimum timeout in seconds when using the adaptive timeout
+        :type adaptive_timeout_min: float
+        :param compression: the codec to compress the images with (none/lz4/zstd)
+        :type compression: str
+        :param compression_level: the compression level, uses the codec's default if None
+        :type compression_level: int
+        :param compression_min_size: the minimum size in bytes for images to get compressed
+        :type compression_min_size: int
+        :param journal: the journal for the predictions of completed images (sqlite:FILE or redis:HASH), ignored if None
+        :type journal: str
+        :param journal_batch_size: the number of journal entries to write in one go
+        :type journal_batch_size: int
+        :param journal_flush_interval: the maximum time in seconds before pending journal entries get written
+        :type journal_flush_interval: float
+        :param drain_timeout: the maximum time in seconds for draining when receiving SIGTERM, 0 to disable
+        :type drain_timeout: float
+        :param stats: whether to collect timing statistics
+        :type stats: bool
+        :param stats_interval: the number of items after which to output the statistics, 0 for only when finishing
+        :type stats_interval: int
+        :param stats_export: where to export the statistics to (prometheus:FILE or statsd:HOST:PORT)
+        :type stats_export: str
+        :param redis_unix_socket: the unix socket to connect to instead of host/port, ignored if None
+        :type redis_unix_socket: str
         :param logger_name: the name to use for the logger
         :type logger_name: str
         :param logging_level: the logging level to use
         :type logging_level: str
         """
         super().__init__(redis_host=redis_host, redis_port=redis_port, redis_db=redis_db,
+                         redis_unix_socket=redis_unix_socket,
                          channel_out=channel_out, channel_in=channel_in, timeout=timeout,
                          timeout_action=timeout_action, sleep_time=sleep_time,
+                         circuit_threshold=circuit_threshold, circuit_probe_interval=circuit_probe_interval,
+                         adaptive_timeout_factor=adaptive_timeout_factor, adaptive_timeout_min=adaptive_timeout_min,
+                         compression=compression, compression_level=compression_level, compression_min_size=compression_min_size,
+                         journal=journal, journal_batch_size=journal_batch_size, journal_flush_interval=journal_flush_interval,
+                         drain_timeout=drain_timeout,
+                         stats=stats, stats_interval=stats_interval, stats_export=stats_export,
                          logger_name=logger_name, logging_level=logging_level)
         self.key_raw = key_raw
+        self.top_k = top_k
+        self.min_prob = min_prob
+        self.labels = labels
+        self.labels_key = labels_key
+        self._labels = None
 
     def name(self) -> str:
         """
@@ -77,7 +140,11 @@ class ImageClassificationRedisPredict(AbstractRedisPubSubFilter):
         :rtype: argparse.ArgumentParser
         """
         parser = super()._create_argparser()
-        parser.add_argument("--key_raw", metavar="KEY", type=str, default=None, help="The key in the meta-data to store the raw prediction result under.")
+        parser.add_argument("--key_raw", metavar="KEY", type=str, default=None, help="The key in the meta-data to store the raw prediction result under; in descending order of probability, except for dictionary-form predictions without --top_k/--min_prob, which get stored as received.")
+        parser.add_argument("--top_k", metavar="K", type=int, default=0, help="The number of best classes to keep in the raw prediction result, 0 for all.", required=False)
+        parser.add_argument("--min_prob", metavar="PROB", type=float, default=0.0, help="The minimum probability for classes to be kept in the raw prediction result and to be used as label.", required=False)
+        parser.add_argument("--labels", metavar="LABEL", type=str, default=None, help="The labels for array-form predictions (npy or JSON array of probabilities).", nargs="+")
+        parser.add_argument("--labels_key", metavar="KEY", type=str, default=None, help="The key in Redis to read the labels for array-form predictions from (JSON array), read once; alternative to --labels.", required=False)
         return parser
 
     def _apply_args(self, ns: argparse.Namespace):
@@ -89,24 +156,21 @@ class ImageClassificationRedisPredict(AbstractRedisPubSubFilter):
         """
         super()._apply_args(ns)
         self.key_raw = ns.key_raw
+        self.top_k = ns.top_k
+        self.min_prob = ns.min_prob
+        self.labels = ns.labels
+        self.labels_key = ns.labels_key
 
-    def _default_channel_out(self):
+    def initialize(self):
         """
-        Returns the default channel for broadcasting the filtered data.
-
-        :return: the default channel
-        :rtype: str
-        """
-        return "images"
-
-    def _default_channel_in(self):
+        Initializes the processing, e.g., for opening files or databases.
         """
-        Returns the default channel for the incoming data.
-
-        :return: the default channel
-        :rtype: str
-        """
-        return "predictions"
+        super().initialize()
+        if self.top_k is None:
+            self.top_k = 0
+        if self.min_prob is None:
+            self.min_prob = 0.0
+        self._labels = self.labels
 
     def accepts(self) -> List:
         """
@@ -126,38 +190,132 @@ class ImageClassificationRedisPredict(AbstractRedisPubSubFilter):
         """
         return [ImageClassificationData]
 
+    def _get_labels(self) -> List[str]:
+        """
+        Returns the labels for array-form predictions, reads them from redis the first time if necessary.
+
+        :return: the labels
+        :rtype: list
+        """
+        if self._labels is None:
+            if self.labels_key is None:
+                raise Exception("Received array-form prediction, but no labels defined (--labels or --labels_key)!")
+            labels = self._redis_session.connection.get(self.labels_key)
+            if labels is None:
+                raise Exception("No labels stored under key: %s" % self.labels_key)
+            self._labels = json.loads(labels)
+            self.logger().info("Read %d labels from key: %s" % (len(self._labels), self.labels_key))
+        return self._labels
+
+    def _rank_dict(self, data, preds: dict) -> Tuple[Optional[str], float, Optional[str]]:
+        """
+        Determines the best class and the raw result from the dictionary-form prediction.
+        Without top_k and min_prob, the raw result is the received data, i.e., the classes are in the
+        order the model sent them rather than in descending order of probability, as re-serializing
+        large predictions is expensive.
+
+        :param data: the received data
+        :param preds: the parsed prediction (label -> probability)
+        :type preds: dict
+        :return: the tuple of best label (None if no classes), its probability and raw result (None if not required)
+        :rtype: tuple
+        """
+        if len(preds) == 0:
+            return None, 0.0, (None if self.key_raw is None else "{}")
+        best = max(preds, key=preds.get)
+        raw = None
+        if self.key_raw is not None:
+            if (self.top_k <= 0) and (self.min_prob <= 0):
+                # store the result as received
+                raw = data.decode("utf-8") if isinstance(data, bytes) else data
+            else:
+                items = preds.items()
+                if self.min_prob > 0:
+                    items = [x for x in items if x[1] >= self.min_prob]
+                if self.top_k > 0:
+                    items = heapq.nlargest(self.top_k, items, key=itemgetter(1))
+                else:
+                    items = sorted(items, key=itemgetter(1), reverse=True)
+                raw = json.dumps(dict(items))
+        return best, preds[best], raw
+
+    def _rank_array(self, probs: "np.ndarray") -> Tuple[Optional[str], float, Optional[str]]:
+        """
+        Determines the best class and the raw result from the array-form prediction.
+
+        :param probs: the probabilities, in the order of the labels
+        :type probs: np.ndarray
+        :return: the tuple of best label (None if no classes), its probability and raw result (None if not required)
+        :rtype: tuple
+        """
+        import numpy as np
+        labels = self._get_labels()
+        probs = probs.ravel()
+        if len(probs) != len(labels):
+            raise Exception("Number of probabilities and labels differ: %d != %d" % (len(probs), len(labels)))
+        if len(probs) == 0:
+            return None, 0.0, (None if self.key_raw is None else "{}")
+        best = int(np.argmax(probs))
+        raw = None
+        if self.key_raw is not None:
+            if self.min_prob > 0:
+                indices = np.flatnonzero(probs >= self.min_prob)
+            else:
+                indices = np.arange(len(probs))
+            selected = probs[indices]
+            if (self.top_k > 0) and (self.top_k < len(indices)):
+                part = np.argpartition(selected, -self.top_k)[-self.top_k:]
+                indices = indices[part]
+                selected = selected[part]
+            # descending order (ties in label order), like the dictionary-form predictions
+            indices = indices[np.lexsort((indices, -selected))]
+            raw = json.dumps(dict(zip([labels[i] for i in indices.tolist()], probs[indices].tolist())))
+        return labels[best], float(probs[best]), raw
+
     def _process_data(self, item: ImageClassificationData, data):
         """
         For processing the received data.
 
         :param item: the image data that was sent via redis
-        :param data: the received data
+        :type item: ImageClassificationData
+        :param data: the received (decompressed) prediction
+        :type data: bytes
         :return: the generated output data
+        :rtype: ImageClassificationData
         """
         if self.logger().isEnabledFor(logging.DEBUG):
             self.logger().debug(data)
 
         # convert to wai.annotations annotations
-        preds = json.loads(data)
-        max_key = None
-        max_value = 0.0
-        for k in preds:
-            if preds[k] > max_value:
-                max_key = k
-                max_value = preds[k]
-
-        meta = item.get_metadata()
+        with timed(self._stats, STAGE_DECODE):
+            preds = None
+            probs = None
+            if data[:6] == b"\x93NUMPY":
+                probs = load_npy_from_bytes(data)
+            else:
+                preds = json.loads(data)
+                if isinstance(preds, list):
+                    import numpy as np
+                    probs = np.asarray(preds, dtype=np.float64)
 
-        # store raw result?
-        if self.key_raw is not None:
-            if meta is None:
-                meta = dict()
+        with timed(self._stats, STAGE_BUILD):
+            if probs is not None:
+                max_key, max_value, raw = self._rank_array(probs)
             else:
-                meta = safe_deepcopy(meta)
-            meta[self.key_raw] = json.dumps(preds)
+                max_key, max_value, raw = self._rank_dict(data, preds)
+            if (max_value <= 0.0) or (max_value < self.min_prob):
+                max_key = None
 
-        if self.logger().isEnabledFor(logging.DEBUG):
-            self.logger().debug("max_value=%f and max_key=%s" % (max_value, max_key))
+            meta = item.get_metadata()
+
+            # store raw result?
+            if self.key_raw is not None:
+                # only adding a top-level key, no need for a deep copy
+                meta = dict() if (meta is None) else dict(meta)
+                meta[self.key_raw] = raw
+
+            if self.logger().isEnabledFor(logging.DEBUG):
+                self.logger().debug("max_value=%f and max_key=%s" % (max_value, max_key))
 
-        return ImageClassificationData(source=item.source, image_name=item.image_name, data=item.data,
-                                       annotation=max_key, metadata=meta)
+            return ImageClassificationData(source=item.source, image_name=item.image_name, data=item.data,
+                                           annotation=max_key, metadata=meta)
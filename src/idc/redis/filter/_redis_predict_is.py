@@ -2,11 +2,11 @@ import argparse
 import io
 from typing import List
 
-from PIL import Image
 from wai.logging import LOGGING_WARNING
 
-from kasperl.redis.filter import AbstractRedisPubSubFilter
 from idc.api import ImageSegmentationData, imgseg_from_bluechannel, imgseg_from_grayscale, imgseg_from_indexedpng
+from idc.redis.api import STAGE_DECODE, STAGE_BUILD, timed
+from ._redis_predict import AbstractRedisPredict
 
 FORMAT_INDEXEDPNG = "indexedpng"
 FORMAT_BLUECHANNEL = "bluechannel"
@@ -18,7 +18,7 @@ FORMATS = [
 ]
 
 
-class ImageSegmentationRedisPredict(AbstractRedisPubSubFilter):
+class ImageSegmentationRedisPredict(AbstractRedisPredict):
     """
     Makes image segmentation predictions via Redis backend.
     """
@@ -27,6 +27,13 @@ class ImageSegmentationRedisPredict(AbstractRedisPubSubFilter):
                  channel_out: str = None, channel_in: str = None, timeout: float = None,
                  timeout_action: str = None, sleep_time: float = None,
                  image_format: str = None, labels: List[str] = None,
+                 circuit_threshold: int = None, circuit_probe_interval: float = None,
+                 adaptive_timeout_factor: float = None, adaptive_timeout_min: float = None,
+                 compression: str = None, compression_level: int = None, compression_min_size: int = None,
+                 journal: str = None, journal_batch_size: int = None, journal_flush_interval: float = None,
+                 drain_timeout: float = None,
+                 stats: bool = False, stats_interval: int = None, stats_export: str = None,
+                 redis_unix_socket: str = None,
                  logger_name: str = None, logging_level: str = LOGGING_WARNING):
         """
         Initializes the filter.
@@ -51,14 +58,51 @@ class ImageSegmentationRedisPredict(AbstractRedisPubSubFilter):
         :type image_format: str
         :param labels: the list of labels
         :type labels: list
+        :param circuit_threshold: the number of consecutive timeouts after which to fail fast, 0 to disable
+        :type circuit_threshold: int
+        :param circuit_probe_interval: the time in seconds after which to probe the backend again when failing fast
+        :type circuit_probe_interval: float
+        :param adaptive_timeout_factor: the factor for the p99 of the round trip times to use as timeout, 0 to disable
+        :type adaptive_timeout_factor: float
+        :param adaptive_timeout_min: the minimum timeout in seconds when using the adaptive timeout
+        :type adaptive_timeout_min: float
+        :param compression: the codec to compress the images with (none/lz4/zstd)
+        :type compression: str
+        :param compression_level: the compression level, uses the codec's default if None
+        :type compression_level: int
+        :param compression_min_size: the minimum size in bytes for images to get compressed
+        :type compression_min_size: int
+        :param journal: the journal for the predictions of completed images (sqlite:FILE or redis:HASH), ignored if None
+        :type journal: str
+        :param journal_batch_size: the number of journal entries to write in one go
+        :type journal_batch_size: int
+        :param journal_flush_interval: the maximum time in seconds before pending journal entries get written
+        :type journal_flush_interval: float
+        :param drain_timeout: the maximum time in seconds for draining when receiving SIGTERM, 0 to disable
+        :type drain_timeout: float
+        :param stats: whether to collect timing statistics
+        :type stats: bool
+        :param stats_interval: the number of items after which to output the statistics, 0 for only when finishing
+        :type stats_interval: int
+        :param stats_export: where to export the statistics to (prometheus:FILE or statsd:HOST:PORT)
+        :type stats_export: str
+        :param redis_unix_socket: the unix socket to connect to instead of host/port, ignored if None
+        :type redis_unix_socket: str
         :param logger_name: the name to use for the logger
         :type logger_name: str
         :param logging_level: the logging level to use
         :type logging_level: str
         """
         super().__init__(redis_host=redis_host, redis_port=redis_port, redis_db=redis_db,
+                         redis_unix_socket=redis_unix_socket,
                          channel_out=channel_out, channel_in=channel_in, timeout=timeout,
                          timeout_action=timeout_action, sleep_time=sleep_time,
+                         circuit_threshold=circuit_threshold, circuit_probe_interval=circuit_probe_interval,
+                         adaptive_timeout_factor=adaptive_timeout_factor, adaptive_timeout_min=adaptive_timeout_min,
+                         compression=compression, compression_level=compression_level, compression_min_size=compression_min_size,
+                         journal=journal, journal_batch_size=journal_batch_size, journal_flush_interval=journal_flush_interval,
+                         drain_timeout=drain_timeout,
+                         stats=stats, stats_interval=stats_interval, stats_export=stats_export,
                          logger_name=logger_name, logging_level=logging_level)
         self.image_format = image_format
         self.labels = labels
@@ -81,24 +125,6 @@ class ImageSegmentationRedisPredict(AbstractRedisPubSubFilter):
         """
         return "Makes image segmentation predictions via Redis backend."
 
-    def _default_channel_out(self):
-        """
-        Returns the default channel for broadcasting the filtered data.
-
-        :return: the default channel
-        :rtype: str
-        """
-        return "images"
-
-    def _default_channel_in(self):
-        """
-        Returns the default channel for the incoming data.
-
-        :return: the default channel
-        :rtype: str
-        """
-        return "predictions"
-
     def accepts(self) -> List:
         """
         Returns the list of classes that are accepted.
@@ -166,6 +192,7 @@ class ImageSegmentationRedisPredict(AbstractRedisPubSubFilter):
         if (img.width == width) and (img.height == height):
             return img
         else:
+            from PIL import Image
             return img.resize((width, height), Image.Resampling.BILINEAR)
 
     def _process_data(self, item: ImageSegmentationData, data):
@@ -173,8 +200,11 @@ class ImageSegmentationRedisPredict(AbstractRedisPubSubFilter):
         For processing the received data.
 
         :param item: the image data that was sent via redis
-        :param data: the received data
+        :type item: ImageSegmentationData
+        :param data: the received (decompressed) prediction
+        :type data: bytes
         :return: the generated output data
+        :rtype: ImageSegmentationData
         """
         w = item.image_width
         h = item.image_height
@@ -184,15 +214,21 @@ class ImageSegmentationRedisPredict(AbstractRedisPubSubFilter):
             label_mapping[i] = label
 
         # convert received image to indices
-        image = self._fix_size(Image.open(io.BytesIO(data)), w, h)
-        if self.image_format == FORMAT_INDEXEDPNG:
-            annotations = imgseg_from_indexedpng(image, self.labels, label_mapping, self.logger())
-        elif self.image_format == FORMAT_BLUECHANNEL:
-            annotations = imgseg_from_bluechannel(image, self.labels, label_mapping, self.logger())
-        elif self.image_format == FORMAT_GRAYSCALE:
-            annotations = imgseg_from_grayscale(image, self.labels, label_mapping, self.logger())
-        else:
-            raise Exception("Unsupported image format: %s" % self.image_format)
-
-        return ImageSegmentationData(source=item.source, image_name=item.image_name, data=item.data,
-                                     annotation=annotations, metadata=item.get_metadata())
+        with timed(self._stats, STAGE_DECODE):
+            from PIL import Image
+            image = Image.open(io.BytesIO(data))
+            image.load()
+            image = self._fix_size(image, w, h)
+
+        with timed(self._stats, STAGE_BUILD):
+            if self.image_format == FORMAT_INDEXEDPNG:
+                annotations = imgseg_from_indexedpng(image, self.labels, label_mapping, self.logger())
+            elif self.image_format == FORMAT_BLUECHANNEL:
+                annotations = imgseg_from_bluechannel(image, self.labels, label_mapping, self.logger())
+            elif self.image_format == FORMAT_GRAYSCALE:
+                annotations = imgseg_from_grayscale(image, self.labels, label_mapping, self.logger())
+            else:
+                raise Exception("Unsupported image format: %s" % self.image_format)
+
+            return ImageSegmentationData(source=item.source, image_name=item.image_name, data=item.data,
+                                         annotation=annotations, metadata=item.get_metadata())
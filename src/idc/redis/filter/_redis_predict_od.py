@@ -1,17 +1,19 @@
 import argparse
 import logging
-from typing import List
+from typing import List, TYPE_CHECKING
 
-from opex import ObjectPredictions
-from wai.common.adams.imaging.locateobjects import LocatedObjects, LocatedObject
-from wai.common.geometry import Polygon, Point
 from wai.logging import LOGGING_WARNING
 
-from kasperl.redis.filter import AbstractRedisPubSubFilter
 from idc.api import ObjectDetectionData
+from idc.redis.api import STAGE_DECODE, STAGE_BUILD, timed
+from ._redis_predict import AbstractRedisPredict
 
+if TYPE_CHECKING:
+    from opex import ObjectPredictions
+    from wai.common.adams.imaging.locateobjects import LocatedObjects
 
-class ObjectDetectionRedisPredict(AbstractRedisPubSubFilter):
+
+class ObjectDetectionRedisPredict(AbstractRedisPredict):
     """
     Makes object detection predictions in OPEX format via Redis backend.
     """
@@ -20,6 +22,13 @@ class ObjectDetectionRedisPredict(AbstractRedisPubSubFilter):
                  channel_out: str = None, channel_in: str = None, timeout: float = None,
                  sleep_time: float = None, timeout_action: str = None,
                  key_label: str = None, key_score: str = None,
+                 circuit_threshold: int = None, circuit_probe_interval: float = None,
+                 adaptive_timeout_factor: float = None, adaptive_timeout_min: float = None,
+                 compression: str = None, compression_level: int = None, compression_min_size: int = None,
+                 journal: str = None, journal_batch_size: int = None, journal_flush_interval: float = None,
+                 drain_timeout: float = None,
+                 stats: bool = False, stats_interval: int = None, stats_export: str = None,
+                 redis_unix_socket: str = None,
                  logger_name: str = None, logging_level: str = LOGGING_WARNING):
         """
         Initializes the filter.
@@ -44,14 +53,51 @@ class ObjectDetectionRedisPredict(AbstractRedisPubSubFilter):
         :type key_label: str
         :param key_score: the key in the meta-data for the score
         :type key_score: str
+        :param circuit_threshold: the number of consecutive timeouts after which to fail fast, 0 to disable
+        :type circuit_threshold: int
+        :param circuit_probe_interval: the time in seconds after which to probe the backend again when failing fast
+        :type circuit_probe_interval: float
+        :param adaptive_timeout_factor: the factor for the p99 of the round trip times to use as timeout, 0 to disable
+        :type adaptive_timeout_factor: float
+        :param adaptive_timeout_min: the minimum timeout in seconds when using the adaptive timeout
+        :type adaptive_timeout_min: float
+        :param compression: the codec to compress the images with (none/lz4/zstd)
+        :type compression: str
+        :param compression_level: the compression level, uses the codec's default if None
+        :type compression_level: int
+        :param compression_min_size: the minimum size in bytes for images to get compressed
+        :type compression_min_size: int
+        :param journal: the journal for the predictions of completed images (sqlite:FILE or redis:HASH), ignored if None
+        :type journal: str
+        :param journal_batch_size: the number of journal entries to write in one go
+        :type journal_batch_size: int
+        :param journal_flush_interval: the maximum time in seconds before pending journal entries get written
+        :type journal_flush_interval: float
+        :param drain_timeout: the maximum time in seconds for draining when receiving SIGTERM, 0 to disable
+        :type drain_timeout: float
+        :param stats: whether to collect timing statistics
+        :type stats: bool
+        :param stats_interval: the number of items after which to output the statistics, 0 for only when finishing
+        :type stats_interval: int
+        :param stats_export: where to export the statistics to (prometheus:FILE or statsd:HOST:PORT)
+        :type stats_export: str
+        :param redis_unix_socket: the unix socket to connect to instead of host/port, ignored if None
+        :type redis_unix_socket: str
         :param logger_name: the name to use for the logger
         :type logger_name: str
         :param logging_level: the logging level to use
         :type logging_level: str
         """
         super().__init__(redis_host=redis_host, redis_port=redis_port, redis_db=redis_db,
+                         redis_unix_socket=redis_unix_socket,
                          channel_out=channel_out, channel_in=channel_in, timeout=timeout,
                          timeout_action=timeout_action, sleep_time=sleep_time,
+                         circuit_threshold=circuit_threshold, circuit_probe_interval=circuit_probe_interval,
+                         adaptive_timeout_factor=adaptive_timeout_factor, adaptive_timeout_min=adaptive_timeout_min,
+                         compression=compression, compression_level=compression_level, compression_min_size=compression_min_size,
+                         journal=journal, journal_batch_size=journal_batch_size, journal_flush_interval=journal_flush_interval,
+                         drain_timeout=drain_timeout,
+                         stats=stats, stats_interval=stats_interval, stats_export=stats_export,
                          logger_name=logger_name, logging_level=logging_level)
         self.key_label = key_label
         self.key_score = key_score
@@ -83,24 +129,6 @@ class ObjectDetectionRedisPredict(AbstractRedisPubSubFilter):
         """
         return [ObjectDetectionData]
 
-    def _default_channel_out(self):
-        """
-        Returns the default channel for broadcasting the filtered data.
-
-        :return: the default channel
-        :rtype: str
-        """
-        return "images"
-
-    def _default_channel_in(self):
-        """
-        Returns the default channel for the incoming data.
-
-        :return: the default channel
-        :rtype: str
-        """
-        return "predictions"
-
     def generates(self) -> List:
         """
         Returns the list of classes that get produced.
@@ -148,13 +176,39 @@ class ObjectDetectionRedisPredict(AbstractRedisPubSubFilter):
         For processing the received data.
 
         :param item: the image data that was sent via redis
-        :param data: the received data
+        :type item: ObjectDetectionData
+        :param data: the received (decompressed) prediction
+        :type data: bytes
         :return: the generated output data
+        :rtype: ObjectDetectionData
         """
         if self.logger().isEnabledFor(logging.DEBUG):
             self.logger().debug(data)
 
-        oobjects = ObjectPredictions.from_json_string(data)
+        with timed(self._stats, STAGE_DECODE):
+            from opex import ObjectPredictions
+            oobjects = ObjectPredictions.from_json_string(data)
+
+        with timed(self._stats, STAGE_BUILD):
+            annotations = self._build_annotations(oobjects)
+
+        if self.logger().isEnabledFor(logging.DEBUG):
+            self.logger().debug("# annotations: %d" % len(annotations))
+
+        return ObjectDetectionData(source=item.source, image_name=item.image_name, data=item.data,
+                                   annotation=annotations, metadata=item.get_metadata())
+
+    def _build_annotations(self, oobjects: "ObjectPredictions") -> "LocatedObjects":
+        """
+        Turns the OPEX predictions into located objects.
+
+        :param oobjects: the predictions to convert
+        :type oobjects: ObjectPredictions
+        :return: the located objects
+        :rtype: LocatedObjects
+        """
+        from wai.common.adams.imaging.locateobjects import LocatedObjects, LocatedObject
+        from wai.common.geometry import Polygon, Point
         lobjects = []
         for oobject in oobjects.objects:
             # bbox
@@ -182,10 +236,4 @@ class ObjectDetectionRedisPredict(AbstractRedisPubSubFilter):
             located_object.set_polygon(lpoly)
             lobjects.append(located_object)
 
-        annotations = LocatedObjects(lobjects)
-
-        if self.logger().isEnabledFor(logging.DEBUG):
-            self.logger().debug("# annotations: %d" % len(annotations))
-
-        return ObjectDetectionData(source=item.source, image_name=item.image_name, data=item.data,
-                                   annotation=annotations, metadata=item.get_metadata())
+        return LocatedObjects(lobjects)
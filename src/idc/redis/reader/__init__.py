@@ -1 +1 @@
-from ._redis_image_listen import RedisImageReader
+from ._redis_image_listen import RedisImageReader, QUEUE_POLICY_DROP_OLDEST, QUEUE_POLICY_DROP_NEWEST, QUEUE_POLICY_BLOCK, QUEUE_POLICIES
@@ -1,12 +1,58 @@
 import argparse
 import io
-from typing import List
+import re
+import threading
+from collections import deque
+from time import perf_counter
+from typing import Dict, Iterable, List, Optional, Tuple
 
-from PIL import Image
 from wai.logging import LOGGING_WARNING
 
 from kasperl.redis.reader import AbstractRedisListener
 from idc.api import DATATYPES, data_type_to_class, DataTypeSupporter, ImageData
+from idc.redis.api import STAGE_WAIT, STAGE_POLL, STAGE_DECODE, STAGE_BUILD, timed, add_stats_options, create_stats_reporter
+from idc.redis.api import acquire_client, release_client, add_unix_socket_option
+from idc.redis.api import STAGE_DECOMPRESS, STAGE_DEDUP, is_compressed, create_compressor
+from idc.redis.api import DEFAULT_DRAIN_TIMEOUT, install_shutdown_handler, shutdown_requested, drain_remaining, add_drain_option
+from idc.redis.api import add_shutdown_callback, remove_shutdown_callback, register_drain_source, unregister_drain_source
+
+# the timeout actions of kasperl's AbstractRedisListener, which doesn't export them
+TIMEOUT_ACTION_KEEP_WAITING = "keep-waiting"
+TIMEOUT_ACTION_STOP = "stop"
+
+QUEUE_POLICY_DROP_OLDEST = "drop-oldest"
+QUEUE_POLICY_DROP_NEWEST = "drop-newest"
+QUEUE_POLICY_BLOCK = "block"
+QUEUE_POLICIES = [
+    QUEUE_POLICY_DROP_OLDEST,
+    QUEUE_POLICY_DROP_NEWEST,
+    QUEUE_POLICY_BLOCK,
+]
+
+DEFAULT_QUEUE_SIZE = 100
+
+BLPOP_SLICE = 1.0
+""" the maximum time in seconds to block in BLPOP, for noticing shutdown requests """
+
+BLPOP_MIN_TIMEOUT = 0.01
+""" the minimum timeout in seconds for BLPOP, as 0 blocks indefinitely (fractions require Redis 6+) """
+
+DEDUP_HASH_SIZE = 8
+""" the width/height of the difference hash, i.e., the hash has DEDUP_HASH_SIZE^2 bits """
+
+DEFAULT_KEY_CHANNEL = "channel"
+
+
+def is_pattern(channel: str) -> bool:
+    """
+    Checks whether the channel is a glob-style pattern, like "cam:*".
+
+    :param channel: the channel to check
+    :type channel: str
+    :return: True if a pattern
+    :rtype: bool
+    """
+    return ("*" in channel) or ("?" in channel) or ("[" in channel)
 
 
 class RedisImageReader(AbstractRedisListener, DataTypeSupporter):
@@ -14,6 +60,12 @@ class RedisImageReader(AbstractRedisListener, DataTypeSupporter):
     def __init__(self, redis_host: str = None, redis_port: int = None, redis_db: int = None,
                  channel_in: str = None, timeout: float = None, timeout_action: str = None,
                  sleep_time: float = None, data_type: str = None, prefix: str = None,
+                 channels_in: List[str] = None, key_channel: str = None,
+                 queue_size: int = None, queue_policy: str = None,
+                 every_nth: int = None, max_fps: float = None, dedup_threshold: int = None,
+                 drain_timeout: float = None,
+                 stats: bool = False, stats_interval: int = None, stats_export: str = None,
+                 redis_unix_socket: str = None,
                  logger_name: str = None, logging_level: str = LOGGING_WARNING):
         """
         Initializes the reader.
@@ -34,6 +86,30 @@ class RedisImageReader(AbstractRedisListener, DataTypeSupporter):
         :type sleep_time: float
         :param prefix: the prefix to use for the image names
         :type prefix: str
+        :param channels_in: additional channels or glob-style patterns to receive the data on
+        :type channels_in: list
+        :param key_channel: the key in the meta-data to store the source channel under when listening to several channels or patterns
+        :type key_channel: str
+        :param queue_size: the maximum number of images to buffer
+        :type queue_size: int
+        :param queue_policy: what to do when the buffer is full (drop-oldest/drop-newest) or whether to pull the images from a list (block)
+        :type queue_policy: str
+        :param every_nth: only forwards every n-th image, 1 for all
+        :type every_nth: int
+        :param max_fps: the maximum number of images per second to forward, 0 for no limit
+        :type max_fps: float
+        :param dedup_threshold: the maximum number of differing bits in the perceptual hash for an image to be considered a duplicate of the last forwarded one, -1 to disable
+        :type dedup_threshold: int
+        :param drain_timeout: the maximum time in seconds for forwarding the buffered images when receiving SIGTERM, 0 to disable
+        :type drain_timeout: float
+        :param stats: whether to collect timing statistics
+        :type stats: bool
+        :param stats_interval: the number of items after which to output the statistics, 0 for only when finishing
+        :type stats_interval: int
+        :param stats_export: where to export the statistics to (prometheus:FILE or statsd:HOST:PORT)
+        :type stats_export: str
+        :param redis_unix_socket: the unix socket to connect to instead of host/port, ignored if None
+        :type redis_unix_socket: str
         :param logger_name: the name to use for the logger
         :type logger_name: str
         :param logging_level: the logging level to use
@@ -42,10 +118,42 @@ class RedisImageReader(AbstractRedisListener, DataTypeSupporter):
         super().__init__(redis_host=redis_host, redis_port=redis_port, redis_db=redis_db,
                          channel_in=channel_in, timeout=timeout, timeout_action=timeout_action,
                          sleep_time=sleep_time, logger_name=logger_name, logging_level=logging_level)
+        self.redis_unix_socket = redis_unix_socket
         self.data_type = data_type
         self.prefix = prefix
+        self.channels_in = channels_in
+        self.key_channel = key_channel
+        self.queue_size = queue_size
+        self.queue_policy = queue_policy
+        self.every_nth = every_nth
+        self.max_fps = max_fps
+        self.dedup_threshold = dedup_threshold
+        self.drain_timeout = drain_timeout
+        self.stats = stats
+        self.stats_interval = stats_interval
+        self.stats_export = stats_export
         self._output_cls = None
         self._counter = None
+        self._stats = None
+        self._client = None
+        self._pubsub = None
+        self._queue = None
+        self._queue_cond = None
+        self._num_received = 0
+        self._num_dropped = 0
+        self._max_depth = 0
+        self._num_skipped = 0
+        self._num_duplicates = 0
+        self._channels = None
+        self._routing = False
+        self._frames: Dict[str, int] = dict()
+        self._forwarded: Dict[str, int] = dict()
+        self._last_forwarded: Dict[str, float] = dict()
+        self._last_hash: Dict[str, int] = dict()
+        self._channel_names: Dict[str, str] = dict()
+        self._compressor = None
+        self._accepting = False
+        self._finished = False
 
     def name(self) -> str:
         """
@@ -73,8 +181,18 @@ class RedisImageReader(AbstractRedisListener, DataTypeSupporter):
         :rtype: argparse.ArgumentParser
         """
         parser = super()._create_argparser()
+        add_unix_socket_option(parser)
         parser.add_argument("-T", "--data_type", choices=DATATYPES, type=str, default=None, help="The type of data to forward", required=True)
         parser.add_argument("-P", "--prefix", type=str, default=None, help="The prefix to use for the images", required=False)
+        parser.add_argument("--channels_in", metavar="CHANNEL", type=str, default=None, help="Additional channels or glob-style patterns (e.g., 'cam:*') to receive the images on; --channel_in can be a pattern as well. When listening to several channels or a pattern, the source channel gets stored in the meta-data and used in the image name.", nargs="+", required=False)
+        parser.add_argument("--key_channel", metavar="KEY", type=str, default=DEFAULT_KEY_CHANNEL, help="The key in the meta-data to store the source channel under when listening to several channels or patterns.", required=False)
+        parser.add_argument("--queue_size", metavar="NUM", type=int, default=DEFAULT_QUEUE_SIZE, help="The maximum number of images to buffer when the downstream processing is slower than the publisher.", required=False)
+        parser.add_argument("--queue_policy", choices=QUEUE_POLICIES, type=str, default=QUEUE_POLICY_DROP_OLDEST, help="What to do when the buffer is full: drop the oldest or the newest image; with block, the images get pulled from the Redis list with the name of the channel instead (publishers need to push the images onto the list), leaving them on the server until they get processed.", required=False)
+        parser.add_argument("--every_nth", metavar="N", type=int, default=1, help="Only forwards every n-th image, e.g., for sampling high-rate camera feeds; 1 for all.", required=False)
+        parser.add_argument("--max_fps", metavar="FPS", type=float, default=0.0, help="The maximum number of images per second to forward, images arriving too soon after the last forwarded one get skipped; 0 for no limit.", required=False)
+        parser.add_argument("--dedup_threshold", metavar="BITS", type=int, default=-1, help="Skips near-duplicate images, i.e., ones whose perceptual hash (computed on a thumbnail) differs in at most this many of the %d bits from the one of the last forwarded image; -1 to disable." % (DEDUP_HASH_SIZE * DEDUP_HASH_SIZE), required=False)
+        add_drain_option(parser)
+        add_stats_options(parser)
         return parser
 
     def _apply_args(self, ns: argparse.Namespace):
@@ -85,8 +203,20 @@ class RedisImageReader(AbstractRedisListener, DataTypeSupporter):
         :type ns: argparse.Namespace
         """
         super()._apply_args(ns)
+        self.redis_unix_socket = ns.redis_unix_socket
         self.data_type = ns.data_type
         self.prefix = ns.prefix
+        self.channels_in = ns.channels_in
+        self.key_channel = ns.key_channel
+        self.queue_size = ns.queue_size
+        self.queue_policy = ns.queue_policy
+        self.every_nth = ns.every_nth
+        self.max_fps = ns.max_fps
+        self.dedup_threshold = ns.dedup_threshold
+        self.drain_timeout = ns.drain_timeout
+        self.stats = ns.stats
+        self.stats_interval = ns.stats_interval
+        self.stats_export = ns.stats_export
 
     def generates(self) -> List:
         """
@@ -109,24 +239,389 @@ class RedisImageReader(AbstractRedisListener, DataTypeSupporter):
             raise Exception("No data type defined!")
         if self.prefix is None:
             self.prefix = ""
+        if self.stats is None:
+            self.stats = False
+        if self.queue_size is None:
+            self.queue_size = DEFAULT_QUEUE_SIZE
+        if self.queue_policy is None:
+            self.queue_policy = QUEUE_POLICY_DROP_OLDEST
+        if self.queue_policy not in QUEUE_POLICIES:
+            raise Exception("Unsupported queue policy: %s" % self.queue_policy)
+        if self.queue_size < 1:
+            raise Exception("Queue size must be at least 1: %d" % self.queue_size)
+        if self.every_nth is None:
+            self.every_nth = 1
+        if self.every_nth < 1:
+            raise Exception("Every n-th image must be at least 1: %d" % self.every_nth)
+        if self.max_fps is None:
+            self.max_fps = 0.0
+        if self.key_channel is None:
+            self.key_channel = DEFAULT_KEY_CHANNEL
+        if self.dedup_threshold is None:
+            self.dedup_threshold = -1
+        if self.drain_timeout is None:
+            self.drain_timeout = DEFAULT_DRAIN_TIMEOUT
+        self._channels = [self._redis_session.channel_in]
+        if self.channels_in is not None:
+            self._channels.extend([x for x in self.channels_in if x not in self._channels])
+        # record the source channel only when listening to more than a single channel
+        self._routing = (len(self._channels) > 1) or any(is_pattern(x) for x in self._channels)
+        if (self.queue_policy == QUEUE_POLICY_BLOCK) and any(is_pattern(x) for x in self._channels):
+            raise Exception("Patterns are not supported by queue policy %s: %s" % (QUEUE_POLICY_BLOCK, ", ".join(self._channels)))
         self._output_cls = data_type_to_class(self.data_type)
         self._counter = 0
+        # only used for decompressing, compressed images are detected automatically
+        self._compressor = create_compressor(None)
+        self._stats = create_stats_reporter(self.stats, self.name(), self.logger(),
+                                            interval=self.stats_interval, export=self.stats_export)
+        self._num_received = 0
+        self._num_dropped = 0
+        self._max_depth = 0
+        self._num_skipped = 0
+        self._num_duplicates = 0
+        self._frames = dict()
+        self._forwarded = dict()
+        self._last_forwarded = dict()
+        self._last_hash = dict()
+        self._channel_names = dict()
+        # share connection pool and pubsub with the other redis plugins in the pipeline
+        self._client = acquire_client(self.redis_host, self.redis_port, self.redis_db,
+                                      redis_unix_socket=self.redis_unix_socket)
+        self._redis_session.connection = self._client.connection
+        if self.queue_policy != QUEUE_POLICY_BLOCK:
+            # the subscription is kept for the lifetime of the reader, buffering messages between reads
+            self._queue = deque()
+            self._queue_cond = threading.Condition()
+            self._pubsub = self._client.pubsub(sleep_time=self.sleep_time)
+            for channel in self._channels:
+                self._pubsub.subscribe(channel, self._on_message)
+        self._accepting = True
+        self._finished = False
+        if self.drain_timeout > 0:
+            install_shutdown_handler()
+            register_drain_source(self)
+            add_shutdown_callback(self._on_shutdown)
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        Returns the number of buffered images.
+
+        :return: the number of images
+        :rtype: int
+        """
+        if self._queue is None:
+            return 0
+        return len(self._queue)
+
+    @property
+    def num_dropped(self) -> int:
+        """
+        Returns the number of images that were dropped due to the buffer being full.
 
-    def _process_data(self, data):
+        :return: the number of images
+        :rtype: int
+        """
+        return self._num_dropped
+
+    def _on_shutdown(self):
+        """
+        Wakes up the reader when a shutdown gets requested, gets executed in the signal handler.
+        """
+        if self._queue_cond is not None:
+            # reentrant lock, the signal handler may interrupt the main thread while holding it
+            with self._queue_cond:
+                self._queue_cond.notify_all()
+
+    def _stop_accepting(self):
+        """
+        Stops accepting new images when shutting down, the buffered ones still get forwarded.
+        """
+        if not self._accepting:
+            return
+        self._accepting = False
+        if self._pubsub is not None:
+            for channel in self._channels:
+                self._pubsub.unsubscribe(channel, self._on_message)
+        self.logger().warning("Shutting down, draining %d buffered image(s)..." % self.queue_depth)
+
+    def _on_message(self, message):
+        """
+        Buffers the incoming message, gets executed in the worker thread of the shared pubsub.
+
+        :param message: the message
+        :type message: dict
+        """
+        with self._queue_cond:
+            self._num_received += 1
+            if len(self._queue) >= self.queue_size:
+                self._num_dropped += 1
+                if (self._num_dropped == 1) or (self._num_dropped % 100 == 0):
+                    self.logger().warning("Queue full, images dropped so far (%s): %d" % (self.queue_policy, self._num_dropped))
+                if self.queue_policy == QUEUE_POLICY_DROP_NEWEST:
+                    return
+                self._queue.popleft()
+            self._queue.append((perf_counter(), message['channel'], message['data']))
+            self._max_depth = max(self._max_depth, len(self._queue))
+            self._queue_cond.notify()
+
+    def _sample(self, channel: str) -> bool:
+        """
+        Determines whether to forward the received image, based on the frame count and rate limit
+        of its channel. Does not look at the image itself.
+
+        :param channel: the channel the image was received on
+        :type channel: str
+        :return: True if to forward the image
+        :rtype: bool
+        """
+        frames = self._frames.get(channel, 0) + 1
+        self._frames[channel] = frames
+        if (self.every_nth > 1) and ((frames - 1) % self.every_nth != 0):
+            return False
+        if (self.max_fps > 0) and (channel in self._last_forwarded):
+            if perf_counter() - self._last_forwarded[channel] < 1.0 / self.max_fps:
+                return False
+        return True
+
+    def _frame_hash(self, data) -> int:
+        """
+        Computes the difference hash of the image, using a grayscale thumbnail.
+
+        :param data: the image data
+        :return: the hash
+        :rtype: int
+        """
+        from PIL import Image
+        img = Image.open(io.BytesIO(data))
+        # JPEGs can get downscaled while decoding already
+        img.draft("L", (DEDUP_HASH_SIZE * 4, DEDUP_HASH_SIZE * 4))
+        thumb = img.convert("L").resize((DEDUP_HASH_SIZE + 1, DEDUP_HASH_SIZE), Image.Resampling.BILINEAR)
+        pixels = thumb.tobytes()
+        result = 0
+        for y in range(DEDUP_HASH_SIZE):
+            row = y * (DEDUP_HASH_SIZE + 1)
+            for x in range(row, row + DEDUP_HASH_SIZE):
+                result = (result << 1) | (pixels[x] > pixels[x + 1])
+        return result
+
+    def _is_duplicate(self, data, channel: str) -> bool:
+        """
+        Checks whether the image is a near-duplicate of the last forwarded one of its channel.
+
+        :param data: the (uncompressed) image data
+        :param channel: the channel the image was received on
+        :type channel: str
+        :return: True if a duplicate
+        :rtype: bool
+        """
+        with timed(self._stats, STAGE_DEDUP):
+            frame_hash = self._frame_hash(data)
+        last_hash = self._last_hash.get(channel)
+        if (last_hash is not None) and (bin(frame_hash ^ last_hash).count("1") <= self.dedup_threshold):
+            return True
+        self._last_hash[channel] = frame_hash
+        return False
+
+    def _channel_name(self, channel: str) -> str:
+        """
+        Turns the channel into a string that can be used in file names, e.g., "cam:1" into "cam_1".
+
+        :param channel: the channel to convert
+        :type channel: str
+        :return: the converted channel
+        :rtype: str
+        """
+        if channel not in self._channel_names:
+            self._channel_names[channel] = re.sub(r"[^\w.-]", "_", channel)
+        return self._channel_names[channel]
+
+    def _process_data(self, data, channel: str = None):
         """
         For processing the received data.
 
         :param data: the received data
+        :param channel: the channel the data was received on
+        :type channel: str
         :return: the generated output data
         """
         self._counter += 1
 
-        img_io = io.BytesIO(data)
-        img = Image.open(img_io)
+        if is_compressed(data):
+            with timed(self._stats, STAGE_DECOMPRESS):
+                data = self._compressor.decompress(data)
+
+        with timed(self._stats, STAGE_DECODE):
+            from PIL import Image
+            # BytesIO shares the buffer of the received bytes, no copy is made
+            img = Image.open(io.BytesIO(data))
+
+        with timed(self._stats, STAGE_BUILD):
+            image_name = self.prefix
+            meta = None
+            counter = self._counter
+            if self._routing and (channel is not None):
+                if len(image_name) > 0:
+                    image_name += "-"
+                image_name += self._channel_name(channel)
+                counter = self._forwarded[channel]
+                meta = {self.key_channel: channel}
+            if len(image_name) > 0:
+                image_name += "-"
+            image_name += str(counter) + "." + img.format.lower().replace("jpeg", "jpg")
+
+            return self._output_cls(image_name=image_name, image=img, image_format=img.format, image_size=img.size,
+                                    data=data, metadata=meta)
+
+    def _receive(self) -> Optional[Tuple[str, bytes]]:
+        """
+        Waits for data to arrive.
+
+        :return: the tuple of channel and received data, None if timed out
+        :rtype: tuple
+        """
+        session = self._redis_session
+        start = perf_counter()
+        if self.queue_policy == QUEUE_POLICY_BLOCK:
+            # pull-based: images only get removed from the list on the server when we are ready for them,
+            # i.e., nothing to drain when shutting down
+            item = None
+            while item is None:
+                if shutdown_requested():
+                    self.logger().warning("Shutting down, leaving remaining images on the server")
+                    self._finished = True
+                    return None
+                # wait in slices, to notice shutdown requests
+                remaining = None if (session.timeout <= 0) else (session.timeout - (perf_counter() - start))
+                if (remaining is not None) and (remaining <= 0):
+                    self.logger().warning("Timeout reached!")
+                    return None
+                wait = BLPOP_SLICE if (remaining is None) else min(BLPOP_SLICE, remaining)
+                if self.drain_timeout > 0:
+                    wait = min(wait, self.drain_timeout)
+                item = session.connection.blpop(self._channels, timeout=max(BLPOP_MIN_TIMEOUT, wait))
+            self._num_received += 1
+            channel, data = item
+            received = end = perf_counter()
+        else:
+            if shutdown_requested():
+                self._stop_accepting()
+            with self._queue_cond:
+                if not self._queue_cond.wait_for(lambda: (len(self._queue) > 0) or shutdown_requested(), session.timeout if session.timeout > 0 else None):
+                    self.logger().warning("Timeout reached!")
+                    return None
+                item = None
+                if (len(self._queue) > 0) and (not shutdown_requested() or (drain_remaining(self.drain_timeout) > 0)):
+                    item = self._queue.popleft()
+            if shutdown_requested():
+                self._stop_accepting()
+                if item is None:
+                    if self.queue_depth > 0:
+                        self.logger().warning("Drain timeout reached, discarding %d buffered image(s)" % self.queue_depth)
+                    else:
+                        self.logger().info("Drained all buffered images")
+                    self._finished = True
+                    return None
+            received, channel, data = item
+            end = perf_counter()
+        if isinstance(channel, bytes):
+            channel = channel.decode("utf-8")
+
+        self.logger().info("Wait time: %f sec" % (end - start))
+        if self._stats is not None:
+            received = max(start, received)
+            self._stats.add(STAGE_WAIT, received - start)
+            self._stats.add(STAGE_POLL, end - received)
+            self._stats.set_counter("received", self._num_received)
+            self._stats.set_counter("dropped", self._num_dropped)
+            self._stats.set_counter("skipped", self._num_skipped)
+            self._stats.set_counter("duplicates", self._num_duplicates)
+            if self.queue_policy == QUEUE_POLICY_BLOCK:
+                self._stats.set_counter("queue_depth", sum([session.connection.llen(x) for x in self._channels]))
+            else:
+                self._stats.set_counter("queue_depth", self.queue_depth)
+                self._stats.set_counter("queue_depth_max", self._max_depth)
+
+        return channel, data
+
+    def read(self) -> Iterable:
+        """
+        Loads the data and returns the items one by one.
 
-        image_name = self.prefix
-        if len(image_name) > 0:
-            image_name += "-"
-        image_name += str(self._counter) + "." + img.format.lower().replace("jpeg", "jpg")
+        :return: the data
+        :rtype: Iterable
+        """
+        while True:
+            item = self._receive()
+            if self._finished:
+                return
+            if item is None:
+                if self.timeout_action == TIMEOUT_ACTION_KEEP_WAITING:
+                    continue
+                elif self.timeout_action == TIMEOUT_ACTION_STOP:
+                    return
+                else:
+                    raise Exception("Unhandled timeout action: %s" % self.timeout_action)
+            channel, data = item
+            # skip redundant images before the container gets built
+            if not self._sample(channel):
+                self._num_skipped += 1
+                continue
+            if self.dedup_threshold >= 0:
+                if is_compressed(data):
+                    with timed(self._stats, STAGE_DECOMPRESS):
+                        data = self._compressor.decompress(data)
+                if self._is_duplicate(data, channel):
+                    self._num_duplicates += 1
+                    continue
+            break
+        self._last_forwarded[channel] = perf_counter()
+        self._forwarded[channel] = self._forwarded.get(channel, 0) + 1
+        if self._routing and (self._stats is not None):
+            self._stats.set_counter("%s.received" % self._channel_name(channel), self._frames[channel])
+            self._stats.set_counter("%s.forwarded" % self._channel_name(channel), self._forwarded[channel])
+
+        # process data
+        result = self._process_data(data, channel=channel)
+        if self._stats is not None:
+            self._stats.item_done()
+        if result is not None:
+            yield result
+
+    def has_finished(self) -> bool:
+        """
+        Returns whether reading has finished, i.e., after draining when shutting down.
 
-        return self._output_cls(image_name=image_name, image=img, image_format=img.format, data=img_io.getvalue())
+        :return: True if finished
+        :rtype: bool
+        """
+        return self._finished
+
+    def finalize(self):
+        """
+        Finishes the processing, e.g., for closing files or databases.
+        """
+        unregister_drain_source(self)
+        remove_shutdown_callback(self._on_shutdown)
+        if self._stats is not None:
+            self._stats.close()
+            self._stats = None
+        if self._client is not None:
+            if self._pubsub is not None:
+                if self._accepting:
+                    for channel in self._channels:
+                        self._pubsub.unsubscribe(channel, self._on_message)
+                    self._accepting = False
+                self.logger().info("Queue - received: %d, dropped: %d, max depth: %d, remaining: %d"
+                                   % (self._num_received, self._num_dropped, self._max_depth, self.queue_depth))
+            if (self.every_nth > 1) or (self.max_fps > 0) or (self.dedup_threshold >= 0):
+                self.logger().info("Frames - received: %d, skipped: %d, duplicates: %d"
+                                   % (sum(self._frames.values()), self._num_skipped, self._num_duplicates))
+            if self._routing:
+                for channel in sorted(self._frames):
+                    self.logger().info("Channel %s - received: %d, forwarded: %d"
+                                       % (channel, self._frames[channel], self._forwarded.get(channel, 0)))
+            release_client(self._client)
+            self._client = None
+            self._pubsub = None
+        super().finalize()
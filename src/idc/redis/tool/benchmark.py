@@ -0,0 +1,767 @@
+import argparse
+import io
+import json
+import logging
+import resource
+import subprocess
+import sys
+import threading
+import tracemalloc
+import traceback
+from time import perf_counter, process_time, sleep
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import redis
+from PIL import Image
+from wai.logging import add_logging_level, init_logging, set_logging_level
+
+from idc.api import DATATYPES, DATATYPE_DEPTH, DATATYPE_IMGCLS, DATATYPE_IMGSEG, DATATYPE_OBJDET, ImageClassificationData
+from idc.core import ENV_IDC_LOGLEVEL
+from idc.redis.api import set_connection_factory, COMPRESSIONS, COMPRESSION_NONE, COMPRESSION_LZ4, COMPRESSION_ZSTD, Compressor, create_compressor
+from idc.redis.filter import DepthRedisPredict, ImageClassificationRedisPredict, ImageSegmentationRedisPredict, ObjectDetectionRedisPredict
+from idc.redis.reader import RedisImageReader, QUEUE_POLICY_BLOCK
+from idc.redis.tool.stand_in import StandInModel, FORMATS, FORMAT_JSON, FORMAT_NUMPY, FORMAT_GRAYSCALE_DEPTH, generate_prediction
+
+BENCHMARK = "idc-redis-benchmark"
+
+DESCRIPTION = "Benchmarks the redis plugins against a stand-in model server, using either a Redis server or fakeredis."
+
+PLUGIN_LISTEN = "listen"
+PLUGINS = DATATYPES + [PLUGIN_LISTEN]
+
+FILTERS = {
+    DATATYPE_DEPTH: DepthRedisPredict,
+    DATATYPE_IMGCLS: ImageClassificationRedisPredict,
+    DATATYPE_IMGSEG: ImageSegmentationRedisPredict,
+    DATATYPE_OBJDET: ObjectDetectionRedisPredict,
+}
+
+IMAGE_FORMATS = ["PNG", "JPEG"]
+
+LABELS_KEY = "benchmark-labels"
+
+CODEC_LEVELS = [
+    (COMPRESSION_LZ4, 0),
+    (COMPRESSION_LZ4, 9),
+    (COMPRESSION_ZSTD, 1),
+    (COMPRESSION_ZSTD, 3),
+    (COMPRESSION_ZSTD, 9),
+]
+
+_logger = logging.getLogger(BENCHMARK)
+
+
+def connection_factory(redis_host: str = "localhost", redis_port: int = 6379, redis_db: int = 0,
+                       use_fakeredis: bool = False) -> Callable[[], redis.Redis]:
+    """
+    Returns a function that creates redis connections. When using fakeredis,
+    all connections share the same in-process server.
+
+    :param redis_host: the redis host to use
+    :type redis_host: str
+    :param redis_port: the port to use
+    :type redis_port: int
+    :param redis_db: the database to use
+    :type redis_db: int
+    :param use_fakeredis: whether to use fakeredis instead of a redis server
+    :type use_fakeredis: bool
+    :return: the function for creating connections
+    """
+    if use_fakeredis:
+        try:
+            import fakeredis
+        except ImportError:
+            raise Exception("The fakeredis library is not installed, please install it with: pip install fakeredis")
+        server = fakeredis.FakeServer()
+        return lambda: fakeredis.FakeRedis(server=server)
+    else:
+        return lambda: redis.Redis(host=redis_host, port=redis_port, db=redis_db)
+
+
+def generate_image(width: int, height: int, image_format: str = "PNG", seed: int = 42) -> bytes:
+    """
+    Generates a random RGB test image.
+
+    :param width: the width of the image
+    :type width: int
+    :param height: the height of the image
+    :type height: int
+    :param image_format: the image format to use (PNG/JPEG)
+    :type image_format: str
+    :param seed: the seed for the random number generator
+    :type seed: int
+    :return: the image bytes
+    :rtype: bytes
+    """
+    rnd = np.random.default_rng(seed)
+    arr = rnd.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(arr, "RGB").save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def benchmark_cases(plugins: List[str], payload_size: int) -> List[Dict]:
+    """
+    Generates the benchmark cases for the specified plugins: one per plugin and relevant option.
+
+    :param plugins: the plugins to generate the cases for, see PLUGINS
+    :type plugins: list
+    :param payload_size: the payload size, used for generating the labels for image segmentation
+    :type payload_size: int
+    :return: the list of cases (dictionaries with plugin, data format of the stand-in model and plugin options)
+    :rtype: list
+    """
+    result = []
+    for plugin in plugins:
+        if plugin == DATATYPE_DEPTH:
+            for fmt in FORMATS[DATATYPE_DEPTH]:
+                if fmt == FORMAT_GRAYSCALE_DEPTH:
+                    result.append({"plugin": plugin, "data_format": fmt, "options": {"data_format": fmt, "depth_scale": 0.001}})
+                    result.append({"plugin": plugin, "data_format": fmt, "options": {"data_format": fmt, "depth_scale": 0.001, "invalid_value": 0}})
+                else:
+                    result.append({"plugin": plugin, "data_format": fmt, "options": {"data_format": fmt}})
+        elif plugin == DATATYPE_IMGCLS:
+            result.append({"plugin": plugin, "data_format": FORMAT_JSON, "options": {}})
+            result.append({"plugin": plugin, "data_format": FORMAT_JSON, "options": {"key_raw": "raw"}})
+            result.append({"plugin": plugin, "data_format": FORMAT_JSON, "options": {"key_raw": "raw", "top_k": 5}})
+            result.append({"plugin": plugin, "data_format": FORMAT_NUMPY, "options": {"labels_key": LABELS_KEY}})
+            result.append({"plugin": plugin, "data_format": FORMAT_NUMPY, "options": {"labels_key": LABELS_KEY, "key_raw": "raw", "top_k": 5}})
+        elif plugin == DATATYPE_IMGSEG:
+            labels = ["label-%d" % i for i in range(min(payload_size, 254))]
+            for fmt in FORMATS[DATATYPE_IMGSEG]:
+                result.append({"plugin": plugin, "data_format": fmt, "options": {"image_format": fmt, "labels": labels}})
+        elif plugin == DATATYPE_OBJDET:
+            result.append({"plugin": plugin, "data_format": None, "options": {}})
+        elif plugin == PLUGIN_LISTEN:
+            result.append({"plugin": plugin, "data_format": None, "options": {"data_type": DATATYPE_IMGCLS}})
+            result.append({"plugin": plugin, "data_format": None, "options": {"data_type": DATATYPE_IMGCLS, "queue_policy": QUEUE_POLICY_BLOCK}})
+        else:
+            raise Exception("Unsupported plugin: %s" % plugin)
+    return result
+
+
+def options_to_str(options: Dict) -> str:
+    """
+    Turns the options into a short string for the report.
+
+    :param options: the options to convert
+    :type options: dict
+    :return: the string
+    :rtype: str
+    """
+    result = []
+    for k in options:
+        v = options[k]
+        if isinstance(v, list):
+            v = "[%d]" % len(v)
+        result.append("%s=%s" % (k, str(v)))
+    return ",".join(result)
+
+
+def summarize(case: Dict, latencies: List[float], total_time: float, total_bytes: int, failed: int,
+              error: Optional[str] = None) -> Dict:
+    """
+    Summarizes the measurements of a benchmark case.
+
+    :param case: the benchmark case
+    :type case: dict
+    :param latencies: the latencies in seconds of the successfully processed images
+    :type latencies: list
+    :param total_time: the total time in seconds
+    :type total_time: float
+    :param total_bytes: the total bytes sent/received over redis
+    :type total_bytes: int
+    :param failed: the number of images that failed (timeouts)
+    :type failed: int
+    :param error: the error message if the case failed altogether
+    :type error: str
+    :return: the summary
+    :rtype: dict
+    """
+    result = {
+        "plugin": case["plugin"],
+        "options": options_to_str(case["options"]),
+        "images": len(latencies),
+        "failed": failed,
+        "images_per_sec": None,
+        "p50_ms": None,
+        "p99_ms": None,
+        "bytes_per_image": None,
+        "peak_mb": None,
+        "error": error,
+    }
+    if len(latencies) > 0:
+        arr = np.array(latencies) * 1000.0
+        result["images_per_sec"] = len(latencies) / total_time if total_time > 0 else None
+        result["p50_ms"] = float(np.percentile(arr, 50))
+        result["p99_ms"] = float(np.percentile(arr, 99))
+        result["bytes_per_image"] = total_bytes / len(latencies)
+    return result
+
+
+def benchmark_filter(create_connection: Callable[[], redis.Redis], case: Dict, image: bytes,
+                     num_images: int = 100, warmup: int = 5, payload_size: int = 10, delay: float = 0.0,
+                     timeout: float = 5.0, compression: str = None, compression_level: int = None) -> Dict:
+    """
+    Benchmarks a redis-predict filter.
+
+    :param create_connection: the function for creating redis connections
+    :param case: the benchmark case
+    :type case: dict
+    :param image: the image to send
+    :type image: bytes
+    :param num_images: the number of images to time
+    :type num_images: int
+    :param warmup: the number of images to process before timing
+    :type warmup: int
+    :param payload_size: the payload size of the predictions
+    :type payload_size: int
+    :param delay: the artificial delay of the stand-in model in seconds
+    :type delay: float
+    :param timeout: the timeout in seconds for the filter
+    :type timeout: float
+    :param compression: the codec for compressing images and predictions, None for no compression
+    :type compression: str
+    :param compression_level: the compression level, uses the default of the codec if None
+    :type compression_level: int
+    :return: the summary
+    :rtype: dict
+    """
+    data_type = case["plugin"]
+    model = StandInModel(create_connection(), data_type, data_format=case["data_format"],
+                         payload_size=payload_size, delay=delay, labels_key=LABELS_KEY,
+                         compression=compression, compression_level=compression_level)
+    flt = FILTERS[data_type](timeout=timeout, compression=compression, compression_level=compression_level)
+    for k in case["options"]:
+        setattr(flt, k, case["options"][k])
+    item_cls = flt.accepts()[0]
+    image_size = Image.open(io.BytesIO(image)).size
+    latencies = []
+    failed = 0
+    total_time = 0.0
+    try:
+        flt.initialize()
+        model.start()
+        for i in range(warmup + num_images):
+            if i == warmup:
+                model.reset_counters()
+                total_time = perf_counter()
+            item = item_cls(image_name="benchmark-%d.png" % i, data=image, image_size=image_size)
+            start = perf_counter()
+            output = flt.process(item)
+            end = perf_counter()
+            if i < warmup:
+                continue
+            if output is None:
+                failed += 1
+            else:
+                latencies.append(end - start)
+        total_time = perf_counter() - total_time
+        return summarize(case, latencies, total_time, model.bytes_in + model.bytes_out, failed)
+    except Exception as e:
+        _logger.exception("Failed to benchmark: %s" % str(case))
+        return summarize(case, [], 0.0, 0, failed, error=str(e))
+    finally:
+        model.stop()
+        flt.finalize()
+
+
+def benchmark_reader(create_connection: Callable[[], redis.Redis], case: Dict, image: bytes,
+                     num_images: int = 100, warmup: int = 5, timeout: float = 5.0,
+                     compression: str = None, compression_level: int = None) -> Dict:
+    """
+    Benchmarks the redis-image-listen reader. The latency is measured from publishing
+    the image until the reader has generated the container.
+
+    :param create_connection: the function for creating redis connections
+    :param case: the benchmark case
+    :type case: dict
+    :param image: the image to send
+    :type image: bytes
+    :param num_images: the number of images to time
+    :type num_images: int
+    :param warmup: the number of images to process before timing
+    :type warmup: int
+    :param timeout: the timeout in seconds for the reader
+    :type timeout: float
+    :param compression: the codec for compressing the published images, None for no compression
+    :type compression: str
+    :param compression_level: the compression level, uses the default of the codec if None
+    :type compression_level: int
+    :return: the summary
+    :rtype: dict
+    """
+    reader = RedisImageReader(timeout=timeout, timeout_action="stop")
+    for k in case["options"]:
+        setattr(reader, k, case["options"][k])
+    publisher = create_connection()
+    image = create_compressor(compression, level=compression_level).compress(image)
+    consumed = threading.Event()
+    stopped = threading.Event()
+    sent = [0.0]
+
+    pull = (reader.queue_policy == QUEUE_POLICY_BLOCK)
+
+    def publish():
+        # the reader stays subscribed, only wait for the subscription to become active
+        while (not pull) and (publisher.pubsub_numpat() < 1) and not stopped.is_set():
+            sleep(0.0001)
+        while not stopped.is_set():
+            sent[0] = perf_counter()
+            if pull:
+                publisher.rpush(reader.channel_in, image)
+            else:
+                publisher.publish(reader.channel_in, image)
+            consumed.wait()
+            consumed.clear()
+
+    latencies = []
+    failed = 0
+    total_time = 0.0
+    thread = threading.Thread(target=publish, daemon=True)
+    try:
+        reader.initialize()
+        thread.start()
+        for i in range(warmup + num_images):
+            if i == warmup:
+                total_time = perf_counter()
+            output = list(reader.read())
+            end = perf_counter()
+            consumed.set()
+            if i < warmup:
+                continue
+            if len(output) == 0:
+                failed += 1
+            else:
+                latencies.append(end - sent[0])
+        total_time = perf_counter() - total_time
+        return summarize(case, latencies, total_time, len(image) * len(latencies), failed)
+    except Exception as e:
+        _logger.exception("Failed to benchmark: %s" % str(case))
+        return summarize(case, [], 0.0, 0, failed, error=str(e))
+    finally:
+        stopped.set()
+        consumed.set()
+        reader.finalize()
+        if pull:
+            thread.join(timeout)
+            publisher.delete(reader.channel_in)
+
+
+def format_report(results: List[Dict], baseline: List[Dict] = None) -> str:
+    """
+    Generates a textual report from the benchmark results.
+
+    :param results: the results to report
+    :type results: list
+    :param baseline: the optional baseline results to compare against
+    :type baseline: list
+    :return: the report
+    :rtype: str
+    """
+    base = dict()
+    if baseline is not None:
+        for r in baseline:
+            base[(r["plugin"], r["options"])] = r
+
+    lines = []
+    memory = (len(results) > 0) and (results[0]["peak_mb"] is not None)
+    header = "%-8s %-40s %8s %6s %10s %10s %10s %14s" % ("plugin", "options", "images", "failed", "images/s", "p50 ms", "p99 ms", "bytes/image")
+    if memory:
+        header += " %10s" % "peak MB"
+    if baseline is not None:
+        header += " %10s" % "vs base"
+    lines.append(header)
+    lines.append("-" * len(header))
+    for r in results:
+        if r["error"] is not None:
+            lines.append("%-8s %-40s error: %s" % (r["plugin"], r["options"], r["error"]))
+            continue
+        if r["images_per_sec"] is None:
+            lines.append("%-8s %-40s %8d %6d %10s" % (r["plugin"], r["options"], r["images"], r["failed"], "-"))
+            continue
+        line = "%-8s %-40s %8d %6d %10.1f %10.2f %10.2f %14.0f" % (
+            r["plugin"], r["options"], r["images"], r["failed"],
+            r["images_per_sec"], r["p50_ms"], r["p99_ms"], r["bytes_per_image"])
+        if memory:
+            line += " %10.1f" % r["peak_mb"]
+        if baseline is not None:
+            b = base.get((r["plugin"], r["options"]))
+            if (b is not None) and (b["images_per_sec"] is not None):
+                line += " %+9.1f%%" % ((r["images_per_sec"] / b["images_per_sec"] - 1.0) * 100.0)
+            else:
+                line += " %10s" % "-"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def run_benchmark(plugins: List[str] = None, num_images: int = 100, warmup: int = 5,
+                  image_width: int = 640, image_height: int = 480, image_format: str = "JPEG",
+                  payload_size: int = 10, delay: float = 0.0, timeout: float = 5.0,
+                  redis_host: str = "localhost", redis_port: int = 6379, redis_db: int = 0,
+                  use_fakeredis: bool = False, memory: bool = False, compression: str = None,
+                  compression_level: int = None) -> List[Dict]:
+    """
+    Runs the benchmark for the specified plugins.
+
+    :param plugins: the plugins to benchmark, see PLUGINS; uses all if None
+    :type plugins: list
+    :param num_images: the number of images to time per case
+    :type num_images: int
+    :param warmup: the number of images to process before timing
+    :type warmup: int
+    :param image_width: the width of the test image
+    :type image_width: int
+    :param image_height: the height of the test image
+    :type image_height: int
+    :param image_format: the format of the test image (PNG/JPEG)
+    :type image_format: str
+    :param payload_size: the payload size of the predictions: number of classes (ic), labels (is) or objects (od)
+    :type payload_size: int
+    :param delay: the artificial delay of the stand-in model in seconds
+    :type delay: float
+    :param timeout: the timeout in seconds for the plugins
+    :type timeout: float
+    :param redis_host: the redis host to use
+    :type redis_host: str
+    :param redis_port: the port to use
+    :type redis_port: int
+    :param redis_db: the database to use
+    :type redis_db: int
+    :param use_fakeredis: whether to use fakeredis instead of a redis server
+    :type use_fakeredis: bool
+    :param memory: whether to trace the peak memory of the Python allocations per case (slows down processing)
+    :type memory: bool
+    :param compression: the codec for compressing the payloads, None for no compression
+    :type compression: str
+    :param compression_level: the compression level, uses the default of the codec if None
+    :type compression_level: int
+    :return: the list of summaries
+    :rtype: list
+    """
+    if plugins is None:
+        plugins = PLUGINS
+    create_connection = connection_factory(redis_host=redis_host, redis_port=redis_port, redis_db=redis_db,
+                                           use_fakeredis=use_fakeredis)
+    # the plugins obtain their connections from the shared registry
+    set_connection_factory(lambda host, port, db, unix_socket: create_connection())
+    image = generate_image(image_width, image_height, image_format=image_format)
+    result = []
+    if memory:
+        tracemalloc.start()
+    for case in benchmark_cases(plugins, payload_size):
+        _logger.info("Benchmarking: %s %s" % (case["plugin"], options_to_str(case["options"])))
+        if memory:
+            tracemalloc.reset_peak()
+        if case["plugin"] == PLUGIN_LISTEN:
+            summary = benchmark_reader(create_connection, case, image, num_images=num_images, warmup=warmup,
+                                       timeout=timeout, compression=compression, compression_level=compression_level)
+        else:
+            summary = benchmark_filter(create_connection, case, image, num_images=num_images, warmup=warmup,
+                                       payload_size=payload_size, delay=delay, timeout=timeout,
+                                       compression=compression, compression_level=compression_level)
+        if memory:
+            summary["peak_mb"] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        result.append(summary)
+    if memory:
+        tracemalloc.stop()
+    set_connection_factory(None)
+    return result
+
+
+def codec_payloads(image_width: int = 640, image_height: int = 480, payload_size: int = 10) -> Dict[str, bytes]:
+    """
+    Generates the payloads for benchmarking the compression codecs: the images,
+    the predictions of all data types/formats and a broadcast of the data.
+
+    :param image_width: the width of the test image
+    :type image_width: int
+    :param image_height: the height of the test image
+    :type image_height: int
+    :param payload_size: the payload size of the predictions: number of classes (ic), labels (is) or objects (od)
+    :type payload_size: int
+    :return: the payloads (name -> bytes)
+    :rtype: dict
+    """
+    result = dict()
+    for image_format in IMAGE_FORMATS:
+        result["image-" + image_format.lower()] = generate_image(image_width, image_height, image_format=image_format)
+    for data_type in DATATYPES:
+        for data_format in FORMATS[data_type]:
+            result["%s-%s" % (data_type, data_format)] = generate_prediction(data_type, image_width, image_height,
+                                                                             payload_size=payload_size, data_format=data_format)
+    item = ImageClassificationData(image_name="benchmark.jpg", data=result["image-jpeg"],
+                                   image_size=(image_width, image_height), annotation="class-0")
+    result["broadcast-json"] = json.dumps(item.to_dict(source=False, metadata=False, image=True)).encode()
+    return result
+
+
+def benchmark_codecs(payloads: Dict[str, bytes], codecs: List[Tuple[str, int]] = None, repeat: int = 10) -> List[Dict]:
+    """
+    Benchmarks the compression codecs on the payloads, measuring the CPU time and the compressed size.
+
+    :param payloads: the payloads to compress (name -> bytes)
+    :type payloads: dict
+    :param codecs: the list of codec/level tuples, uses CODEC_LEVELS if None
+    :type codecs: list
+    :param repeat: the number of times to compress/decompress each payload
+    :type repeat: int
+    :return: the list of summaries
+    :rtype: list
+    """
+    if codecs is None:
+        codecs = CODEC_LEVELS
+    repeat = max(1, repeat)
+    result = []
+    for name in payloads:
+        data = payloads[name]
+        for codec, level in codecs:
+            summary = {
+                "payload": name,
+                "codec": codec,
+                "level": level,
+                "bytes": len(data),
+                "compressed": None,
+                "ratio": None,
+                "compress_ms": None,
+                "decompress_ms": None,
+                "error": None,
+            }
+            try:
+                # no minimum size, all payloads get compressed
+                compressor = Compressor(codec, level=level, min_size=0)
+                compressed = None
+                start = process_time()
+                for _ in range(repeat):
+                    compressed = compressor.compress(data)
+                summary["compress_ms"] = (process_time() - start) / repeat * 1000.0
+                start = process_time()
+                for _ in range(repeat):
+                    compressor.decompress(compressed)
+                summary["decompress_ms"] = (process_time() - start) / repeat * 1000.0
+                summary["compressed"] = len(compressed)
+                summary["ratio"] = len(compressed) / len(data)
+            except Exception as e:
+                _logger.exception("Failed to benchmark: %s/%s/%s" % (name, codec, str(level)))
+                summary["error"] = str(e)
+            result.append(summary)
+    return result
+
+
+def format_codec_report(results: List[Dict]) -> str:
+    """
+    Generates a textual report from the codec benchmark results.
+
+    :param results: the results to report
+    :type results: list
+    :return: the report
+    :rtype: str
+    """
+    lines = []
+    header = "%-22s %-6s %6s %12s %12s %8s %14s %14s" % ("payload", "codec", "level", "bytes", "compressed", "ratio", "compress ms", "decompress ms")
+    lines.append(header)
+    lines.append("-" * len(header))
+    for r in results:
+        if r["error"] is not None:
+            lines.append("%-22s %-6s %6s error: %s" % (r["payload"], r["codec"], str(r["level"]), r["error"]))
+            continue
+        lines.append("%-22s %-6s %6s %12d %12d %8.3f %14.3f %14.3f" % (
+            r["payload"], r["codec"], str(r["level"]), r["bytes"], r["compressed"], r["ratio"],
+            r["compress_ms"], r["decompress_ms"]))
+    return "\n".join(lines)
+
+
+IMPORT_BASELINE = ["idc.api", "kasperl.redis.filter", "kasperl.redis.reader", "kasperl.redis.writer"]
+""" the modules that get imported before timing, as they get loaded by idc-convert anyway """
+
+IMPORT_MODULES = ["idc.redis.api", "idc.redis.filter", "idc.redis.reader", "idc.redis.writer"]
+
+LAZY_MODULES = ["PIL", "numpy", "opex", "wai.common", "sqlite3", "lz4", "zstandard", "fakeredis"]
+""" the modules that the plugin modules must only import when required """
+
+
+def benchmark_imports(modules: List[str] = None, baseline: List[str] = None, repeat: int = 5) -> Dict:
+    """
+    Measures the import time of the modules in fresh interpreters via 'python -X importtime',
+    after importing the baseline modules. Also determines which of the modules that should
+    get imported lazily got imported in the baseline and by the modules.
+
+    :param modules: the modules to time, uses IMPORT_MODULES if None
+    :type modules: list
+    :param baseline: the modules to import before timing, uses IMPORT_BASELINE if None
+    :type baseline: list
+    :param repeat: the number of interpreters to start
+    :type repeat: int
+    :return: the results (median times in ms per module and in total, lazy modules loaded by the baseline and eagerly loaded modules)
+    :rtype: dict
+    """
+    if modules is None:
+        modules = IMPORT_MODULES
+    if baseline is None:
+        baseline = IMPORT_BASELINE
+    code = ("import json, sys; import %s; before = set(sys.modules); import %s; "
+            "print(json.dumps([sorted(before), sorted(set(sys.modules) - before)]))") % (", ".join(baseline), ", ".join(modules))
+    times = {m: [] for m in modules}
+    totals = []
+    before = []
+    loaded = []
+    for i in range(max(1, repeat)):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise Exception("Failed to import modules:\n%s" % proc.stderr)
+        total = 0.0
+        for line in proc.stderr.splitlines():
+            # format: "import time: self [us] | cumulative | imported package", nested imports are indented
+            parts = line.split("|")
+            if (len(parts) != 3) or not parts[0].startswith("import time:"):
+                continue
+            name = parts[2][1:]
+            if name in times:
+                cumulative = int(parts[1]) / 1000
+                times[name].append(cumulative)
+                total += cumulative
+        totals.append(total)
+        before, loaded = json.loads(proc.stdout)
+
+    def is_lazy(module):
+        return any((module == x) or module.startswith(x + ".") for x in LAZY_MODULES)
+
+    return {
+        "modules": {m: (float(np.median(times[m])) if len(times[m]) > 0 else 0.0) for m in modules},
+        "total_ms": float(np.median(totals)),
+        "baseline_lazy": [x for x in LAZY_MODULES if any((m == x) or m.startswith(x + ".") for m in before)],
+        "eager": sorted(x for x in loaded if is_lazy(x)),
+    }
+
+
+def format_import_report(result: Dict, max_ms: float = 0.0) -> str:
+    """
+    Generates a textual report from the import benchmark result.
+
+    :param result: the result to report
+    :type result: dict
+    :param max_ms: the maximum total import time in ms that is acceptable, 0 for no limit
+    :type max_ms: float
+    :return: the report
+    :rtype: str
+    """
+    lines = []
+    header = "%-30s %12s" % ("module", "import ms")
+    lines.append(header)
+    lines.append("-" * len(header))
+    for m in result["modules"]:
+        lines.append("%-30s %12.3f" % (m, result["modules"][m]))
+    lines.append("%-30s %12.3f%s" % ("total", result["total_ms"], "" if (max_ms <= 0) else (" (max: %.3f)" % max_ms)))
+    if len(result["baseline_lazy"]) > 0:
+        lines.append("")
+        lines.append("Already loaded by baseline: %s" % ", ".join(result["baseline_lazy"]))
+    if len(result["eager"]) > 0:
+        lines.append("")
+        lines.append("Loaded eagerly: %s" % ", ".join(result["eager"]))
+    return "\n".join(lines)
+
+
+def peak_rss() -> float:
+    """
+    Returns the peak resident set size of the process.
+
+    :return: the peak RSS in MB
+    :rtype: float
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main(args=None):
+    """
+    The main method for parsing command-line arguments.
+
+    :param args: the commandline arguments, uses sys.argv if not supplied
+    :type args: list
+    """
+    init_logging(env_var=ENV_IDC_LOGLEVEL)
+    parser = argparse.ArgumentParser(prog=BENCHMARK, description=DESCRIPTION, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-H", "--redis_host", type=str, help="The Redis server to connect to.", default="localhost", required=False)
+    parser.add_argument("-p", "--redis_port", type=int, help="The port the Redis server is running on.", default=6379, required=False)
+    parser.add_argument("-d", "--redis_db", type=int, help="The database to use.", default=0, required=False)
+    parser.add_argument("-F", "--fakeredis", action="store_true", help="Whether to use an in-process fakeredis server instead of a Redis server.", required=False)
+    parser.add_argument("-P", "--plugins", choices=PLUGINS, type=str, help="The plugins to benchmark.", default=PLUGINS, required=False, nargs="+")
+    parser.add_argument("-n", "--num_images", type=int, help="The number of images to time per plugin/option.", default=100, required=False)
+    parser.add_argument("-w", "--warmup", type=int, help="The number of images to process before timing.", default=5, required=False)
+    parser.add_argument("-W", "--image_width", type=int, help="The width of the test image.", default=640, required=False)
+    parser.add_argument("-E", "--image_height", type=int, help="The height of the test image.", default=480, required=False)
+    parser.add_argument("-f", "--image_format", choices=IMAGE_FORMATS, type=str, help="The format of the test image.", default="JPEG", required=False)
+    parser.add_argument("-S", "--payload_size", type=int, help="The size of the prediction payload: number of classes (ic), labels (is) or objects (od).", default=10, required=False)
+    parser.add_argument("-D", "--delay", type=float, help="The artificial delay in seconds of the stand-in model.", default=0.0, required=False)
+    parser.add_argument("-t", "--timeout", type=float, help="The timeout in seconds for the plugins.", default=5.0, required=False)
+    parser.add_argument("-m", "--memory", action="store_true", help="Whether to trace the peak memory of the Python allocations per plugin/option and output the peak RSS of the process (run plugins separately for comparing RSS).", required=False)
+    parser.add_argument("-o", "--output", metavar="FILE", type=str, help="The JSON file to store the results in, e.g., for use as baseline.", default=None, required=False)
+    parser.add_argument("-b", "--baseline", metavar="FILE", type=str, help="The JSON file with baseline results to compare against.", default=None, required=False)
+    parser.add_argument("-c", "--compression", choices=COMPRESSIONS, type=str, help="The codec for compressing images and predictions.", default=COMPRESSION_NONE, required=False)
+    parser.add_argument("--compression_level", type=int, help="The compression level, uses the default of the codec if omitted.", default=None, required=False)
+    parser.add_argument("-C", "--codecs", action="store_true", help="Whether to benchmark the CPU time and compressed size of the compression codecs for each payload type instead of the plugins.", required=False)
+    parser.add_argument("-I", "--imports", action="store_true", help="Whether to benchmark the import time of the plugin modules instead of the plugins (median of --import_repeat interpreter starts); fails if heavy libraries get imported eagerly or the time exceeds --max_import_ms.", required=False)
+    parser.add_argument("--import_repeat", type=int, help="The number of interpreter starts for measuring the import time.", default=5, required=False)
+    parser.add_argument("--max_import_ms", type=float, help="The maximum total import time in ms of the plugin modules, 0 for no limit.", default=0.0, required=False)
+    add_logging_level(parser)
+    ns = parser.parse_args(args=args)
+    set_logging_level(_logger, ns.logging_level)
+
+    baseline = None
+    if ns.baseline is not None:
+        with open(ns.baseline, "r") as fp:
+            baseline = json.load(fp)
+
+    if ns.imports:
+        result = benchmark_imports(repeat=ns.import_repeat)
+        print(format_import_report(result, max_ms=ns.max_import_ms))
+        if ns.output is not None:
+            with open(ns.output, "w") as fp:
+                json.dump(result, fp, indent=2)
+        if len(result["eager"]) > 0:
+            raise Exception("Modules loaded eagerly: %s" % ", ".join(result["eager"]))
+        if (ns.max_import_ms > 0) and (result["total_ms"] > ns.max_import_ms):
+            raise Exception("Import time exceeds limit: %.3f > %.3f ms" % (result["total_ms"], ns.max_import_ms))
+        return
+
+    if ns.codecs:
+        payloads = codec_payloads(image_width=ns.image_width, image_height=ns.image_height, payload_size=ns.payload_size)
+        results = benchmark_codecs(payloads, repeat=ns.num_images)
+        print(format_codec_report(results))
+        if ns.output is not None:
+            with open(ns.output, "w") as fp:
+                json.dump(results, fp, indent=2)
+        return
+
+    results = run_benchmark(plugins=ns.plugins, num_images=ns.num_images, warmup=ns.warmup,
+                            image_width=ns.image_width, image_height=ns.image_height, image_format=ns.image_format,
+                            payload_size=ns.payload_size, delay=ns.delay, timeout=ns.timeout,
+                            redis_host=ns.redis_host, redis_port=ns.redis_port, redis_db=ns.redis_db,
+                            use_fakeredis=ns.fakeredis, memory=ns.memory,
+                            compression=ns.compression, compression_level=ns.compression_level)
+    print(format_report(results, baseline=baseline))
+    if ns.memory:
+        print("Peak RSS: %.1f MB" % peak_rss())
+
+    if ns.output is not None:
+        with open(ns.output, "w") as fp:
+            json.dump(results, fp, indent=2)
+
+
+def sys_main() -> int:
+    """
+    Runs the main function using the system cli arguments, and
+    returns a system error code.
+
+    :return: 0 for success, 1 for failure.
+    """
+    try:
+        main()
+        return 0
+    except Exception:
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,515 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import struct
+import threading
+import traceback
+from time import sleep, time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import redis
+from wai.logging import add_logging_level, init_logging, set_logging_level
+
+from idc.api import DATATYPES
+from idc.core import ENV_IDC_LOGLEVEL
+from idc.redis.api import COMPRESSIONS, COMPRESSION_NONE, create_compressor, is_compressed
+from idc.redis.tool.benchmark import connection_factory
+from idc.redis.tool.stand_in import StandInModel
+
+LOAD = "idc-redis-load"
+
+DESCRIPTION = "Replays images or a recorded capture onto a Redis channel at a target rate, using one or more publishers, and reports the achieved throughput and the end-to-end latency of the predictions."
+
+MODE_PUBLISH = "publish"
+MODE_PUSH = "push"
+MODES = [
+    MODE_PUBLISH,
+    MODE_PUSH,
+]
+
+IMAGE_EXTENSIONS = [".bmp", ".gif", ".jpeg", ".jpg", ".png", ".tif", ".tiff", ".webp"]
+
+CAPTURE_MAGIC = b"IDCCAP1\n"
+""" the header of capture files, followed by records of time offset (double), length (uint32) and data """
+
+CAPTURE_RECORD = struct.Struct("<dI")
+
+DEFAULT_TIMESTAMPS_KEY = "idc-redis-load:timestamps"
+
+_logger = logging.getLogger(LOAD)
+
+
+def load_images(path: str) -> List[bytes]:
+    """
+    Loads the images from the directory, in alphabetical order.
+
+    :param path: the directory with the images
+    :type path: str
+    :return: the image bytes
+    :rtype: list
+    """
+    result = []
+    for f in sorted(os.listdir(path)):
+        if os.path.splitext(f)[1].lower() not in IMAGE_EXTENSIONS:
+            continue
+        with open(os.path.join(path, f), "rb") as fp:
+            result.append(fp.read())
+    if len(result) == 0:
+        raise Exception("No images found in: %s" % path)
+    return result
+
+
+def write_capture(path: str, messages: List[Tuple[float, bytes]]):
+    """
+    Writes the messages to the capture file.
+
+    :param path: the file to write to
+    :type path: str
+    :param messages: the tuples of time offset in seconds and message data
+    :type messages: list
+    """
+    with open(path, "wb") as fp:
+        fp.write(CAPTURE_MAGIC)
+        for offset, data in messages:
+            fp.write(CAPTURE_RECORD.pack(offset, len(data)))
+            fp.write(data)
+
+
+def read_capture(path: str) -> List[Tuple[float, bytes]]:
+    """
+    Reads the messages from the capture file.
+
+    :param path: the file to read
+    :type path: str
+    :return: the tuples of time offset in seconds (relative to the first message) and message data
+    :rtype: list
+    """
+    with open(path, "rb") as fp:
+        content = fp.read()
+    if not content.startswith(CAPTURE_MAGIC):
+        raise Exception("Not a capture file: %s" % path)
+    result = []
+    pos = len(CAPTURE_MAGIC)
+    while pos < len(content):
+        offset, length = CAPTURE_RECORD.unpack_from(content, pos)
+        pos += CAPTURE_RECORD.size
+        result.append((offset, content[pos:pos + length]))
+        pos += length
+    if len(result) == 0:
+        raise Exception("Capture contains no messages: %s" % path)
+    return result
+
+
+def record_capture(connection: redis.Redis, channel: str, path: str, num_messages: int = 0) -> int:
+    """
+    Records the messages broadcast on the channel in a capture file, until the specified
+    number of messages have been received or the recording gets interrupted (Ctrl+C).
+
+    :param connection: the connection to use
+    :type connection: redis.Redis
+    :param channel: the channel to record
+    :type channel: str
+    :param path: the capture file to write
+    :type path: str
+    :param num_messages: the number of messages to record, 0 for unlimited
+    :type num_messages: int
+    :return: the number of recorded messages
+    :rtype: int
+    """
+    messages = []
+    pubsub = connection.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(channel)
+    _logger.info("Recording channel '%s'..." % channel)
+    start = None
+    try:
+        while (num_messages <= 0) or (len(messages) < num_messages):
+            message = pubsub.get_message(timeout=1.0)
+            if (message is None) or (message["type"] != "message"):
+                continue
+            now = time()
+            if start is None:
+                start = now
+            messages.append((now - start, message["data"]))
+            if _logger.isEnabledFor(logging.DEBUG):
+                _logger.debug("Recorded message #%d" % len(messages))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pubsub.close()
+    write_capture(path, messages)
+    _logger.info("Recorded %d message(s) in: %s" % (len(messages), path))
+    return len(messages)
+
+
+def send_offsets(num_images: int, rate: float = 0.0, capture_offsets: List[float] = None,
+                 speed: float = 1.0) -> Optional[List[float]]:
+    """
+    Determines when to send the images, relative to the start.
+
+    :param num_images: the total number of images to send
+    :type num_images: int
+    :param rate: the target rate in images per second, 0 for as fast as possible
+    :type rate: float
+    :param capture_offsets: the time offsets of the recorded messages for replaying them with the original timing, ignored if None
+    :type capture_offsets: list
+    :param speed: the factor for speeding up (>1) or slowing down (<1) the original timing
+    :type speed: float
+    :return: the offsets in seconds, None if as fast as possible
+    :rtype: list
+    """
+    if capture_offsets is not None:
+        # the capture gets repeated after the average interval between its messages
+        interval = capture_offsets[-1] / (len(capture_offsets) - 1) if len(capture_offsets) > 1 else 0.0
+        span = capture_offsets[-1] + interval
+        return [(capture_offsets[i % len(capture_offsets)] + (i // len(capture_offsets)) * span) / speed
+                for i in range(num_images)]
+    if rate > 0:
+        return [i / rate for i in range(num_images)]
+    return None
+
+
+def publish_images(create_connection: Callable[[], redis.Redis], payloads: List[bytes], indices: List[int],
+                   offsets: Optional[List[float]], start: float, channel: str, mode: str = MODE_PUBLISH,
+                   timestamps_key: str = DEFAULT_TIMESTAMPS_KEY):
+    """
+    Sends the images with the specified indices, as one of the publishers. The send time of each image
+    gets appended to the timestamps list in the same transaction, i.e., in the order in which the images
+    get received by the model.
+
+    :param create_connection: the function for creating the redis connection
+    :param payloads: the images to send, get cycled through
+    :type payloads: list
+    :param indices: the (global) indices of the images to send
+    :type indices: list
+    :param offsets: the time offsets of all the images relative to the start, None for as fast as possible
+    :type offsets: list
+    :param start: the start time (time.time())
+    :type start: float
+    :param channel: the channel to publish the images on (or the list to push them onto)
+    :type channel: str
+    :param mode: how to send the images, see MODES
+    :type mode: str
+    :param timestamps_key: the redis list to record the send times in
+    :type timestamps_key: str
+    """
+    connection = create_connection()
+    pipe = connection.pipeline(transaction=True)
+    delay = start - time()
+    if delay > 0:
+        sleep(delay)
+    for i in indices:
+        if offsets is not None:
+            delay = start + offsets[i] - time()
+            if delay > 0:
+                sleep(delay)
+        pipe.rpush(timestamps_key, repr(time()))
+        if mode == MODE_PUSH:
+            pipe.rpush(channel, payloads[i % len(payloads)])
+        else:
+            pipe.publish(channel, payloads[i % len(payloads)])
+        pipe.execute()
+
+
+def _publisher_process(redis_host: str, redis_port: int, redis_db: int, payloads: List[bytes], indices: List[int],
+                       offsets: Optional[List[float]], start: float, channel: str, mode: str, timestamps_key: str):
+    """
+    Entry point for the publisher processes.
+    """
+    publish_images(lambda: redis.Redis(host=redis_host, port=redis_port, db=redis_db), payloads, indices,
+                   offsets, start, channel, mode=mode, timestamps_key=timestamps_key)
+
+
+def summarize_load(sent: List[float], arrivals: List[float], target_rate: float = 0.0, in_order: bool = False) -> Dict:
+    """
+    Summarizes the load test. The predictions carry no reference to their image, so they can only
+    get matched with the images in the order of arrival. The latency is therefore only reported if
+    the model is known to respond in order and every image got answered, as a single dropped or
+    reordered prediction would shift all the following pairs.
+
+    :param sent: the send times of the images, in the order they were received by the model
+    :type sent: list
+    :param arrivals: the arrival times of the predictions
+    :type arrivals: list
+    :param target_rate: the target rate in images per second, 0 for as fast as possible
+    :type target_rate: float
+    :param in_order: whether the model responds to the images in the order it received them
+    :type in_order: bool
+    :return: the summary
+    :rtype: dict
+    """
+    result = {
+        "sent": len(sent),
+        "received": len(arrivals),
+        "unanswered": max(0, len(sent) - len(arrivals)),
+        "target_rate": target_rate if target_rate > 0 else None,
+        "send_rate": None,
+        "throughput": None,
+        "duration": None,
+        "latency_mean_ms": None,
+        "latency_p50_ms": None,
+        "latency_p90_ms": None,
+        "latency_p99_ms": None,
+        "latency_max_ms": None,
+    }
+    if len(sent) > 1:
+        result["send_rate"] = (len(sent) - 1) / (sent[-1] - sent[0]) if sent[-1] > sent[0] else None
+    if (len(sent) > 0) and (len(arrivals) > 0):
+        result["duration"] = arrivals[-1] - sent[0]
+        result["throughput"] = len(arrivals) / result["duration"] if result["duration"] > 0 else None
+    if not in_order:
+        _logger.warning("Predictions can only be matched with images by order of arrival, not reporting latency "
+                        "(use --in_order if the model responds in order)")
+    elif len(arrivals) != len(sent):
+        _logger.warning("Number of predictions and images differ (%d != %d), not reporting latency"
+                        % (len(arrivals), len(sent)))
+    elif len(sent) > 0:
+        arr = (np.array(arrivals) - np.array(sent)) * 1000.0
+        result["latency_mean_ms"] = float(arr.mean())
+        result["latency_p50_ms"] = float(np.percentile(arr, 50))
+        result["latency_p90_ms"] = float(np.percentile(arr, 90))
+        result["latency_p99_ms"] = float(np.percentile(arr, 99))
+        result["latency_max_ms"] = float(arr.max())
+    return result
+
+
+def format_load_report(result: Dict) -> str:
+    """
+    Generates a textual report from the load test summary.
+
+    :param result: the summary to report
+    :type result: dict
+    :return: the report
+    :rtype: str
+    """
+    def fmt(value, unit=""):
+        return "-" if value is None else ("%.2f%s" % (value, unit))
+
+    lines = [
+        "images sent:      %d" % result["sent"],
+        "predictions:      %d" % result["received"],
+        "unanswered:       %d" % result["unanswered"],
+        "target rate:      %s" % fmt(result["target_rate"], " images/s"),
+        "send rate:        %s" % fmt(result["send_rate"], " images/s"),
+        "throughput:       %s" % fmt(result["throughput"], " images/s"),
+        "latency mean:     %s" % fmt(result["latency_mean_ms"], " ms"),
+        "latency p50:      %s" % fmt(result["latency_p50_ms"], " ms"),
+        "latency p90:      %s" % fmt(result["latency_p90_ms"], " ms"),
+        "latency p99:      %s" % fmt(result["latency_p99_ms"], " ms"),
+        "latency max:      %s" % fmt(result["latency_max_ms"], " ms"),
+    ]
+    return "\n".join(lines)
+
+
+def run_load(payloads: List[bytes], num_images: int = 0, rate: float = 0.0, capture_offsets: List[float] = None,
+             speed: float = 1.0, num_publishers: int = 1, channel_images: str = "images",
+             channel_predictions: str = "predictions", mode: str = MODE_PUBLISH, timeout: float = 5.0,
+             timestamps_key: str = None, compression: str = None, compression_level: int = None,
+             stand_in: str = None, delay: float = 0.0, in_order: bool = False, redis_host: str = "localhost", redis_port: int = 6379,
+             redis_db: int = 0, use_fakeredis: bool = False) -> Dict:
+    """
+    Sends the images with the publishers and collects the predictions.
+
+    :param payloads: the images to send, get cycled through
+    :type payloads: list
+    :param num_images: the total number of images to send, 0 for sending each image once
+    :type num_images: int
+    :param rate: the target rate in images per second across all publishers, 0 for as fast as possible
+    :type rate: float
+    :param capture_offsets: the time offsets of the recorded messages for replaying them with the original timing, ignored if None
+    :type capture_offsets: list
+    :param speed: the factor for speeding up (>1) or slowing down (<1) the original timing
+    :type speed: float
+    :param num_publishers: the number of publishers (processes, or threads when using fakeredis)
+    :type num_publishers: int
+    :param channel_images: the channel to publish the images on (or the list to push them onto)
+    :type channel_images: str
+    :param channel_predictions: the channel the predictions get broadcast on
+    :type channel_predictions: str
+    :param mode: how to send the images, see MODES
+    :type mode: str
+    :param timeout: the time in seconds to wait for outstanding predictions after the last image was sent
+    :type timeout: float
+    :param timestamps_key: the redis list to record the send times in, uses a process-specific key if None
+    :type timestamps_key: str
+    :param compression: the codec for compressing the images, None for no compression
+    :type compression: str
+    :param compression_level: the compression level, uses the default of the codec if None
+    :type compression_level: int
+    :param stand_in: the data type for an in-process stand-in model to respond to the images, ignored if None
+    :type stand_in: str
+    :param delay: the artificial delay in seconds of the stand-in model
+    :type delay: float
+    :param in_order: whether the model responds to the images in the order it received them, always the case for the stand-in model
+    :type in_order: bool
+    :param redis_host: the redis host to use
+    :type redis_host: str
+    :param redis_port: the port to use
+    :type redis_port: int
+    :param redis_db: the database to use
+    :type redis_db: int
+    :param use_fakeredis: whether to use fakeredis instead of a redis server
+    :type use_fakeredis: bool
+    :return: the summary
+    :rtype: dict
+    """
+    if mode not in MODES:
+        raise Exception("Unsupported mode: %s" % mode)
+    if (stand_in is not None) and (mode != MODE_PUBLISH):
+        raise Exception("The stand-in model only supports mode: %s" % MODE_PUBLISH)
+    if num_publishers < 1:
+        raise Exception("Number of publishers must be at least 1: %d" % num_publishers)
+    if num_images <= 0:
+        num_images = len(payloads)
+    if timestamps_key is None:
+        timestamps_key = "%s:%d" % (DEFAULT_TIMESTAMPS_KEY, os.getpid())
+    compressor = create_compressor(compression, level=compression_level)
+    # captures may contain compressed images already
+    payloads = [x if is_compressed(x) else compressor.compress(x) for x in payloads]
+    offsets = send_offsets(num_images, rate=rate, capture_offsets=capture_offsets, speed=speed)
+
+    create_connection = connection_factory(redis_host=redis_host, redis_port=redis_port, redis_db=redis_db,
+                                           use_fakeredis=use_fakeredis)
+    connection = create_connection()
+    connection.delete(timestamps_key)
+    model = None
+    if stand_in is not None:
+        model = StandInModel(create_connection(), stand_in, channel_in=channel_images,
+                             channel_out=channel_predictions, delay=delay)
+        model.start()
+    pubsub = connection.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(channel_predictions)
+
+    # fakeredis only works within the same process
+    publishers = []
+    start = time() + 0.5 + 0.1 * num_publishers
+    for n in range(num_publishers):
+        indices = list(range(n, num_images, num_publishers))
+        if use_fakeredis:
+            publisher = threading.Thread(target=publish_images, daemon=True,
+                                         args=(create_connection, payloads, indices, offsets, start, channel_images, mode, timestamps_key))
+        else:
+            publisher = multiprocessing.Process(target=_publisher_process, daemon=True,
+                                                args=(redis_host, redis_port, redis_db, payloads, indices, offsets, start, channel_images, mode, timestamps_key))
+        publishers.append(publisher)
+    _logger.info("Sending %d image(s) with %d publisher(s)..." % (num_images, num_publishers))
+
+    arrivals = []
+    try:
+        for publisher in publishers:
+            publisher.start()
+        finished = None
+        while True:
+            message = pubsub.get_message(timeout=0.1)
+            if (message is not None) and (message["type"] == "message"):
+                arrivals.append(time())
+                if _logger.isEnabledFor(logging.DEBUG):
+                    _logger.debug("Received prediction #%d" % len(arrivals))
+            if finished is None:
+                if not any(x.is_alive() for x in publishers):
+                    finished = time()
+            elif (len(arrivals) >= num_images) or (time() - finished >= timeout):
+                break
+        sent = [float(x) for x in connection.lrange(timestamps_key, 0, -1)]
+    finally:
+        for publisher in publishers:
+            publisher.join(timeout=1.0)
+        pubsub.close()
+        if model is not None:
+            model.stop()
+        connection.delete(timestamps_key)
+
+    if len(sent) < num_images:
+        _logger.warning("Only %d of %d image(s) sent, see publisher errors" % (len(sent), num_images))
+    if len(arrivals) > len(sent):
+        _logger.warning("More predictions than images, other clients publishing on '%s'?" % channel_predictions)
+    return summarize_load(sent, arrivals, target_rate=rate if capture_offsets is None else 0.0,
+                          in_order=in_order or (stand_in is not None))
+
+
+def main(args=None):
+    """
+    The main method for parsing command-line arguments.
+
+    :param args: the commandline arguments, uses sys.argv if not supplied
+    :type args: list
+    """
+    init_logging(env_var=ENV_IDC_LOGLEVEL)
+    parser = argparse.ArgumentParser(prog=LOAD, description=DESCRIPTION, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-H", "--redis_host", type=str, help="The Redis server to connect to.", default="localhost", required=False)
+    parser.add_argument("-p", "--redis_port", type=int, help="The port the Redis server is running on.", default=6379, required=False)
+    parser.add_argument("-d", "--redis_db", type=int, help="The database to use.", default=0, required=False)
+    parser.add_argument("-F", "--fakeredis", action="store_true", help="Whether to use an in-process fakeredis server instead of a Redis server (requires --stand_in; the publishers run as threads).", required=False)
+    parser.add_argument("-s", "--source", metavar="DIR_OR_FILE", type=str, help="The directory with the images to send or the capture file to replay.", required=True)
+    parser.add_argument("-R", "--record", action="store_true", help="Whether to record the messages broadcast on --channel_images in the capture file --source instead (stops after --num_images or Ctrl+C).", required=False)
+    parser.add_argument("--channel_images", metavar="CHANNEL", type=str, help="The channel to publish the images on (or the list to push them onto).", default="images", required=False)
+    parser.add_argument("--channel_predictions", metavar="CHANNEL", type=str, help="The channel the model broadcasts the predictions on.", default="predictions", required=False)
+    parser.add_argument("-m", "--mode", choices=MODES, type=str, help="How to send the images: publish them on the channel (model servers, redis-image-listen) or push them onto the list (redis-image-listen with --queue_policy block).", default=MODE_PUBLISH, required=False)
+    parser.add_argument("-n", "--num_images", type=int, help="The total number of images to send, cycling through the source; 0 for sending each image once.", default=0, required=False)
+    parser.add_argument("-r", "--rate", metavar="FPS", type=float, help="The target rate in images per second across all publishers, 0 for as fast as possible.", default=0.0, required=False)
+    parser.add_argument("--realtime", action="store_true", help="Whether to replay the capture with the original timing rather than --rate.", required=False)
+    parser.add_argument("--speed", type=float, help="The factor for speeding up (>1) or slowing down (<1) the original timing of the capture.", default=1.0, required=False)
+    parser.add_argument("-j", "--num_publishers", type=int, help="The number of publisher processes.", default=1, required=False)
+    parser.add_argument("-t", "--timeout", type=float, help="The time in seconds to wait for outstanding predictions after the last image was sent.", default=5.0, required=False)
+    parser.add_argument("-c", "--compression", choices=COMPRESSIONS, type=str, help="The codec for compressing the images, like the predict filters.", default=COMPRESSION_NONE, required=False)
+    parser.add_argument("--compression_level", type=int, help="The compression level, uses the default of the codec if omitted.", default=None, required=False)
+    parser.add_argument("-T", "--stand_in", choices=DATATYPES, type=str, help="The data type for an in-process stand-in model that responds to the images, e.g., for testing the load test itself.", default=None, required=False)
+    parser.add_argument("-D", "--delay", type=float, help="The artificial delay in seconds of the stand-in model.", default=0.0, required=False)
+    parser.add_argument("--in_order", action="store_true", help="Whether the model is known to respond to every image in the order it received them (e.g., a single worker), required for reporting the latency, as the predictions can only be matched with the images by order of arrival.", required=False)
+    parser.add_argument("--timestamps_key", metavar="KEY", type=str, help="The Redis list to record the send times in, uses a process-specific key if omitted.", default=None, required=False)
+    parser.add_argument("-o", "--output", metavar="FILE", type=str, help="The JSON file to store the results in.", default=None, required=False)
+    add_logging_level(parser)
+    ns = parser.parse_args(args=args)
+    set_logging_level(_logger, ns.logging_level)
+
+    if ns.record:
+        connection = redis.Redis(host=ns.redis_host, port=ns.redis_port, db=ns.redis_db)
+        record_capture(connection, ns.channel_images, ns.source, num_messages=ns.num_images)
+        return
+
+    if ns.fakeredis and (ns.stand_in is None):
+        raise Exception("No model server can connect to fakeredis, --stand_in is required!")
+    capture_offsets = None
+    if os.path.isdir(ns.source):
+        if ns.realtime:
+            raise Exception("Original timing is only available when replaying a capture!")
+        payloads = load_images(ns.source)
+    else:
+        messages = read_capture(ns.source)
+        payloads = [x[1] for x in messages]
+        if ns.realtime:
+            capture_offsets = [x[0] for x in messages]
+
+    result = run_load(payloads, num_images=ns.num_images, rate=ns.rate, capture_offsets=capture_offsets,
+                      speed=ns.speed, num_publishers=ns.num_publishers, channel_images=ns.channel_images,
+                      channel_predictions=ns.channel_predictions, mode=ns.mode, timeout=ns.timeout,
+                      timestamps_key=ns.timestamps_key, compression=ns.compression,
+                      compression_level=ns.compression_level, stand_in=ns.stand_in, delay=ns.delay,
+                      redis_host=ns.redis_host, redis_port=ns.redis_port, redis_db=ns.redis_db,
+                      in_order=ns.in_order, use_fakeredis=ns.fakeredis)
+    print(format_load_report(result))
+
+    if ns.output is not None:
+        with open(ns.output, "w") as fp:
+            json.dump(result, fp, indent=2)
+
+
+def sys_main() -> int:
+    """
+    Runs the main function using the system cli arguments, and
+    returns a system error code.
+
+    :return: 0 for success, 1 for failure.
+    """
+    try:
+        main()
+        return 0
+    except Exception:
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,346 @@
+import argparse
+import io
+import json
+import logging
+import traceback
+from time import sleep
+from typing import Dict, List, Tuple
+
+import numpy as np
+import redis
+from PIL import Image
+from opex import ObjectPredictions, ObjectPrediction, BBox, Polygon
+from wai.logging import add_logging_level, init_logging, set_logging_level
+
+from idc.api import DATATYPES, DATATYPE_DEPTH, DATATYPE_IMGCLS, DATATYPE_IMGSEG, DATATYPE_OBJDET
+from idc.core import ENV_IDC_LOGLEVEL
+from idc.redis.api import COMPRESSIONS, create_compressor
+
+STAND_IN = "idc-redis-stand-in"
+
+DESCRIPTION = "Stand-in model server that responds to images with fake predictions, for benchmarking the redis plugins."
+
+FORMAT_GRAYSCALE = "grayscale"
+FORMAT_GRAYSCALE_DEPTH = "grayscale-depth"
+FORMAT_NUMPY = "numpy"
+FORMAT_INDEXEDPNG = "indexedpng"
+FORMAT_BLUECHANNEL = "bluechannel"
+FORMAT_JSON = "json"
+FORMAT_OPEX = "opex"
+
+FORMATS = {
+    DATATYPE_DEPTH: [FORMAT_GRAYSCALE, FORMAT_GRAYSCALE_DEPTH, FORMAT_NUMPY],
+    DATATYPE_IMGCLS: [FORMAT_JSON, FORMAT_NUMPY],
+    DATATYPE_IMGSEG: [FORMAT_INDEXEDPNG, FORMAT_BLUECHANNEL, FORMAT_GRAYSCALE],
+    DATATYPE_OBJDET: [FORMAT_OPEX],
+}
+
+_logger = logging.getLogger(STAND_IN)
+
+
+def default_format(data_type: str) -> str:
+    """
+    Returns the default prediction format for the data type.
+
+    :param data_type: the data type, see idc.api.DATATYPES
+    :type data_type: str
+    :return: the format
+    :rtype: str
+    """
+    if data_type not in FORMATS:
+        raise Exception("Unsupported data type: %s" % data_type)
+    return FORMATS[data_type][0]
+
+
+def _png_bytes(img: Image.Image) -> bytes:
+    """
+    Turns the image into PNG bytes.
+
+    :param img: the image to convert
+    :type img: Image.Image
+    :return: the PNG bytes
+    :rtype: bytes
+    """
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def class_labels(num_classes: int) -> List[str]:
+    """
+    Generates the class labels for image classification predictions.
+
+    :param num_classes: the number of classes
+    :type num_classes: int
+    :return: the labels
+    :rtype: list
+    """
+    return ["class-%d" % i for i in range(max(1, num_classes))]
+
+
+def generate_prediction(data_type: str, width: int, height: int, payload_size: int = 10,
+                        data_format: str = None, seed: int = 42) -> bytes:
+    """
+    Generates a fake prediction for an image with the specified dimensions.
+
+    The payload size is interpreted per data type: number of classes (ic),
+    number of labels (is), number of objects (od); for depth it is ignored,
+    as the size is determined by the image dimensions.
+
+    :param data_type: the data type to generate the prediction for, see idc.api.DATATYPES
+    :type data_type: str
+    :param width: the width of the image
+    :type width: int
+    :param height: the height of the image
+    :type height: int
+    :param payload_size: the size of the payload (classes/labels/objects)
+    :type payload_size: int
+    :param data_format: the format of the prediction, uses the default of the data type if None
+    :type data_format: str
+    :param seed: the seed for the random number generator
+    :type seed: int
+    :return: the generated prediction
+    :rtype: bytes
+    """
+    if data_format is None:
+        data_format = default_format(data_type)
+    if data_format not in FORMATS.get(data_type, []):
+        raise Exception("Unsupported format for data type %s: %s" % (data_type, data_format))
+    payload_size = max(1, payload_size)
+    rnd = np.random.default_rng(seed)
+
+    if data_type == DATATYPE_IMGCLS:
+        probs = rnd.random(payload_size)
+        probs /= probs.sum()
+        if data_format == FORMAT_NUMPY:
+            # array-form: the labels are available via the labels key
+            buffer = io.BytesIO()
+            np.save(buffer, probs.astype(np.float32))
+            return buffer.getvalue()
+        preds = dict()
+        for i, label in enumerate(class_labels(payload_size)):
+            preds[label] = float(probs[i])
+        return json.dumps(preds).encode()
+
+    elif data_type == DATATYPE_OBJDET:
+        objects = []
+        for i in range(payload_size):
+            left = int(rnd.integers(0, max(1, width - 1)))
+            top = int(rnd.integers(0, max(1, height - 1)))
+            right = int(rnd.integers(left, width))
+            bottom = int(rnd.integers(top, height))
+            points = [[left, top], [right, top], [right, bottom], [left, bottom]]
+            objects.append(ObjectPrediction(score=float(rnd.random()), label="object-%d" % (i % 10),
+                                            bbox=BBox(left=left, top=top, right=right, bottom=bottom),
+                                            polygon=Polygon(points=points)))
+        preds = ObjectPredictions(id="stand-in", timestamp="2000-01-01 00:00:00.000000", objects=objects)
+        return preds.to_json_string().encode()
+
+    elif data_type == DATATYPE_IMGSEG:
+        # horizontal stripes, one per label (index 0 is background)
+        num_labels = min(payload_size, 254)
+        arr = (np.arange(height, dtype=np.uint32) * (num_labels + 1) // max(1, height)).astype(np.uint8)
+        arr = np.repeat(arr[:, np.newaxis], width, axis=1)
+        if data_format == FORMAT_INDEXEDPNG:
+            img = Image.fromarray(arr, "P")
+            img.putpalette([i % 256 for i in range(768)])
+        elif data_format == FORMAT_BLUECHANNEL:
+            rgb = np.zeros((height, width, 3), dtype=np.uint8)
+            rgb[:, :, 2] = arr
+            img = Image.fromarray(rgb, "RGB")
+        else:
+            img = Image.fromarray(arr, "L")
+        return _png_bytes(img)
+
+    elif data_type == DATATYPE_DEPTH:
+        # diagonal gradient
+        arr = np.add.outer(np.arange(height, dtype=np.float32), np.arange(width, dtype=np.float32))
+        arr /= max(1.0, float(arr.max()))
+        if data_format == FORMAT_NUMPY:
+            buffer = io.BytesIO()
+            np.save(buffer, arr * 10.0)
+            return buffer.getvalue()
+        elif data_format == FORMAT_GRAYSCALE_DEPTH:
+            # 16-bit, in mm
+            return _png_bytes(Image.fromarray((arr * 10000).astype(np.uint16)))
+        else:
+            return _png_bytes(Image.fromarray((arr * 255).astype(np.uint8), "L"))
+
+    else:
+        raise Exception("Unsupported data type: %s" % data_type)
+
+
+class StandInModel:
+    """
+    Listens for images on a channel and responds with fake predictions after an artificial delay.
+    Predictions are cached per image dimensions, so that generating them does not skew the timings.
+    """
+
+    def __init__(self, connection: redis.Redis, data_type: str, data_format: str = None,
+                 channel_in: str = "images", channel_out: str = "predictions",
+                 payload_size: int = 10, delay: float = 0.0, labels_key: str = None,
+                 compression: str = None, compression_level: int = None, logger: logging.Logger = None):
+        """
+        Initializes the model.
+
+        :param connection: the redis connection to use
+        :type connection: redis.Redis
+        :param data_type: the data type to generate the predictions for, see idc.api.DATATYPES
+        :type data_type: str
+        :param data_format: the format of the predictions, uses the default of the data type if None
+        :type data_format: str
+        :param channel_in: the channel to receive the images on
+        :type channel_in: str
+        :param channel_out: the channel to send the predictions on
+        :type channel_out: str
+        :param payload_size: the size of the payload (classes/labels/objects)
+        :type payload_size: int
+        :param delay: the artificial delay in seconds before responding
+        :type delay: float
+        :param labels_key: the key to store the class labels under for array-form image classification predictions, ignored if None
+        :type labels_key: str
+        :param compression: the codec to compress the predictions with, compressed images get detected automatically
+        :type compression: str
+        :param compression_level: the compression level, uses the codec's default if None
+        :type compression_level: int
+        :param logger: the optional logger to use
+        :type logger: logging.Logger
+        """
+        self.connection = connection
+        self.data_type = data_type
+        self.data_format = data_format
+        self.channel_in = channel_in
+        self.channel_out = channel_out
+        self.payload_size = payload_size
+        self.delay = delay
+        self.labels_key = labels_key
+        self.logger = logger
+        self._compressor = create_compressor(compression, level=compression_level)
+        self.num_requests = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._cache: Dict[Tuple[int, int], bytes] = dict()
+        self._pubsub = None
+        self._thread = None
+
+    def _respond(self, message):
+        """
+        Handles an incoming image.
+
+        :param message: the pubsub message
+        :type message: dict
+        """
+        data = message['data']
+        size = Image.open(io.BytesIO(self._compressor.decompress(data))).size
+        if size not in self._cache:
+            prediction = generate_prediction(self.data_type, size[0], size[1], payload_size=self.payload_size,
+                                             data_format=self.data_format)
+            self._cache[size] = self._compressor.compress(prediction)
+        if self.delay > 0:
+            sleep(self.delay)
+        prediction = self._cache[size]
+        self.num_requests += 1
+        self.bytes_in += len(data)
+        self.bytes_out += len(prediction)
+        self.connection.publish(self.channel_out, prediction)
+        if (self.logger is not None) and self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Responded to image #%d (%dx%d)" % (self.num_requests, size[0], size[1]))
+
+    def start(self, sleep_time: float = 0.001):
+        """
+        Starts listening in a background thread.
+
+        :param sleep_time: the time in seconds between polls
+        :type sleep_time: float
+        """
+        if self._thread is not None:
+            return
+        if (self.labels_key is not None) and (self.data_type == DATATYPE_IMGCLS) and (self.data_format == FORMAT_NUMPY):
+            self.connection.set(self.labels_key, json.dumps(class_labels(self.payload_size)))
+        self._pubsub = self.connection.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(**{self.channel_in: self._respond})
+        self._thread = self._pubsub.run_in_thread(sleep_time=sleep_time, daemon=True)
+        if self.logger is not None:
+            self.logger.info("Listening on '%s', responding on '%s'" % (self.channel_in, self.channel_out))
+
+    def stop(self):
+        """
+        Stops listening.
+        """
+        if self._thread is not None:
+            self._thread.stop()
+            self._thread.join()
+            self._thread = None
+        if self._pubsub is not None:
+            self._pubsub.close()
+            self._pubsub = None
+
+    def reset_counters(self):
+        """
+        Resets the request/byte counters.
+        """
+        self.num_requests = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+
+def main(args=None):
+    """
+    The main method for parsing command-line arguments.
+
+    :param args: the commandline arguments, uses sys.argv if not supplied
+    :type args: list
+    """
+    init_logging(env_var=ENV_IDC_LOGLEVEL)
+    parser = argparse.ArgumentParser(prog=STAND_IN, description=DESCRIPTION, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-H", "--redis_host", type=str, help="The Redis server to connect to.", default="localhost", required=False)
+    parser.add_argument("-p", "--redis_port", type=int, help="The port the Redis server is running on.", default=6379, required=False)
+    parser.add_argument("-d", "--redis_db", type=int, help="The database to use.", default=0, required=False)
+    parser.add_argument("-i", "--channel_in", type=str, help="The Redis channel to receive the images on.", default="images", required=False)
+    parser.add_argument("-o", "--channel_out", type=str, help="The Redis channel to send the predictions on.", default="predictions", required=False)
+    parser.add_argument("-T", "--data_type", choices=DATATYPES, type=str, help="The type of predictions to generate.", required=True)
+    parser.add_argument("-f", "--data_format", type=str, help="The format of the predictions (dp: %s; ic: %s; is: %s; od: %s), uses the data type's default if omitted."
+                                                             % ("|".join(FORMATS[DATATYPE_DEPTH]), "|".join(FORMATS[DATATYPE_IMGCLS]), "|".join(FORMATS[DATATYPE_IMGSEG]), "|".join(FORMATS[DATATYPE_OBJDET])),
+                        default=None, required=False)
+    parser.add_argument("-S", "--payload_size", type=int, help="The size of the payload: number of classes (ic), labels (is) or objects (od).", default=10, required=False)
+    parser.add_argument("-D", "--delay", type=float, help="The artificial delay in seconds before responding.", default=0.0, required=False)
+    parser.add_argument("-c", "--compression", choices=COMPRESSIONS, type=str, help="The codec to compress the predictions with; compressed images are detected automatically.", default="none", required=False)
+    parser.add_argument("--compression_level", type=int, help="The compression level, uses the default of the codec if omitted.", default=None, required=False)
+    parser.add_argument("-L", "--labels_key", type=str, help="The key to store the class labels under (JSON array) for array-form image classification predictions (ic: numpy).", default="labels", required=False)
+    add_logging_level(parser)
+    ns = parser.parse_args(args=args)
+    set_logging_level(_logger, ns.logging_level)
+
+    connection = redis.Redis(host=ns.redis_host, port=ns.redis_port, db=ns.redis_db)
+    model = StandInModel(connection, ns.data_type, data_format=ns.data_format,
+                         channel_in=ns.channel_in, channel_out=ns.channel_out,
+                         payload_size=ns.payload_size, delay=ns.delay, labels_key=ns.labels_key,
+                         compression=ns.compression, compression_level=ns.compression_level, logger=_logger)
+    model.start()
+    try:
+        while True:
+            sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        model.stop()
+        _logger.info("# requests: %d" % model.num_requests)
+
+
+def sys_main() -> int:
+    """
+    Runs the main function using the system cli arguments, and
+    returns a system error code.
+
+    :return: 0 for success, 1 for failure.
+    """
+    try:
+        main()
+        return 0
+    except Exception:
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == '__main__':
+    main()
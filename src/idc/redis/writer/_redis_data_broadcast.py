@@ -4,14 +4,24 @@ from typing import List
 
 from wai.logging import LOGGING_WARNING
 
+from kasperl.api import make_list
 from kasperl.redis.writer import AbstractRedisBroadcaster
 from idc.api import ImageData
+from idc.redis.api import STAGE_SERIALIZE, STAGE_PUBLISH, timed, add_stats_options, create_stats_reporter
+from idc.redis.api import acquire_client, release_client, add_unix_socket_option
+from idc.redis.api import STAGE_COMPRESS, add_compression_options, create_compressor
+from idc.redis.api import STAGE_STORE, KEY_IMAGE_REF, DEFAULT_IMAGE_REF_PREFIX, DEFAULT_IMAGE_REF_TTL, store_image_ref
 
 
 class RedisDataBroadcast(AbstractRedisBroadcaster):
 
     def __init__(self, redis_host: str = None, redis_port: int = None, redis_db: int = None,
-                 include_image: bool = False, channel_out: str = None, logger_name: str = None, logging_level: str = LOGGING_WARNING):
+                 include_image: bool = False, channel_out: str = None,
+                 image_ref: bool = False, image_ref_prefix: str = None, image_ref_ttl: int = None,
+                 compression: str = None, compression_level: int = None, compression_min_size: int = None,
+                 stats: bool = False, stats_interval: int = None, stats_export: str = None,
+                 redis_unix_socket: str = None,
+                 logger_name: str = None, logging_level: str = LOGGING_WARNING):
         """
         Initializes the reader.
 
@@ -25,6 +35,26 @@ class RedisDataBroadcast(AbstractRedisBroadcaster):
         :type include_image: bool
         :param channel_out: the channel to broadcast the data on
         :type channel_out: str
+        :param image_ref: whether to store the image in redis under a content-addressed key and only send the key
+        :type image_ref: bool
+        :param image_ref_prefix: the prefix for the keys of the stored images
+        :type image_ref_prefix: str
+        :param image_ref_ttl: the time-to-live in seconds of the stored images, 0 for no expiry
+        :type image_ref_ttl: int
+        :param compression: the codec to compress the data with (none/lz4/zstd)
+        :type compression: str
+        :param compression_level: the compression level, uses the codec's default if None
+        :type compression_level: int
+        :param compression_min_size: the minimum size in bytes for the data to get compressed
+        :type compression_min_size: int
+        :param stats: whether to collect timing statistics
+        :type stats: bool
+        :param stats_interval: the number of items after which to output the statistics, 0 for only when finishing
+        :type stats_interval: int
+        :param stats_export: where to export the statistics to (prometheus:FILE or statsd:HOST:PORT)
+        :type stats_export: str
+        :param redis_unix_socket: the unix socket to connect to instead of host/port, ignored if None
+        :type redis_unix_socket: str
         :param logger_name: the name to use for the logger
         :type logger_name: str
         :param logging_level: the logging level to use
@@ -32,7 +62,20 @@ class RedisDataBroadcast(AbstractRedisBroadcaster):
         """
         super().__init__(redis_host=redis_host, redis_port=redis_port, redis_db=redis_db,
                          channel_out=channel_out, logger_name=logger_name, logging_level=logging_level)
+        self.redis_unix_socket = redis_unix_socket
         self.include_image = include_image
+        self.image_ref = image_ref
+        self.image_ref_prefix = image_ref_prefix
+        self.image_ref_ttl = image_ref_ttl
+        self.compression = compression
+        self.compression_level = compression_level
+        self.compression_min_size = compression_min_size
+        self.stats = stats
+        self.stats_interval = stats_interval
+        self.stats_export = stats_export
+        self._stats = None
+        self._client = None
+        self._compressor = None
 
     def name(self) -> str:
         """
@@ -60,7 +103,13 @@ class RedisDataBroadcast(AbstractRedisBroadcaster):
         :rtype: argparse.ArgumentParser
         """
         parser = super()._create_argparser()
+        add_unix_socket_option(parser)
         parser.add_argument("-i", "--include_image", action="store_true", help="Whether to send the image as well.", required=False)
+        parser.add_argument("--image_ref", action="store_true", help="Whether to store the image once in Redis under a content-addressed key and only send the key (under '%s') rather than the image itself; subscribers can fetch the image when required." % KEY_IMAGE_REF, required=False)
+        parser.add_argument("--image_ref_prefix", metavar="PREFIX", type=str, default=DEFAULT_IMAGE_REF_PREFIX, help="The prefix for the keys of the stored images.", required=False)
+        parser.add_argument("--image_ref_ttl", metavar="SEC", type=int, default=DEFAULT_IMAGE_REF_TTL, help="The time-to-live in seconds of the stored images, 0 for no expiry.", required=False)
+        add_compression_options(parser)
+        add_stats_options(parser)
         return parser
 
     def _apply_args(self, ns: argparse.Namespace):
@@ -71,15 +120,43 @@ class RedisDataBroadcast(AbstractRedisBroadcaster):
         :type ns: argparse.Namespace
         """
         super()._apply_args(ns)
+        self.redis_unix_socket = ns.redis_unix_socket
         self.include_image = ns.include_image
+        self.image_ref = ns.image_ref
+        self.image_ref_prefix = ns.image_ref_prefix
+        self.image_ref_ttl = ns.image_ref_ttl
+        self.compression = ns.compression
+        self.compression_level = ns.compression_level
+        self.compression_min_size = ns.compression_min_size
+        self.stats = ns.stats
+        self.stats_interval = ns.stats_interval
+        self.stats_export = ns.stats_export
 
     def initialize(self):
         """
         Initializes the processing, e.g., for opening files or databases.
         """
         super().initialize()
+        # share connection pool with the other redis plugins in the pipeline
+        self._client = acquire_client(self.redis_host, self.redis_port, self.redis_db,
+                                      redis_unix_socket=self.redis_unix_socket)
+        self._redis_session.connection = self._client.connection
         if self.include_image is None:
             self.include_image = False
+        if self.image_ref is None:
+            self.image_ref = False
+        if self.image_ref_prefix is None:
+            self.image_ref_prefix = DEFAULT_IMAGE_REF_PREFIX
+        if self.image_ref_ttl is None:
+            self.image_ref_ttl = DEFAULT_IMAGE_REF_TTL
+        if self.include_image and self.image_ref:
+            raise Exception("Cannot both include the image and send a reference to it!")
+        if self.stats is None:
+            self.stats = False
+        self._compressor = create_compressor(self.compression, level=self.compression_level,
+                                             min_size=self.compression_min_size)
+        self._stats = create_stats_reporter(self.stats, self.name(), self.logger(),
+                                            interval=self.stats_interval, export=self.stats_export)
 
     def accepts(self) -> List:
         """
@@ -90,12 +167,53 @@ class RedisDataBroadcast(AbstractRedisBroadcaster):
         """
         return [ImageData]
 
-    def _process_data(self, data):
+    def _process_data(self, data, image_ref: str = None):
         """
         For processing the incoming data.
 
         :param data: the incoming data
+        :param image_ref: the key of the stored image, ignored if None
+        :type image_ref: str
         :return: the generated data to broadcast
         """
         d = data.to_dict(source=False, metadata=False, image=self.include_image)
+        if image_ref is not None:
+            d[KEY_IMAGE_REF] = image_ref
         return json.dumps(d)
+
+    def write_stream(self, data):
+        """
+        Saves the data one by one.
+
+        :param data: the data to write (single record or iterable of records)
+        """
+        for item in make_list(data):
+            self.logger().info("Broadcasting on %s: %s" % (self._redis_session.channel_out, item.image_name))
+            image_ref = None
+            if self.image_ref:
+                # the image only gets uploaded if not already stored, no re-encoding if the bytes are available
+                with timed(self._stats, STAGE_STORE):
+                    image_ref = store_image_ref(self._redis_session.connection,
+                                                item.image_bytes if (item.data is None) else item.data,
+                                                prefix=self.image_ref_prefix, ttl=self.image_ref_ttl)
+            with timed(self._stats, STAGE_SERIALIZE):
+                payload = self._process_data(item, image_ref=image_ref)
+            if self._compressor.enabled:
+                with timed(self._stats, STAGE_COMPRESS):
+                    payload = self._compressor.compress(payload)
+            with timed(self._stats, STAGE_PUBLISH):
+                self._redis_session.connection.publish(self._redis_session.channel_out, payload)
+            if self._stats is not None:
+                self._stats.item_done()
+
+    def finalize(self):
+        """
+        Finishes the processing, e.g., for closing files or databases.
+        """
+        if self._stats is not None:
+            self._stats.close()
+            self._stats = None
+        if self._client is not None:
+            release_client(self._client)
+            self._client = None
+        super().finalize()
@@ -0,0 +1,113 @@
+import hashlib
+import json
+from time import sleep
+
+import fakeredis
+import pytest
+
+from idc.api import ImageClassificationData
+from idc.redis.api import set_connection_factory, reset_shutdown
+from idc.redis.tool.benchmark import generate_image
+
+
+@pytest.fixture
+def server():
+    """
+    Provides an in-process redis server that all the plugins connect to.
+    """
+    srv = fakeredis.FakeServer()
+    set_connection_factory(lambda host, port, db, unix_socket: fakeredis.FakeRedis(server=srv))
+    yield srv
+    set_connection_factory(None)
+    reset_shutdown()
+
+
+@pytest.fixture
+def connection(server):
+    """
+    Provides a connection to the in-process redis server.
+    """
+    return fakeredis.FakeRedis(server=server)
+
+
+def image_label(data: bytes) -> str:
+    """
+    Generates the label that the echo model predicts for the image.
+    """
+    return "label-" + hashlib.md5(data).hexdigest()[:8]
+
+
+class EchoModel:
+    """
+    Model that responds to each image with an image classification prediction derived
+    from the image content, after the configurable delay.
+    """
+
+    def __init__(self, connection, channel_in: str = "images", channel_out: str = "predictions"):
+        self.connection = connection
+        self.channel_in = channel_in
+        self.channel_out = channel_out
+        self.delay = 0.0
+        self.num_requests = 0
+        self._pubsub = None
+        self._thread = None
+
+    def _respond(self, message):
+        if self.delay > 0:
+            sleep(self.delay)
+        self.num_requests += 1
+        self.connection.publish(self.channel_out, json.dumps({image_label(message["data"]): 1.0}))
+
+    def start(self):
+        self._pubsub = self.connection.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(**{self.channel_in: self._respond})
+        self._thread = self._pubsub.run_in_thread(sleep_time=0.001, daemon=True)
+        while self.connection.pubsub_numsub(self.channel_in)[0][1] < 1:
+            sleep(0.001)
+
+    def stop(self):
+        self._thread.stop()
+        self._thread.join()
+        self._pubsub.close()
+
+
+@pytest.fixture
+def echo_model(connection):
+    """
+    Provides the started echo model.
+    """
+    model = EchoModel(connection)
+    model.start()
+    yield model
+    model.stop()
+
+
+def wait_for(condition, timeout: float = 5.0):
+    """
+    Waits for the condition to become true.
+    """
+    for _ in range(int(timeout / 0.001)):
+        if condition():
+            return True
+        sleep(0.001)
+    return condition()
+
+
+def make_items(num: int, offset: int = 0):
+    """
+    Generates the specified number of distinct image classification containers.
+    """
+    result = []
+    for i in range(offset, offset + num):
+        data = generate_image(16, 16, seed=i)
+        result.append(ImageClassificationData(image_name="img-%d.png" % i, data=data, image_size=(16, 16)))
+    return result
+
+
+def process_item(flt, item):
+    """
+    Processes the item with the filter, returns None if it got dropped.
+    """
+    output = flt.process(item)
+    # dropped items result in an empty list
+    return None if (output is None) or (output == []) else output
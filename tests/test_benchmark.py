@@ -0,0 +1,8 @@
+from idc.redis.tool.benchmark import benchmark_imports
+
+
+def test_no_eager_imports():
+    # regression check: the plugin modules must only import the heavy libraries when required
+    result = benchmark_imports(repeat=1)
+    assert result["eager"] == []
+    assert result["total_ms"] > 0
@@ -0,0 +1,74 @@
+from time import sleep
+
+from idc.redis.api import CIRCUIT_CLOSED, CIRCUIT_OPEN, CIRCUIT_HALF_OPEN, CircuitBreaker, AdaptiveTimeout
+
+
+def test_circuit_opens_after_threshold():
+    circuit = CircuitBreaker(3, 10.0)
+    for _ in range(2):
+        circuit.record_timeout()
+        assert circuit.allow_request()
+    circuit.record_timeout()
+    assert circuit.state == CIRCUIT_OPEN
+    assert not circuit.allow_request()
+    assert circuit.num_rejected == 1
+
+
+def test_circuit_success_resets_count():
+    circuit = CircuitBreaker(2, 10.0)
+    circuit.record_timeout()
+    circuit.record_success()
+    circuit.record_timeout()
+    assert circuit.state == CIRCUIT_CLOSED
+
+
+def test_circuit_probe():
+    circuit = CircuitBreaker(1, 0.05)
+    circuit.record_timeout()
+    assert not circuit.allow_request()
+    sleep(0.06)
+    assert circuit.allow_request()
+    assert circuit.state == CIRCUIT_HALF_OPEN
+    # failed probe opens the circuit again
+    circuit.record_timeout()
+    assert circuit.state == CIRCUIT_OPEN
+    sleep(0.06)
+    assert circuit.allow_request()
+    circuit.record_success()
+    assert circuit.state == CIRCUIT_CLOSED
+    assert circuit.num_rejected == 0
+
+
+def test_adaptive_timeout_uses_maximum_until_enough_samples():
+    timeout = AdaptiveTimeout(2.0, 0.01, 5.0, min_samples=10)
+    for _ in range(9):
+        timeout.add(0.1)
+    assert timeout.current() == 5.0
+    timeout.add(0.1)
+    assert abs(timeout.current() - 0.2) < 1e-9
+
+
+def test_adaptive_timeout_bounds():
+    timeout = AdaptiveTimeout(2.0, 0.5, 1.0, min_samples=1)
+    timeout.add(0.01)
+    assert timeout.current() == 0.5
+    timeout.add(10.0)
+    assert timeout.current() == 1.0
+
+
+def test_adaptive_timeout_backs_off():
+    timeout = AdaptiveTimeout(2.0, 0.01, 1.0, min_samples=5)
+    for _ in range(5):
+        timeout.add(0.05)
+    assert abs(timeout.current() - 0.1) < 1e-9
+    timeout.record_timeout()
+    assert abs(timeout.current() - 0.2) < 1e-9
+    timeout.record_timeout()
+    assert abs(timeout.current() - 0.4) < 1e-9
+    timeout.record_timeout()
+    timeout.record_timeout()
+    assert timeout.current() == 1.0
+    # adapts again once enough new samples are available
+    for _ in range(5):
+        timeout.add(0.2)
+    assert abs(timeout.current() - 0.4) < 1e-9
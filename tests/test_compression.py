@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+from idc.api import ImageClassificationData
+from idc.redis.api import Compressor, COMPRESSION_NONE, COMPRESSION_LZ4, COMPRESSION_ZSTD, COMPRESSION_MAGIC, is_compressed
+from idc.redis.filter import ImageClassificationRedisPredict
+from idc.redis.tool.benchmark import generate_image
+
+from conftest import EchoModel, image_label
+
+
+def _codec(codec):
+    pytest.importorskip("lz4.frame" if (codec == COMPRESSION_LZ4) else "zstandard")
+    return codec
+
+
+@pytest.mark.parametrize("codec", [COMPRESSION_LZ4, COMPRESSION_ZSTD])
+def test_roundtrip(codec):
+    c = Compressor(codec=_codec(codec), min_size=0)
+    data = b"abc" * 1000
+    compressed = c.compress(data)
+    assert compressed.startswith(COMPRESSION_MAGIC)
+    assert is_compressed(compressed)
+    assert len(compressed) < len(data)
+    assert bytes(c.decompress(compressed)) == data
+    # header identifies the codec, any compressor can decompress it
+    assert bytes(Compressor().decompress(compressed)) == data
+
+
+def test_uncompressed_passthrough():
+    c = Compressor(codec=COMPRESSION_NONE)
+    assert not c.enabled
+    assert c.compress(b"data") == b"data"
+    assert c.decompress(b"data") == b"data"
+    assert not is_compressed(COMPRESSION_MAGIC)
+
+
+def test_min_size():
+    c = Compressor(codec=_codec(COMPRESSION_ZSTD), min_size=100)
+    assert c.compress(b"x" * 99) == b"x" * 99
+    assert is_compressed(c.compress(b"x" * 100))
+    assert is_compressed(c.compress("x" * 100))
+
+
+def test_unsupported():
+    with pytest.raises(Exception):
+        Compressor(codec="gzip")
+    with pytest.raises(Exception):
+        Compressor().decompress(COMPRESSION_MAGIC + bytes([99]) + b"data")
+
+
+class CompressingModel(EchoModel):
+    """
+    Echo model that decompresses the images and compresses the predictions.
+    """
+
+    received = False
+
+    def _respond(self, message):
+        self.num_requests += 1
+        compressor = Compressor(codec=COMPRESSION_ZSTD, min_size=0)
+        data = bytes(compressor.decompress(message["data"]))
+        self.received = is_compressed(message["data"])
+        self.connection.publish(self.channel_out, compressor.compress(json.dumps({image_label(data): 1.0})))
+
+
+def test_filter_roundtrip(connection):
+    _codec(COMPRESSION_ZSTD)
+    model = CompressingModel(connection)
+    model.start()
+    flt = ImageClassificationRedisPredict(channel_out="images", channel_in="predictions", timeout=2.0,
+                                          compression=COMPRESSION_ZSTD, compression_min_size=0)
+    flt.initialize()
+    try:
+        data = generate_image(16, 16, seed=1)
+        output = flt.process(ImageClassificationData(image_name="img.png", data=data, image_size=(16, 16)))
+        assert model.received
+        assert output.get_annotation() == image_label(data)
+    finally:
+        flt.finalize()
+        model.stop()
@@ -0,0 +1,76 @@
+import pytest
+
+from idc.redis.api import SqliteJournal, RedisJournal, journal_key, create_journal
+from idc.redis.filter import ImageClassificationRedisPredict
+from idc.redis.tool.benchmark import generate_image
+
+from conftest import image_label, make_items, process_item
+
+
+def test_journal_key():
+    data = generate_image(8, 8, seed=1)
+    assert journal_key("a.png", data) == journal_key("a.png", memoryview(data))
+    assert journal_key("a.png", data) != journal_key("b.png", data)
+    assert journal_key("a.png", data) != journal_key("a.png", generate_image(8, 8, seed=2))
+
+
+def test_sqlite_journal(tmp_path):
+    path = str(tmp_path / "journal.db")
+    journal = SqliteJournal(path, batch_size=2, flush_interval=10.0)
+    journal.start()
+    journal.put("a", b"1")
+    # pending entries are visible before getting written
+    assert journal.get("a") == b"1"
+    journal.put("b", b"2")
+    journal.put("c", b"3")
+    journal.close()
+    assert journal.num_written == 3
+
+    journal = SqliteJournal(path)
+    assert journal.get("a") == b"1"
+    assert journal.get("c") == b"3"
+    assert journal.get("d") is None
+    journal.close()
+
+
+def test_redis_journal(connection):
+    journal = RedisJournal(connection, "journal", batch_size=10, flush_interval=0.01)
+    journal.start()
+    journal.put("a", b"1")
+    journal.close()
+    assert connection.hget("journal", "a") == b"1"
+    assert RedisJournal(connection, "journal").get("a") == b"1"
+
+
+def test_invalid_spec(connection):
+    assert create_journal(None, connection) is None
+    for spec in ["journal.db", "csv:journal.csv", "sqlite:"]:
+        with pytest.raises(Exception):
+            create_journal(spec, connection)
+
+
+@pytest.mark.parametrize("spec", ["sqlite", "redis"])
+def test_resume(echo_model, tmp_path, spec):
+    spec = ("sqlite:" + str(tmp_path / "journal.db")) if (spec == "sqlite") else "redis:journal"
+    items = make_items(5)
+
+    # first run, only gets partially through the images
+    flt = ImageClassificationRedisPredict(channel_out="images", channel_in="predictions", timeout=2.0, journal=spec)
+    flt.initialize()
+    try:
+        for item in items[:3]:
+            assert process_item(flt, item).get_annotation() == image_label(item.data)
+    finally:
+        flt.finalize()
+    assert echo_model.num_requests == 3
+
+    # resumed run, only the remaining images get sent to the model
+    flt = ImageClassificationRedisPredict(channel_out="images", channel_in="predictions", timeout=2.0, journal=spec)
+    flt.initialize()
+    try:
+        for item in items:
+            assert process_item(flt, item).get_annotation() == image_label(item.data)
+        assert flt._num_journaled == 3
+    finally:
+        flt.finalize()
+    assert echo_model.num_requests == 5
@@ -0,0 +1,58 @@
+import os
+
+from idc.redis.tool.benchmark import generate_image
+from idc.redis.tool.load import summarize_load, send_offsets, write_capture, read_capture, load_images, run_load
+
+
+def test_summarize_in_order():
+    sent = [0.0, 0.1, 0.2, 0.3]
+    arrivals = [0.01, 0.12, 0.23, 0.34]
+    result = summarize_load(sent, arrivals, target_rate=10.0, in_order=True)
+    assert result["unanswered"] == 0
+    assert abs(result["send_rate"] - 10.0) < 1e-6
+    assert abs(result["latency_max_ms"] - 40.0) < 1e-6
+    assert abs(result["latency_mean_ms"] - 25.0) < 1e-6
+
+
+def test_summarize_no_latency_when_unanswered():
+    result = summarize_load([0.0, 0.1, 0.2], [0.05, 0.15], in_order=True)
+    assert result["unanswered"] == 1
+    assert result["throughput"] is not None
+    assert result["latency_p50_ms"] is None
+
+
+def test_summarize_no_latency_when_not_in_order():
+    result = summarize_load([0.0, 0.1], [0.05, 0.15])
+    assert result["latency_p50_ms"] is None
+    assert result["throughput"] is not None
+
+
+def test_send_offsets():
+    assert send_offsets(3) is None
+    assert send_offsets(3, rate=2.0) == [0.0, 0.5, 1.0]
+    # capture gets repeated after the average interval, speed scales the timing
+    assert send_offsets(4, capture_offsets=[0.0, 1.0], speed=2.0) == [0.0, 0.5, 1.0, 1.5]
+
+
+def test_capture(tmp_path):
+    path = str(tmp_path / "test.cap")
+    messages = [(0.0, b"a"), (0.5, b""), (1.25, b"xyz")]
+    write_capture(path, messages)
+    assert read_capture(path) == messages
+
+
+def test_load_images(tmp_path):
+    for i in range(3):
+        with open(os.path.join(str(tmp_path), "img-%d.png" % i), "wb") as fp:
+            fp.write(generate_image(8, 8, seed=i))
+    with open(os.path.join(str(tmp_path), "notes.txt"), "w") as fp:
+        fp.write("ignored")
+    assert len(load_images(str(tmp_path))) == 3
+
+
+def test_run_load_with_stand_in():
+    payloads = [generate_image(32, 32, seed=i) for i in range(3)]
+    result = run_load(payloads, num_images=20, rate=200.0, num_publishers=2, stand_in="ic", use_fakeredis=True)
+    assert result["sent"] == 20
+    assert result["received"] == 20
+    assert result["latency_p99_ms"] is not None
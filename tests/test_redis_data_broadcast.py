@@ -0,0 +1,72 @@
+import json
+from time import perf_counter
+
+import pytest
+
+from idc.api import ImageClassificationData
+from idc.redis.api import KEY_IMAGE_REF, image_ref_key, store_image_ref, fetch_image_ref
+from idc.redis.tool.benchmark import generate_image
+from idc.redis.writer import RedisDataBroadcast
+
+
+def _broadcast(connection, items, **kwargs):
+    """
+    Broadcasts the items and returns the decoded messages.
+    """
+    pubsub = connection.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe("data")
+    writer = RedisDataBroadcast(channel_out="data", **kwargs)
+    writer.initialize()
+    try:
+        writer.write_stream(items)
+    finally:
+        writer.finalize()
+    result = []
+    deadline = perf_counter() + 5.0
+    while (len(result) < len(items)) and (perf_counter() < deadline):
+        # the subscribe confirmation is returned as None
+        message = pubsub.get_message(timeout=0.1)
+        if message is not None:
+            result.append(json.loads(message["data"]))
+    pubsub.close()
+    assert len(result) == len(items)
+    return result
+
+
+def test_store_image_ref(connection):
+    data = generate_image(8, 8)
+    key = store_image_ref(connection, data, ttl=60)
+    assert key == image_ref_key(data)
+    assert connection.get(key) == data
+    assert 0 < connection.ttl(key) <= 60
+    # already stored, only the time-to-live gets refreshed
+    connection.expire(key, 10)
+    assert store_image_ref(connection, data, ttl=60) == key
+    assert connection.ttl(key) > 10
+    key = store_image_ref(connection, data, prefix="other:", ttl=0)
+    assert key.startswith("other:")
+    assert connection.ttl(key) == -1
+
+
+def test_broadcast_image_ref(connection):
+    image = generate_image(8, 8, seed=1)
+    items = [ImageClassificationData(image_name="%d.png" % i, data=image, annotation="a") for i in range(2)]
+    messages = _broadcast(connection, items, image_ref=True, image_ref_ttl=60)
+    assert messages[0][KEY_IMAGE_REF] == messages[1][KEY_IMAGE_REF]
+    assert len(connection.keys("idc:image:*")) == 1
+    assert fetch_image_ref(connection, messages[0]) == image
+
+
+def test_broadcast_without_image_ref(connection):
+    items = [ImageClassificationData(image_name="1.png", data=generate_image(8, 8), annotation="a")]
+    messages = _broadcast(connection, items)
+    assert KEY_IMAGE_REF not in messages[0]
+    assert fetch_image_ref(connection, messages[0]) is None
+    assert len(connection.keys("idc:image:*")) == 0
+
+
+def test_image_ref_and_include_image(server):
+    writer = RedisDataBroadcast(channel_out="data", image_ref=True, include_image=True)
+    with pytest.raises(Exception):
+        writer.initialize()
+    writer.finalize()
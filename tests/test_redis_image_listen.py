@@ -0,0 +1,149 @@
+from time import perf_counter
+
+from idc.redis.reader import RedisImageReader
+from idc.redis.tool.benchmark import generate_image
+
+from conftest import wait_for
+
+
+def _reader(connection, **kwargs):
+    reader = RedisImageReader(data_type="ic", timeout=0.2, timeout_action="stop", **kwargs)
+    reader.initialize()
+    assert wait_for(lambda: connection.pubsub_numpat() > 0)
+    return reader
+
+
+def _read_all(reader):
+    result = []
+    while True:
+        items = list(reader.read())
+        if len(items) == 0:
+            break
+        result.extend(items)
+    return result
+
+
+def test_single_channel(connection):
+    reader = _reader(connection, channel_in="images")
+    try:
+        for i in range(3):
+            connection.publish("images", generate_image(8, 8, seed=i))
+        items = _read_all(reader)
+        assert [x.image_name for x in items] == ["1.png", "2.png", "3.png"]
+        assert items[0].get_metadata() is None
+    finally:
+        reader.finalize()
+
+
+def test_routing(connection):
+    reader = _reader(connection, channel_in="cam:*", channels_in=["other"], prefix="img")
+    try:
+        connection.publish("cam:1", generate_image(8, 8, seed=1))
+        connection.publish("other", generate_image(8, 8, seed=2))
+        connection.publish("cam:1", generate_image(8, 8, seed=3))
+        items = _read_all(reader)
+        assert [x.image_name for x in items] == ["img-cam_1-1.png", "img-other-1.png", "img-cam_1-2.png"]
+        assert [x.get_metadata()["channel"] for x in items] == ["cam:1", "other", "cam:1"]
+    finally:
+        reader.finalize()
+
+
+def test_routing_default_key(connection):
+    # the default key gets used when not going through the command-line
+    reader = _reader(connection, channel_in="a", channels_in=["b"], key_channel=None)
+    try:
+        connection.publish("b", generate_image(8, 8))
+        items = _read_all(reader)
+        assert items[0].get_metadata() == {"channel": "b"}
+    finally:
+        reader.finalize()
+
+
+def test_positional_parameters():
+    reader = RedisImageReader("host", 1234, 2, "in", 3.0, "stop", 0.1, "ic", "prefix")
+    assert (reader.redis_host, reader.redis_port, reader.redis_db) == ("host", 1234, 2)
+    assert (reader.channel_in, reader.timeout, reader.timeout_action) == ("in", 3.0, "stop")
+    assert (reader.sleep_time, reader.data_type, reader.prefix) == (0.1, "ic", "prefix")
+
+
+def test_queue_drop_oldest(connection):
+    reader = _reader(connection, channel_in="images", queue_size=2, queue_policy="drop-oldest")
+    try:
+        for i in range(4):
+            connection.publish("images", generate_image(8, 8, seed=i))
+        assert wait_for(lambda: reader.num_dropped == 2)
+        items = _read_all(reader)
+        assert [x.data for x in items] == [generate_image(8, 8, seed=i) for i in (2, 3)]
+    finally:
+        reader.finalize()
+
+
+def test_queue_drop_newest(connection):
+    reader = _reader(connection, channel_in="images", queue_size=2, queue_policy="drop-newest")
+    try:
+        for i in range(4):
+            connection.publish("images", generate_image(8, 8, seed=i))
+        assert wait_for(lambda: reader.num_dropped == 2)
+        items = _read_all(reader)
+        assert [x.data for x in items] == [generate_image(8, 8, seed=i) for i in (0, 1)]
+    finally:
+        reader.finalize()
+
+
+def test_queue_block(connection):
+    reader = RedisImageReader(data_type="ic", channel_in="images", timeout=0.3, timeout_action="stop",
+                              queue_policy="block")
+    reader.initialize()
+    try:
+        for i in range(3):
+            connection.rpush("images", generate_image(8, 8, seed=i))
+        items = _read_all(reader)
+        assert [x.data for x in items] == [generate_image(8, 8, seed=i) for i in range(3)]
+        assert connection.llen("images") == 0
+        # the timeout gets honored rather than blocking for a full slice
+        start = perf_counter()
+        assert list(reader.read()) == []
+        assert perf_counter() - start < 0.6
+    finally:
+        reader.finalize()
+
+
+def test_every_nth(connection):
+    reader = _reader(connection, channel_in="images", every_nth=3)
+    try:
+        images = [generate_image(8, 8, seed=i) for i in range(7)]
+        for image in images:
+            connection.publish("images", image)
+        items = _read_all(reader)
+        assert [x.data for x in items] == [images[0], images[3], images[6]]
+    finally:
+        reader.finalize()
+
+
+def test_max_fps(connection):
+    reader = _reader(connection, channel_in="images", max_fps=1.0)
+    try:
+        for i in range(5):
+            connection.publish("images", generate_image(8, 8, seed=i))
+        assert len(_read_all(reader)) == 1
+    finally:
+        reader.finalize()
+
+
+def test_dedup(connection):
+    reader = _reader(connection, channel_in="cam:*", dedup_threshold=4)
+    try:
+        image = generate_image(32, 32, seed=1)
+        other = generate_image(32, 32, seed=2)
+        connection.publish("cam:1", image)
+        # same content, different encoding
+        connection.publish("cam:1", generate_image(32, 32, image_format="JPEG", seed=1))
+        connection.publish("cam:1", other)
+        connection.publish("cam:1", other)
+        # duplicates only get detected per channel
+        connection.publish("cam:2", image)
+        items = _read_all(reader)
+        assert [x.data for x in items] == [image, other, image]
+        assert reader._num_duplicates == 2
+    finally:
+        reader.finalize()
@@ -0,0 +1,105 @@
+from time import perf_counter
+
+from idc.redis.api import CIRCUIT_OPEN
+from idc.redis.filter import ImageClassificationRedisPredict
+
+from conftest import image_label, make_items, process_item
+
+
+def _filter(**kwargs):
+    flt = ImageClassificationRedisPredict(channel_out="images", channel_in="predictions", **kwargs)
+    flt.initialize()
+    return flt
+
+
+def test_predictions(echo_model):
+    flt = _filter(timeout=2.0)
+    try:
+        for item in make_items(5):
+            output = process_item(flt, item)
+            assert output.get_annotation() == image_label(item.data)
+    finally:
+        flt.finalize()
+
+
+def test_adaptive_timeout_slow_down(echo_model):
+    flt = _filter(timeout=2.0, timeout_action="drop", adaptive_timeout_factor=2.0, adaptive_timeout_min=0.02)
+    try:
+        for item in make_items(25):
+            assert process_item(flt, item) is not None
+        assert flt._adaptive_timeout.current() < 0.2
+
+        # model slows down: timeouts back off, late predictions must not get used for other images
+        echo_model.delay = 0.2
+        num_ok = 0
+        for item in make_items(10, offset=100):
+            output = process_item(flt, item)
+            if output is not None:
+                assert output.get_annotation() == image_label(item.data)
+                num_ok += 1
+        assert num_ok >= 5
+        assert flt._adaptive_timeout.current() >= 0.2
+    finally:
+        flt.finalize()
+
+
+def test_model_down_costs_one_timeout_per_item(server):
+    flt = _filter(timeout=0.2, timeout_action="drop")
+    try:
+        start = perf_counter()
+        for item in make_items(6):
+            assert process_item(flt, item) is None
+        assert perf_counter() - start < 6 * 0.2 * 1.3
+    finally:
+        flt.finalize()
+
+
+def test_slow_model_costs_one_timeout_per_item(echo_model):
+    flt = _filter(timeout=0.2, timeout_action="drop")
+    try:
+        # the images get sent without waiting for the predictions of the ones that timed out
+        echo_model.delay = 0.3
+        start = perf_counter()
+        for item in make_items(6):
+            assert process_item(flt, item) is None
+        assert perf_counter() - start < 6 * 0.2 * 1.3
+
+        # late predictions get discarded rather than used for the next images
+        echo_model.delay = 0.0
+        num_ok = 0
+        for item in make_items(6, offset=100):
+            output = process_item(flt, item)
+            if output is not None:
+                assert output.get_annotation() == image_label(item.data)
+                num_ok += 1
+        assert num_ok > 0
+        assert flt._num_discarded > 0
+    finally:
+        flt.finalize()
+
+
+def test_circuit_probe_uses_full_timeout(echo_model):
+    flt = _filter(timeout=1.0, timeout_action="drop", circuit_threshold=2, circuit_probe_interval=0.0,
+                  adaptive_timeout_factor=2.0, adaptive_timeout_min=0.02)
+    try:
+        for item in make_items(25):
+            flt.process(item)
+        echo_model.delay = 0.2
+        items = make_items(3, offset=200)
+        assert process_item(flt, items[0]) is None
+        assert process_item(flt, items[1]) is None
+        assert flt._circuit.state == CIRCUIT_OPEN
+        # the probe waits for the configured timeout rather than the adaptive one
+        output = process_item(flt, items[2])
+        assert output is not None
+        assert output.get_annotation() == image_label(items[2].data)
+        assert flt._circuit.state != CIRCUIT_OPEN
+    finally:
+        flt.finalize()
+
+
+def test_positional_parameters():
+    flt = ImageClassificationRedisPredict("host", 1234, 2, "out", "in", 3.0, "input", 0.1, "raw")
+    assert (flt.redis_host, flt.redis_port, flt.redis_db) == ("host", 1234, 2)
+    assert (flt.channel_out, flt.channel_in, flt.timeout) == ("out", "in", 3.0)
+    assert (flt.timeout_action, flt.sleep_time, flt.key_raw) == ("input", 0.1, "raw")
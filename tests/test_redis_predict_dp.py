@@ -0,0 +1,86 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from idc.redis.api import resize_bilinear, load_npy_from_bytes
+from idc.redis.filter import DepthRedisPredict
+
+
+@pytest.fixture
+def depth_filter(server):
+    """
+    Provides a function for creating initialized filters, which get finalized afterwards.
+    """
+    filters = []
+
+    def create(**kwargs):
+        flt = DepthRedisPredict(**kwargs)
+        flt.initialize()
+        filters.append(flt)
+        return flt
+
+    yield create
+    for flt in filters:
+        flt.finalize()
+
+
+def _png(arr):
+    buf = io.BytesIO()
+    Image.fromarray(arr).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def test_resize_same_size():
+    arr = np.zeros((4, 6), dtype=np.float32)
+    assert resize_bilinear(arr, 6, 4) is arr
+
+
+def test_resize_matches_pil():
+    arr = np.random.RandomState(1).rand(5, 7).astype(np.float32)
+    result = resize_bilinear(arr, 14, 10)
+    expected = np.asarray(Image.fromarray(arr, mode="F").resize((14, 10), Image.BILINEAR))
+    assert result.shape == (10, 14)
+    assert result.dtype == np.float32
+    assert np.allclose(result, expected, atol=1e-5)
+
+
+def test_resize_constant_and_nan():
+    assert np.allclose(resize_bilinear(np.full((3, 3), 2.5, dtype=np.float32), 7, 5), 2.5)
+    arr = np.ones((4, 4), dtype=np.float32)
+    arr[0, 0] = np.nan
+    result = resize_bilinear(arr, 8, 8)
+    assert np.isnan(result[0, 0])
+    assert not np.isnan(result[-1, -1])
+    # neighbor without weight
+    assert not np.isnan(resize_bilinear(arr, 4, 4)[0, 1])
+
+
+def test_load_npy():
+    arr = np.arange(12, dtype=np.float32).reshape((3, 4))
+    for a in [arr, np.asfortranarray(arr)]:
+        buf = io.BytesIO()
+        np.save(buf, a)
+        assert np.array_equal(load_npy_from_bytes(buf.getvalue()), arr)
+
+
+def test_grayscale_depth_16bit(depth_filter):
+    flt = depth_filter(data_format="grayscale-depth", depth_scale=0.001, invalid_value=0, invalid_fill=-1.0)
+    arr = np.array([[0, 1000], [2000, 65535]], dtype=np.uint16)
+    depth = flt._to_depth(flt._decode(_png(arr)), 2, 2)
+    assert depth.dtype == np.float32
+    assert np.allclose(depth, [[-1.0, 1.0], [2.0, 65.535]])
+
+
+def test_depth_range_and_resize(depth_filter):
+    flt = depth_filter(data_format="numpy", min_depth=1.0, max_depth=10.0)
+    buf = io.BytesIO()
+    np.save(buf, np.array([[0.5, 2.0], [4.0, 20.0]], dtype=np.float32))
+    depth = flt._to_depth(flt._decode(buf.getvalue()), 4, 4)
+    assert depth.shape == (4, 4)
+    # invalid depth doesn't get blended into the valid values
+    assert np.isnan(depth[0, 0]) and np.isnan(depth[-1, -1])
+    assert depth[0, -1] == 2.0
+    assert depth[-1, 0] == 4.0
+    assert np.nanmax(depth) <= 10.0
@@ -0,0 +1,56 @@
+import json
+
+import numpy as np
+
+from idc.redis.filter import ImageClassificationRedisPredict
+
+LABELS = ["a", "b", "c", "d", "e"]
+
+PROBS = [0.1, 0.3, 0.05, 0.3, 0.25]
+
+
+def _filter(**kwargs):
+    flt = ImageClassificationRedisPredict(key_raw="raw", labels=LABELS, **kwargs)
+    flt._labels = LABELS
+    return flt
+
+
+def _rank_both(flt):
+    best_dict, prob_dict, raw_dict = flt._rank_dict(None, dict(zip(LABELS, PROBS)))
+    best_array, prob_array, raw_array = flt._rank_array(np.array(PROBS))
+    return (best_dict, prob_dict, list(json.loads(raw_dict).items())), \
+        (best_array, prob_array, list(json.loads(raw_array).items()))
+
+
+def test_rank_top_k():
+    from_dict, from_array = _rank_both(_filter(top_k=3, min_prob=0.0))
+    assert from_dict == from_array
+    assert from_dict[2] == [("b", 0.3), ("d", 0.3), ("e", 0.25)]
+
+
+def test_rank_min_prob():
+    from_dict, from_array = _rank_both(_filter(top_k=0, min_prob=0.2))
+    assert from_dict == from_array
+    assert from_dict[2] == [("b", 0.3), ("d", 0.3), ("e", 0.25)]
+
+
+def test_rank_top_k_exceeding_classes():
+    from_dict, from_array = _rank_both(_filter(top_k=10, min_prob=0.0))
+    assert from_dict == from_array
+    assert [x[0] for x in from_array[2]] == ["b", "d", "e", "a", "c"]
+
+
+def test_rank_array_all_sorted():
+    flt = _filter(top_k=0, min_prob=0.0)
+    best, prob, raw = flt._rank_array(np.array(PROBS))
+    assert best == "b"
+    assert [x[0] for x in json.loads(raw).items()] == ["b", "d", "e", "a", "c"]
+
+
+def test_rank_dict_as_received():
+    flt = _filter(top_k=0, min_prob=0.0)
+    data = json.dumps(dict(zip(LABELS, PROBS))).encode()
+    best, prob, raw = flt._rank_dict(data, json.loads(data))
+    assert (best, prob) == ("b", 0.3)
+    # stored as received, i.e., in the order of the model
+    assert raw == data.decode()
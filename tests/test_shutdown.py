@@ -0,0 +1,101 @@
+
+from idc.api import ImageClassificationData
+from idc.redis.api import request_shutdown, shutdown_requested, drain_remaining
+from idc.redis.filter import ImageClassificationRedisPredict
+from idc.redis.reader import RedisImageReader
+from idc.redis.tool.benchmark import generate_image
+
+from conftest import image_label, wait_for
+
+
+def test_disabled_by_default():
+    reader = RedisImageReader(data_type="ic")
+    flt = ImageClassificationRedisPredict()
+    assert reader.drain_timeout is None
+    assert flt.drain_timeout is None
+    assert not shutdown_requested()
+
+
+def test_drain_remaining():
+    assert drain_remaining(5.0) == 5.0
+    request_shutdown()
+    assert 0.0 < drain_remaining(5.0) <= 5.0
+    assert drain_remaining(0.0) == 0.0
+
+
+def test_reader_drains_buffer(connection):
+    reader = RedisImageReader(data_type="ic", channel_in="images", timeout=-1, timeout_action="keep-waiting",
+                              drain_timeout=5.0)
+    reader.initialize()
+    try:
+        assert wait_for(lambda: connection.pubsub_numpat() > 0)
+        for i in range(3):
+            connection.publish("images", generate_image(8, 8, seed=i))
+        assert wait_for(lambda: reader.queue_depth == 3)
+        request_shutdown()
+        # no longer accepting new images
+        items = list(reader.read())
+        connection.publish("images", generate_image(8, 8, seed=10))
+        while not reader.has_finished():
+            items.extend(reader.read())
+        assert len(items) == 3
+    finally:
+        reader.finalize()
+
+
+def test_filter_stops_without_drain_sources(echo_model):
+    flt = ImageClassificationRedisPredict(channel_out="images", channel_in="predictions", timeout=1.0,
+                                          drain_timeout=5.0)
+    flt.initialize()
+    try:
+        item = ImageClassificationData(image_name="a.png", data=generate_image(8, 8))
+        assert flt.process(item) is not None
+        request_shutdown()
+        assert flt.process(item) == []
+        assert echo_model.num_requests == 1
+    finally:
+        flt.finalize()
+
+
+class _InterruptingConnection:
+    """
+    Raises KeyboardInterrupt after publishing, i.e., while waiting for the prediction.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def publish(self, channel, data):
+        self.connection.publish(channel, data)
+        raise KeyboardInterrupt()
+
+    def __getattr__(self, item):
+        return getattr(self.connection, item)
+
+
+def test_outstanding_prediction_gets_journaled(echo_model, tmp_path):
+    journal = "sqlite:" + str(tmp_path / "journal.db")
+    item = ImageClassificationData(image_name="a.png", data=generate_image(8, 8))
+    flt = ImageClassificationRedisPredict(channel_out="images", channel_in="predictions", timeout=1.0,
+                                          journal=journal, drain_timeout=2.0)
+    flt.initialize()
+    session = flt._redis_session
+    session.connection = _InterruptingConnection(session.connection)
+    echo_model.delay = 0.1
+    try:
+        flt.process(item)
+        assert False, "not interrupted"
+    except KeyboardInterrupt:
+        pass
+    assert flt._outstanding is not None
+    flt.finalize()
+
+    # resuming serves the prediction from the journal
+    flt = ImageClassificationRedisPredict(channel_out="images", channel_in="predictions", timeout=1.0,
+                                          journal=journal)
+    flt.initialize()
+    try:
+        assert flt.process(item).get_annotation() == image_label(item.data)
+        assert echo_model.num_requests == 1
+    finally:
+        flt.finalize()
@@ -0,0 +1,50 @@
+import logging
+
+from idc.redis.api import StatsReporter, STAGE_PUBLISH
+
+
+def _reporter(name, path, logger=None):
+    return StatsReporter(name, logger or logging.getLogger(name), export="prometheus:" + str(path))
+
+
+def test_shared_prometheus_file(tmp_path):
+    path = tmp_path / "metrics.prom"
+    r1 = _reporter("redis-predict-ic", path)
+    r2 = _reporter("redis-image-listen", path)
+    r3 = _reporter("redis-predict-ic", path)
+    for r in [r1, r2, r3]:
+        r.add(STAGE_PUBLISH, 0.001)
+        r.item_done()
+        r.report()
+    text = path.read_text()
+    assert 'idc_redis_items_total{plugin="redis-predict-ic"} 1' in text
+    assert 'idc_redis_items_total{plugin="redis-image-listen"} 1' in text
+    assert 'idc_redis_items_total{plugin="redis-predict-ic-2"} 1' in text
+    assert text.count("# TYPE idc_redis_stage_seconds histogram") == 1
+    for r in [r1, r2, r3]:
+        r.close()
+
+
+def test_close_removes_plugin(tmp_path):
+    path = tmp_path / "metrics.prom"
+    r1 = _reporter("a", path)
+    r2 = _reporter("b", path)
+    r1.report()
+    r2.close()
+    r1.report()
+    text = path.read_text()
+    assert 'plugin="a"' in text
+    assert 'plugin="b"' not in text
+    r1.close()
+
+
+def test_report_at_info_level(caplog):
+    logger = logging.getLogger("test-stats")
+    r = StatsReporter("test", logger)
+    r.add(STAGE_PUBLISH, 0.001)
+    r.item_done()
+    with caplog.at_level(logging.INFO, logger="test-stats"):
+        r.close()
+    records = [x for x in caplog.records if "publish" in x.getMessage()]
+    assert len(records) == 1
+    assert records[0].levelno == logging.INFO